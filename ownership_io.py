@@ -0,0 +1,158 @@
+#! /usr/bin/env python3
+# ownership_io.py
+# Moves has_relic in and out of per-player inventory files like
+# exported_sooby_relics.tsv:
+#   player, era, minor, quantity, refinement name
+# Tab-separated, or comma-separated if the file ends in .csv.
+
+import csv, os, sys
+
+refinement_codes = {
+    "Intact": "0",
+    "Exceptional": "1",
+    "Flawless": "2",
+    "Radiant": "3",
+}
+refinement_names = {code: name for (name, code) in refinement_codes.items()}
+
+batch_size = 5000# rows per executemany / fetchmany
+
+def dialect_for(path):
+    return "excel" if str(path).lower().endswith(".csv") else "excel-tab"
+
+def refinement_code(s):
+    # "Intact", "intact" and "0" all mean the same thing
+    if s in refinement_names:
+        return s
+    for (name, code) in refinement_codes.items():
+        if s.lower() == name.lower():
+            return code
+    raise ValueError("unknown refinement {}".format(s))
+
+def parse_rows(infile, dialect="excel-tab", known_relics=None):
+    """Yields (line number, row or None, problem or None) for each line.
+
+    Rows come out as (player, era, minor, refinement code, quantity),
+    which is has_relic's column order in relic.db.
+    """
+    for (n, fields) in enumerate(csv.reader(infile, dialect), 1):
+        if len(fields) == 0 or all(f.strip() == "" for f in fields):
+            continue
+        if len(fields) != 5:
+            yield (n, None, "expected 5 fields, got {}".format(len(fields)))
+            continue
+        (player, era, minor, quantity, refinement) = [f.strip() for f in fields]
+        era = era.capitalize()
+        minor = minor.upper()
+        try:
+            quantity = int(quantity)
+            if quantity < 0:
+                raise ValueError("negative quantity {}".format(quantity))
+            refinement = refinement_code(refinement)
+        except ValueError as ve:
+            yield (n, None, str(ve))
+            continue
+        if player == "":
+            yield (n, None, "empty player name")
+            continue
+        if known_relics is not None and (era, minor) not in known_relics:
+            yield (n, None, "unknown relic {} {}".format(era, minor))
+            continue
+        yield (n, (player, era, minor, refinement, quantity), None)
+
+def import_files(paths, db_connection, replace=False):
+    """Loads inventory files into has_relic in one transaction.
+
+    Existing rows are upserted; replace=True first clears every player
+    that shows up in the files. If any line is bad nothing is written
+    and a ValueError lists every problem.
+    """
+    known_relics = set(db_connection.execute("select era, minor from relic"))
+    problems = []
+    players = set()
+    loaded = 0
+    with db_connection:# one transaction for the lot, rolled back on error
+        for path in paths:
+            with open(path, newline="") as infile:
+                batch = []
+                for (n, row, problem) in parse_rows(
+                        infile, dialect_for(path), known_relics):
+                    if problem is not None:
+                        problems.append("{}:{}: {}".format(path, n, problem))
+                        continue
+                    if row[0] not in players:
+                        players.add(row[0])
+                        if replace:
+                            db_connection.execute(
+                                "delete from has_relic where player == ?",
+                                (row[0],))
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        loaded += write_batch(db_connection, batch)
+                        batch = []
+                loaded += write_batch(db_connection, batch)
+        if len(problems) > 0:
+            raise ValueError("{} bad line(s), nothing imported:\n{}".format(
+                len(problems), "\n".join(problems)))
+    return {"rows": loaded, "players": len(players)}
+
+def write_batch(db_connection, batch):
+    db_connection.executemany(
+        """insert into has_relic (player, era, minor, refinement, quantity)
+        values (?, ?, ?, ?, ?)
+        on conflict (player, era, minor, refinement)
+        do update set quantity = excluded.quantity;""",
+        batch
+    )
+    return len(batch)
+
+def export_rows(db_connection, players=None):
+    """Yields has_relic rows in file order, fetchmany at a time."""
+    query = """select player, era, minor, quantity, refinement
+        from has_relic {}
+        order by player,
+            case era when 'Lith' then 0 when 'Meso' then 1
+                when 'Neo' then 2 when 'Axi' then 3 else 4 end,
+            era, minor, refinement"""
+    if players is None:
+        cur = db_connection.execute(query.format(""))
+    else:
+        players = list(players)
+        cur = db_connection.execute(
+            query.format("where player in ({})".format(
+                ", ".join("?" for p in players))),
+            players)
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+        for (player, era, minor, quantity, refinement) in rows:
+            yield (player, era, minor, quantity,
+                refinement_names.get(str(refinement), refinement))
+
+def export_file(path, db_connection, players=None):
+    """Writes has_relic (or just some players) to path; "-" is stdout."""
+    n = 0
+    if path == "-":
+        outfile = sys.stdout
+    else:
+        outfile = open(path, "w", newline="")
+    try:
+        writer = csv.writer(outfile, dialect_for(path))
+        for row in export_rows(db_connection, players):
+            writer.writerow(row)
+            n += 1
+    finally:
+        if outfile is not sys.stdout:
+            outfile.close()
+    return n
+
+def export_players(directory, db_connection, pattern="exported_{}_relics.tsv"):
+    """One file per player, named like exported_sooby_relics.tsv."""
+    players = [r[0] for r in db_connection.execute(
+        "select distinct player from has_relic order by player")]
+    written = {}
+    for player in players:
+        path = os.path.join(directory, pattern.format(player))
+        written[path] = export_file(path, db_connection, [player])
+    return written
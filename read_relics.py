@@ -9,10 +9,24 @@
 
 # The rest is unique data such as relic tier and vaultedness.
 
+import gzip, hashlib, io, lzma, os, pickle, sys, tempfile
+from array import array
+import relic_profile
+
 source_table = "from_wiki_20190403.txt"
 
 debug = False
 
+# Parsed registries get snapshotted next to the dump they came from
+# so later runs don't have to re-parse it.
+use_cache = os.environ.get("WFRELIC_NO_CACHE", "") in ("", "0")
+cache_suffix = ".regcache"
+cache_version = 1# bump whenever the snapshot layout changes
+
+# read_relics(workers=N) only bothers with a process pool past this,
+# below it starting the workers costs more than the parse
+parallel_min_bytes = 4 << 20
+
 def debug_msg(*args, **kwargs):
     if debug:
         print(*args,**kwargs)
@@ -122,7 +136,180 @@ class Registry:
         relic.register_reward(part, rarity)
         part.register_relic(relic, rarity)
 
-        
+    def records(self):
+        """Flattens the registry back out into the records it was built from."""
+        for relic in self.relics.values():
+            for rarity in ["Common", "Uncommon", "Rare"]:
+                # sets don't keep an order, so sort for repeatable output
+                for part in sorted(relic.rewards[rarity],
+                        key=lambda p: p.full_name()):
+                    yield (
+                        part.prime_obj.name, part.role,
+                        relic.name, rarity, relic.vaulted
+                    )
+
+
+# Compact registry mode
+# Same attributes as above, but the objects are __slots__ only, the
+# strings are interned, and which part drops from which relic lives in
+# three parallel arrays on the registry instead of per-object sets and
+# dicts. relic.rewards and part.relics are rebuilt on access.
+
+rarities = ["Common", "Uncommon", "Rare"]
+rarity_ids = {r: i for (i, r) in enumerate(rarities)}
+
+class CompactRelic:
+    __slots__ = ("registry", "id", "name", "era", "minor_name", "vaulted")
+    def __init__(self, registry, relic_id, name, vaulted = 0):
+        self.registry = registry
+        self.id = relic_id
+        self.name = sys.intern(name)
+        (era, minor_name) = name.split(" ")
+        self.era = sys.intern(era)
+        self.minor_name = sys.intern(minor_name)
+        self.vaulted = vaulted
+    @property
+    def rewards(self):
+        reg = self.registry
+        rewards = {r: set() for r in rarities}
+        for row in reg.reward_rows("relic", self.id):
+            rewards[rarities[reg.reward_rarity[row]]].add(
+                reg.part_list[reg.reward_part[row]])
+        return rewards
+    def register_reward(self, reward_obj, rarity):
+        self.registry.add_reward_row(self.id, reward_obj.id, rarity_ids[rarity])
+    serialize_helper = Relic.serialize_helper
+    full_serialize = Relic.full_serialize
+    pretty_print = Relic.pretty_print
+
+class CompactPrime:
+    __slots__ = ("registry", "id", "name")
+    def __init__(self, registry, prime_id, name):
+        self.registry = registry
+        self.id = prime_id
+        self.name = sys.intern(name)
+    @property
+    def parts(self):
+        reg = self.registry
+        return {
+            reg.part_list[p].full_name(): reg.part_list[p]
+            for p in reg.prime_part_ids(self.id)
+        }
+    def register_part(self, part):
+        pass# part.prime_obj already says so
+
+class CompactPart:
+    __slots__ = ("registry", "id", "role", "prime_obj")
+    def __init__(self, registry, part_id, role, prime_obj):
+        self.registry = registry
+        self.id = part_id
+        self.role = sys.intern(role)
+        self.prime_obj = prime_obj
+    @property
+    def relics(self):
+        reg = self.registry
+        relics = {}
+        for row in reg.reward_rows("part", self.id):
+            relic = reg.relic_list[reg.reward_relic[row]]
+            relics[relic.name] = (relic, rarities[reg.reward_rarity[row]])
+        return relics
+    def register_relic(self, relic, rarity):
+        pass# the reward row added by relic.register_reward covers both ends
+    def full_name(self):
+        return self.prime_obj.name + " " + self.role
+
+class CompactRegistry(Registry):
+    def __init__(self):
+        Registry.__init__(self)
+        # ids are positions in these lists
+        self.relic_list = []
+        self.prime_list = []
+        self.part_list = []
+        # one row per distinct (relic, part, rarity)
+        self.reward_relic = array("I")
+        self.reward_part = array("I")
+        self.reward_rarity = array("B")
+        self._seen = set()# packed rows, only kept while registering
+        self._index = {}# "relic"/"part"/"prime" -> (offsets, order)
+
+    def register_reward(self, prime_s, part_s, relic_s, rarity, vaulted):
+        """For sanity: only inputs strings, not objects."""
+        full_part_s = prime_s + " " + part_s# for indexing only
+
+        relic = self.relics.get(relic_s)
+        if relic is None:
+            relic = CompactRelic(self, len(self.relic_list), relic_s, vaulted)
+            self.relic_list.append(relic)
+            self.relics[relic.name] = relic
+
+        prime = self.primes.get(prime_s)
+        if prime is None:
+            prime = CompactPrime(self, len(self.prime_list), prime_s)
+            self.prime_list.append(prime)
+            self.primes[prime.name] = prime
+
+        part = self.parts.get(full_part_s)
+        if part is None:
+            part = CompactPart(self, len(self.part_list), part_s, prime)
+            self.part_list.append(part)
+            self.parts[sys.intern(full_part_s)] = part
+            self._index.pop("prime", None)
+
+        relic.register_reward(part, rarity)
+
+    def add_reward_row(self, relic_id, part_id, rarity_id):
+        if self._seen is None:# dropped by an earlier index build
+            self._seen = {
+                (r << 34) | (p << 2) | y for (r, p, y) in zip(
+                    self.reward_relic, self.reward_part, self.reward_rarity)
+            }
+        key = (relic_id << 34) | (part_id << 2) | rarity_id
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        self.reward_relic.append(relic_id)
+        self.reward_part.append(part_id)
+        self.reward_rarity.append(rarity_id)
+        self._index.pop("relic", None)
+        self._index.pop("part", None)
+
+    def _build_index(self, keys, n_ids):
+        # CSR style: order lists row numbers grouped by key,
+        # rows for key k are order[offsets[k]:offsets[k + 1]]
+        # (stable sort, so registration order is kept inside a group)
+        order = array("I", sorted(range(len(keys)), key=keys.__getitem__))
+        offsets = array("I", [0] * (n_ids + 1))
+        for k in keys:
+            offsets[k + 1] += 1
+        for i in range(n_ids):
+            offsets[i + 1] += offsets[i]
+        self._seen = None# the arrays are the source of truth from here on
+        return (offsets, order)
+
+    def reward_rows(self, kind, key_id):
+        """Row numbers (or part ids, for kind "prime") belonging to key_id."""
+        if kind not in self._index:
+            if kind == "relic":
+                idx = self._build_index(self.reward_relic, len(self.relic_list))
+            elif kind == "part":
+                idx = self._build_index(self.reward_part, len(self.part_list))
+            else:
+                idx = self._build_index(
+                    array("I", [p.prime_obj.id for p in self.part_list]),
+                    len(self.prime_list))
+            self._index[kind] = idx
+        (offsets, order) = self._index[kind]
+        return order[offsets[key_id]:offsets[key_id + 1]]
+
+    def prime_part_ids(self, prime_id):
+        return self.reward_rows("prime", prime_id)
+
+    def build_indexes(self):
+        # optional, lookups build these on first use anyway
+        if self.relic_list:
+            for kind in ["relic", "part", "prime"]:
+                self.reward_rows(kind, 0)
+
 def parse_line(line):
     prime_s = None
     part_s = None
@@ -176,15 +363,36 @@ def parse_line(line):
     
     return (prime_s, part_s, relic_s, rarity, vaulted)
 
-def read_relics(input_file):
-    x = []
-    with open(input_file) as infile:
-        x = infile.read().split("\n")
-    reward_registry = Registry()
-    prime_s = None
-    part_s = None
+def open_source(input_file):
+    """Open a dump as text, decompressing gzip/xz inputs on the fly."""
+    with open(input_file, "rb") as probe:
+        magic = probe.read(6)
+    if magic[:2] == b"\x1f\x8b":
+        return gzip.open(input_file, "rt")
+    elif magic == b"\xfd7zXZ\x00":
+        return lzma.open(input_file, "rt")
+    return open(input_file)
+
+def iter_lines(input_file):
+    # one line at a time, so a huge dump never sits in memory
+    with open_source(input_file) as infile:
+        for line in infile:
+            yield line
+
+def is_image_line(line):
+    # the prime block markers, i.e. "MirageAkboltoPrime"
+    # (parse_line skips these along with blank lines)
+    lsp = line.strip().split(" \t")
+    return len(lsp) == 1 and lsp[0] != "" and len(lsp[0].split(" ")) < 3
+
+def iter_records(lines, prime_s=None, part_s=None):
+    """Yields (prime, part, relic, rarity, vaulted) for each reward line.
+
+    prime_s and part_s are where to pick up from when lines starts
+    partway through a dump.
+    """
     # prime_s and part_s are the only things that can be missing from a line
-    for line in x:
+    for line in lines:
         parsed = parse_line(line)
         # Unpacking time
         # Error conditions
@@ -199,16 +407,222 @@ def read_relics(input_file):
             prime_s = parsed[0]
         if parsed[1] != None:# Normal for it not to include a part
             part_s = parsed[1]
-        
-        relic_s = parsed[2]
-        rarity = parsed[3]
-        vaulted = parsed[4]
-        
+
+        yield (prime_s, part_s, parsed[2], parsed[3], parsed[4])
+
+def build_registry(records, reward_registry=None):
+    if reward_registry is None:
+        reward_registry = Registry()
+    for (prime_s, part_s, relic_s, rarity, vaulted) in records:
         reward_registry.register_reward(
             prime_s, part_s, relic_s, rarity, vaulted
         )
     return reward_registry
 
+def new_registry(compact=False):
+    return CompactRegistry() if compact else Registry()
+
+def read_relics(input_file, streaming=True, compact=False, workers=1):
+    if workers != 1:
+        return read_relics_parallel(input_file, workers, compact)
+    if streaming:
+        records = iter_records(iter_lines(input_file))
+        if relic_profile.enabled:
+            # parse and build interleave when streaming, so pull the
+            # records out first to time them apart (profiling only)
+            with relic_profile.phase("parse"):
+                records = list(records)
+        with relic_profile.phase("registry build"):
+            return build_registry(records, new_registry(compact))
+    # old path: slurp the whole file and split it up front
+    # kept around so the benchmark has something to compare against
+    x = []
+    with open_source(input_file) as infile:
+        x = infile.read().split("\n")
+    return build_registry(iter_records(x), new_registry(compact))
+
+# Parallel parsing
+# prime_s and part_s carry over from line to line, but every prime block
+# starts at an image line, so the file is cut just before image lines
+# into byte ranges and each worker parses its own range. A worker can't
+# know the prime/part in effect where its range starts; records from
+# before its first prime/part line come back with None there, and get
+# filled in from the end of the previous range while merging. The merge
+# then registers every record in file order, so the Registry is the
+# same one read_relics would have built.
+
+def split_points(input_file, n_chunks):
+    """Byte offsets of about n_chunks ranges, each starting at an image
+    line (or the start of the file)."""
+    size = os.path.getsize(input_file)
+    points = [0]
+    with open(input_file, "rb") as infile:
+        for i in range(1, n_chunks):
+            infile.seek(max(size * i // n_chunks, points[-1]))
+            infile.readline()# the rest of whatever line we landed in
+            while True:
+                pos = infile.tell()
+                line = infile.readline()
+                if line == b"" or is_image_line(line.decode("utf-8", "replace")):
+                    break
+            if points[-1] < pos < size:
+                points.append(pos)
+    points.append(size)
+    return points
+
+def parse_range(input_file, start, end):
+    """The records in input_file[start:end], prime/part None until the
+    range sets them itself."""
+    with open(input_file, "rb") as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+    # same newline handling as reading the file with open()
+    lines = io.TextIOWrapper(io.BytesIO(data))
+    # interned, so repeats pickle as one string on the way back
+    intern = sys.intern
+    return [
+        (p and intern(p), q and intern(q), intern(relic_s), intern(rarity), v)
+        for (p, q, relic_s, rarity, v) in iter_records(lines)
+    ]
+
+def read_relics_parallel(input_file, workers=None, compact=False):
+    """read_relics over a process pool; workers=None is one per CPU.
+
+    Compressed dumps can't be cut into byte ranges, and small ones
+    aren't worth it, so those are parsed sequentially.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    with open(input_file, "rb") as probe:
+        magic = probe.read(6)
+    if workers <= 1 or magic[:2] == b"\x1f\x8b" or magic == b"\xfd7zXZ\x00" \
+            or os.path.getsize(input_file) < parallel_min_bytes:
+        return read_relics(input_file, compact=compact)
+    from concurrent.futures import ProcessPoolExecutor
+    points = split_points(input_file, workers * 4)# a few each, to even out
+    with relic_profile.phase("parse"):
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(pool.map(parse_range,
+                [input_file] * (len(points) - 1), points[:-1], points[1:]))
+    with relic_profile.phase("registry build"):
+        reg = new_registry(compact)
+        prime_s = None
+        part_s = None
+        for records in chunks:
+            for (p, q, relic_s, rarity, vaulted) in records:
+                if p is None:
+                    p = prime_s
+                if q is None:
+                    q = part_s
+                reg.register_reward(p, q, relic_s, rarity, vaulted)
+                (prime_s, part_s) = (p, q)
+    return reg
+
+def source_fingerprint(input_file, with_hash=True):
+    st = os.stat(input_file)
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": None}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(input_file, "rb") as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b""):
+                h.update(chunk)
+        fp["sha256"] = h.hexdigest()
+    return fp
+
+def load_snapshot(input_file, compact=False):
+    """Returns the cached Registry for input_file, or None if it's stale."""
+    cache_file = input_file + cache_suffix
+    try:
+        with open(cache_file, "rb") as infile:
+            header = pickle.load(infile)
+            if header.get("version") != cache_version:
+                debug_msg("snapshot has version {}, want {}".format(
+                    header.get("version"), cache_version))
+                return None
+            fp = source_fingerprint(input_file, with_hash=False)
+            touched = (fp["size"], fp["mtime_ns"]) != \
+                (header["size"], header["mtime_ns"])
+            if touched:
+                # touched or rewritten; only the content hash can save it
+                if fp["size"] != header["size"]:
+                    return None
+                fp = source_fingerprint(input_file)
+                if fp["sha256"] != header["sha256"]:
+                    return None
+            records = pickle.load(infile)
+    except FileNotFoundError:
+        return None
+    except Exception as e:# truncated, corrupt, from some other version...
+        debug_msg("ignoring unreadable snapshot {}: {}".format(cache_file, e))
+        return None
+    if touched:
+        # same content, new mtime: record it, or every later load would
+        # hash the whole dump again
+        try:
+            _write_snapshot(input_file, fp, records)
+        except OSError as e:
+            debug_msg("couldn't refresh snapshot: {}".format(e))
+    return build_registry(records, new_registry(compact))
+
+def save_snapshot(input_file, registry, fingerprint=None):
+    """Snapshots registry as the parse of input_file. fingerprint is
+    source_fingerprint() from before the parse; if the file has changed
+    since, registry may not be what it holds now, so nothing is saved.
+    Returns whether it was."""
+    if fingerprint is None:
+        fingerprint = source_fingerprint(input_file)
+    return _write_snapshot(input_file, fingerprint, list(registry.records()))
+
+def _write_snapshot(input_file, fingerprint, records):
+    cache_file = input_file + cache_suffix
+    now = source_fingerprint(input_file, with_hash=False)
+    if (now["size"], now["mtime_ns"]) != \
+            (fingerprint["size"], fingerprint["mtime_ns"]):
+        debug_msg("{} changed while it was read, not snapshotting it".format(
+            input_file))
+        return False
+    header = dict(fingerprint, version=cache_version)
+    # write a temp file and rename it over, so a reader never
+    # sees half a snapshot
+    (fd, tmp_name) = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(cache_file)),
+        prefix=os.path.basename(cache_file) + ".")
+    try:
+        with os.fdopen(fd, "wb") as outfile:
+            pickle.dump(header, outfile, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(records, outfile, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, cache_file)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    return True
+
+def load_registry(input_file=source_table, cached=None, compact=False):
+    """read_relics, but through the on-disk snapshot when it's still fresh.
+
+    cached=False (or WFRELIC_NO_CACHE=1) always re-parses and leaves the
+    snapshot alone. compact=True builds a CompactRegistry instead.
+    """
+    if cached is None:
+        cached = use_cache
+    if not cached:
+        return read_relics(input_file, compact=compact)
+    with relic_profile.phase("snapshot load"):
+        reg = load_snapshot(input_file, compact)
+    if reg is not None:
+        debug_msg("using snapshot for {}".format(input_file))
+        return reg
+    # fingerprinted before parsing, so a rewrite during the parse can't
+    # get the new file's fingerprint onto the old file's records
+    fingerprint = source_fingerprint(input_file)
+    reg = read_relics(input_file, compact=compact)
+    try:
+        with relic_profile.phase("snapshot save"):
+            save_snapshot(input_file, reg, fingerprint)
+    except OSError as e:# read-only checkout or similar; not fatal
+        debug_msg("couldn't save snapshot: {}".format(e))
+    return reg
+
 if __name__ == "__main__":
     import random
     master_registry = mr = read_relics(source_table)
@@ -0,0 +1,331 @@
+#! /usr/bin/env python3
+# relic_api.py
+# A small local HTTP/JSON service over the relic database.
+#
+#   GET  /players                      player names
+#   GET  /players/{player}/inventory   what they hold
+#   POST /players/{player}/inventory   upsert holdings, a JSON list of
+#                                      {"era", "minor", "refinement", "quantity"}
+#   GET  /relics                       every relic and whether it's vaulted
+#   GET  /relics/{era}/{minor}         one relic and its rewards
+#   GET  /parts/{base}/{role}          relics dropping a part, and who has them
+#   GET  /stats                        cache and request counters
+#
+# HTTP is handled on one asyncio loop (keep-alive, Content-Length
+# bodies only). Everything that touches SQLite runs on a thread pool no
+# bigger than the connection pool, so the loop never waits on the disk.
+#
+# GET responses are kept, already encoded, until the database changes:
+# the token is relic_cache's data_version/total_changes/user_version
+# check, so a hit costs one pragma. The same token is the ETag, and a
+# request whose If-None-Match still matches gets a bare 304 (once the
+# path is known to exist).
+
+import asyncio, json, threading, time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+import ownership_io, relic_db, relic_history
+
+max_body = 1 << 20# bytes, for POSTs
+max_cached = 1024# encoded GET responses kept
+idle_timeout = 30.0# seconds a keep-alive connection may sit unused
+
+reasons = {200: "OK", 304: "Not Modified", 400: "Bad Request",
+    404: "Not Found", 405: "Method Not Allowed", 411: "Length Required",
+    413: "Payload Too Large", 500: "Internal Server Error"}
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Api:
+    """The request handlers. handle() blocks, so call it off the loop."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.cache = pool.cache()
+        self._responses = OrderedDict()# path -> (token, body), LRU first
+        # handle() runs on the executor's threads, so _responses and the
+        # counters are only touched under the lock
+        self._lock = threading.Lock()
+        self._boot = "{:x}".format(int(time.time() * 1000))
+        self.requests = 0
+        self.not_modified = 0
+        self.cached = 0
+
+    def token(self):
+        # data_version only means something to this process's probe, so
+        # the boot time keeps ETags from an earlier run from matching
+        (data_version, changes, generation) = self.cache.version()
+        return "{}-{}-{}-{}".format(self._boot, generation, data_version, changes)
+
+    def handle(self, method, target, headers, body):
+        """(status, etag or None, body bytes) for one request."""
+        with self._lock:
+            self.requests += 1
+        path = urlsplit(target).path
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        try:
+            if method == "POST":
+                if len(parts) == 3 and parts[0] == "players" and parts[2] == "inventory":
+                    return (200, None, encode(self.upsert(parts[1], body)))
+                raise ApiError(405, "only GET here")
+            if method not in ("GET", "HEAD"):
+                raise ApiError(405, "GET or POST only")
+            if path == "/stats":
+                return (200, None, encode(self.stats()))
+            token = self.token()
+            etag = '"{}"'.format(token)
+            with self._lock:
+                entry = self._responses.get(path)
+                if entry is not None and entry[0] == token:
+                    self._responses.move_to_end(path)
+                    self.cached += 1
+                    data = entry[1]
+                else:
+                    data = None
+            if data is None:
+                # routed before any 304, so a path that doesn't exist is
+                # a 404 whatever ETag it was sent with
+                data = encode(self.route(parts))
+                with self._lock:
+                    self._responses[path] = (token, data)
+                    self._responses.move_to_end(path)
+                    while len(self._responses) > max_cached:
+                        self._responses.popitem(last=False)
+            if headers.get("if-none-match") == etag:
+                with self._lock:
+                    self.not_modified += 1
+                return (304, etag, b"")
+            return (200, etag, data)
+        except ApiError as e:
+            return (e.status, None, encode({"error": str(e)}))
+
+    def route(self, parts):
+        if parts == ["players"]:
+            return [r[0] for r in self.cache.query(
+                "select distinct player from has_relic order by player")]
+        if len(parts) == 3 and parts[0] == "players" and parts[2] == "inventory":
+            return self.inventory(parts[1])
+        if parts == ["relics"]:
+            return [{"era": era, "minor": minor, "vaulted": bool(vaulted)}
+                for (era, minor, vaulted) in self.cache.query(
+                    "select era, minor, vaulted from relic order by era, minor",
+                    catalog=True)]
+        if len(parts) == 3 and parts[0] == "relics":
+            return self.relic(parts[1], parts[2])
+        if len(parts) == 3 and parts[0] == "parts":
+            return self.part(parts[1], parts[2])
+        raise ApiError(404, "no such resource")
+
+    def inventory(self, player):
+        with self.pool.read() as con:
+            rows = con.execute(
+                """select era, minor, refinement, quantity from has_relic
+                where player = ? and quantity > 0
+                order by era, minor, refinement""",
+                (player,)).fetchall()
+        if len(rows) == 0:
+            raise ApiError(404, "no relics for {}".format(player))
+        return [{"era": era, "minor": minor,
+            "refinement": ownership_io.refinement_names.get(refinement, refinement),
+            "quantity": quantity} for (era, minor, refinement, quantity) in rows]
+
+    def relic(self, era, minor):
+        with self.pool.read() as con:
+            row = con.execute(
+                "select vaulted from relic where era = ? and minor = ?",
+                (era, minor)).fetchone()
+            if row is None:
+                raise ApiError(404, "no relic {} {}".format(era, minor))
+            rewards = con.execute(
+                """select base, role, rarity from reward
+                where era = ? and minor = ? order by rarity, base, role""",
+                (era, minor)).fetchall()
+        return {"era": era, "minor": minor, "vaulted": bool(row[0]),
+            "rewards": [{"base": base, "role": role, "rarity": rarity}
+                for (base, role, rarity) in rewards]}
+
+    def part(self, base, role):
+        with self.pool.read() as con:
+            if con.execute("select count(*) from part where base = ? and role = ?",
+                    (base, role)).fetchone()[0] == 0:
+                raise ApiError(404, "no part {} {}".format(base, role))
+            drops = con.execute(
+                """select reward.era, reward.minor, reward.rarity, relic.vaulted
+                from reward join relic
+                    on relic.era = reward.era and relic.minor = reward.minor
+                where reward.base = ? and reward.role = ?
+                order by relic.vaulted, reward.rarity, reward.era, reward.minor""",
+                (base, role)).fetchall()
+            owners = con.execute(relic_db.report_queries["part_owners"],
+                {"base": base, "role": role}).fetchall()
+        return {"base": base, "role": role,
+            "drops": [{"era": era, "minor": minor, "rarity": rarity,
+                "vaulted": bool(vaulted)} for (era, minor, rarity, vaulted) in drops],
+            "owners": [{"era": era, "minor": minor, "player": player,
+                "refinement": ownership_io.refinement_names.get(refinement, refinement),
+                "quantity": quantity}
+                for (era, minor, rarity, player, refinement, quantity) in owners]}
+
+    def upsert(self, player, body):
+        try:
+            items = json.loads(body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError):
+            raise ApiError(400, "body isn't JSON")
+        if isinstance(items, dict):
+            items = [items]
+        if not isinstance(items, list) or len(items) == 0:
+            raise ApiError(400, "expected a list of holdings")
+        known = self.cache.get(("known relic keys",),
+            lambda: frozenset(self.cache.probe.execute(
+                "select era, minor from relic")),
+            catalog=True)
+        rows = []
+        for (n, item) in enumerate(items):
+            try:
+                (era, minor) = (item["era"], item["minor"])
+                refinement = ownership_io.refinement_code(
+                    str(item.get("refinement", "Intact")))
+                quantity = item["quantity"]
+            except (KeyError, TypeError, ValueError) as e:
+                raise ApiError(400, "item {}: {}".format(n, e))
+            if not isinstance(era, str) or not isinstance(minor, str):
+                raise ApiError(400, "item {}: era and minor must be strings".format(n))
+            if (era, minor) not in known:
+                raise ApiError(400, "item {}: unknown relic {} {}".format(n, era, minor))
+            # n.b. JSON true/false come back as bool, an int subclass
+            if not isinstance(quantity, int) or isinstance(quantity, bool) \
+                    or quantity < 0:
+                raise ApiError(400, "item {}: bad quantity".format(n))
+            rows.append((player, era, minor, refinement, quantity))
+        with self.pool.write() as con:
+            written = ownership_io.write_batch(con, rows)
+            relic_history.maybe_snapshot(con.cursor())
+        return {"player": player, "written": written}
+
+    def stats(self):
+        with self._lock:
+            counts = {"requests": self.requests,
+                "not_modified": self.not_modified,
+                "response_cache_hits": self.cached,
+                "responses_cached": len(self._responses)}
+        counts["cache"] = self.cache.stats()
+        return counts
+
+def encode(obj):
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+class Server:
+    def __init__(self, pool, workers=None):
+        self.api = Api(pool)
+        self.executor = ThreadPoolExecutor(workers or pool.max_readers,
+            thread_name_prefix="relic-api")
+
+    async def _read_request(self, reader):
+        # (method, target, version, headers, body), or None at EOF
+        line = await asyncio.wait_for(reader.readline(), idle_timeout)
+        if line == b"":
+            return None
+        try:
+            (method, target, version) = line.decode("latin-1").split()
+        except ValueError:
+            raise ApiError(400, "bad request line")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            (name, _, value) = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", ""):
+            raise ApiError(411, "send a Content-Length")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise ApiError(400, "bad Content-Length")
+        if length > max_body:
+            raise ApiError(413, "body over {} bytes".format(max_body))
+        body = await reader.readexactly(length) if length > 0 else b""
+        return (method, target, version, headers, body)
+
+    async def _connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                (method, keep_alive) = (None, True)
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    (method, target, version, headers, body) = request
+                    connection = headers.get("connection", "").lower()
+                    keep_alive = (connection == "keep-alive" if version == "HTTP/1.0"
+                        else connection != "close")
+                    (status, etag, data) = await loop.run_in_executor(
+                        self.executor, self.api.handle,
+                        method, target, headers, body)
+                except ApiError as e:
+                    (status, etag, data) = (e.status, None, encode({"error": str(e)}))
+                    keep_alive = False
+                except Exception as e:
+                    (status, etag, data) = (500, None, encode({"error": repr(e)}))
+                    keep_alive = False
+                head = ["HTTP/1.1 {} {}".format(status, reasons.get(status, "")),
+                    "Content-Type: application/json",
+                    "Content-Length: {}".format(len(data)),
+                    "Connection: {}".format("keep-alive" if keep_alive else "close")]
+                if etag is not None:
+                    head.append("ETag: " + etag)
+                    head.append("Cache-Control: no-cache")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, ready=None):
+        """Serves until cancelled. ready(host, port) is called once
+        listening (port 0 picks a free one)."""
+        server = await asyncio.start_server(self._connection, host, port,
+            backlog=1024)
+        (host, port) = server.sockets[0].getsockname()[:2]
+        if ready is not None:
+            ready(host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown()
+
+def run(path, host="127.0.0.1", port=8080, max_readers=8):
+    """Blocks serving path until interrupted."""
+    pool = relic_db.ConnectionPool(path, max_readers)
+    server = Server(pool)
+    try:
+        asyncio.run(server.serve(host, port, lambda h, p: print(
+            "listening on http://{}:{}/".format(h, p), flush=True)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        pool.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Relic database HTTP API")
+    parser.add_argument("--db", default="relics.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--readers", type=int, default=8,
+        help="read connections, and threads running queries")
+    args = parser.parse_args()
+    run(args.db, args.host, args.port, args.readers)
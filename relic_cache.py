@@ -0,0 +1,98 @@
+#! /usr/bin/env python3
+# relic_cache.py
+# Process-wide cache for reference data and report results.
+#
+# Entries are keyed by whatever the caller likes and loaded on a miss by
+# a callback. Before every lookup the cache asks its probe connection
+# for `pragma data_version` (bumped whenever another connection commits)
+# and its own total_changes (for writes made through the probe itself).
+# Neither reads a table, so while nothing has changed a hit costs one
+# pragma and a dict lookup.
+#
+# When something has changed:
+# - plain entries (players, reports...) are all dropped,
+# - catalog entries (eras, relic keys...) are dropped only if the
+#   catalog generation, `pragma user_version`, moved too. Whatever
+#   rewrites relic/prime/part/reward calls relic_db.bump_generation().
+#
+# Loaders should return something immutable (tuples, frozensets), since
+# every caller gets the same object back.
+
+import threading
+from collections import OrderedDict
+
+class Cache:
+    def __init__(self, probe, max_entries=256):
+        # probe: a connection to the database, used only for the checks
+        # (and by loaders called without one of their own)
+        self.probe = probe
+        self.max_entries = max_entries
+        self._entries = OrderedDict()# key -> (catalog?, value), LRU first
+        self._lock = threading.Lock()
+        self._seen = None# (data_version, total_changes) at last check
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check(self):
+        seen = (self.probe.execute("pragma data_version").fetchone()[0],
+            self.probe.total_changes)
+        if seen == self._seen:
+            return
+        self._seen = seen
+        generation = self.probe.execute("pragma user_version").fetchone()[0]
+        if generation != self._generation:
+            self._generation = generation
+            stale = list(self._entries.keys())
+        else:
+            stale = [k for (k, (catalog, v)) in self._entries.items()
+                if not catalog]
+        for key in stale:
+            del self._entries[key]
+        if len(stale) > 0:
+            self.invalidations += 1
+
+    def get(self, key, load, catalog=False):
+        """The cached value for key, or load() if it's missing or stale.
+
+        catalog=True entries only depend on the catalog tables, so they
+        outlive changes to has_relic.
+        """
+        with self._lock:
+            self._check()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            value = load()
+            self._entries[key] = (catalog, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return value
+
+    def query(self, sql, params=(), catalog=False):
+        """fetchall() of sql on the probe connection, as a tuple."""
+        key = (sql, tuple(sorted(params.items()))
+            if isinstance(params, dict) else tuple(params))
+        return self.get(key,
+            lambda: tuple(self.probe.execute(sql, params).fetchall()),
+            catalog)
+
+    def version(self):
+        """(data_version, total_changes, generation) as of now; it moves
+        whenever anything a plain entry depends on could have."""
+        with self._lock:
+            self._check()
+            return self._seen + (self._generation,)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seen = None
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits,
+            "misses": self.misses, "invalidations": self.invalidations}
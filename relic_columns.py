@@ -0,0 +1,190 @@
+#! /usr/bin/env python3
+# relic_columns.py
+# Columnar export of the catalog and has_relic for analysis code.
+#
+# Every column is one .npy file, so np.load(mmap_mode="r") maps it
+# without parsing anything. Strings are dictionary-encoded: the column
+# holds int32 codes into a sorted, fixed-width unicode array shared by
+# every column of the same kind, so reward.era and relic.era codes can
+# be compared directly. Foreign keys are also resolved once into row
+# numbers (reward.relic, reward.part, has_relic.relic), which makes
+# joins plain fancy indexing.
+#
+# Layout of an export directory:
+#   manifest.json            tables, their columns, row counts, and what
+#                            the catalog looked like when it was written
+#   dict.<kind>.npy          <U dictionary: era, minor, base, role,
+#                            rarity, refinement, player
+#   <table>.<column>.npy     one column
+#
+#   relic     era, minor (codes), vaulted (int8)
+#   prime     name (base code)
+#   part      base, role (codes)
+#   reward    era, minor, base, role, rarity (codes), relic, part (rows)
+#   has_relic player, era, minor, refinement (codes), quantity (int32),
+#             relic (row)
+#
+# e.g. what each player holds of unvaulted relics:
+#   c = relic_columns.load("cols")
+#   h = c["has_relic"]
+#   live = c["relic"]["vaulted"][h["relic"]] == 0
+#   per_player = np.bincount(h["player"][live], h["quantity"][live])
+#
+# A later export only rewrites has_relic (and the player dictionary) if
+# the catalog generation and row counts are what the manifest says.
+#
+# has_relic rows for relics the catalog no longer has (a rebuild can
+# leave them behind) have no row to point at, so they're left out and
+# counted as "orphans" in the manifest.
+
+import json, os
+import numpy as np
+
+version = 1
+catalog_columns = {
+    "relic": ("select era, minor, vaulted from relic order by era, minor",
+        ["era", "minor", "vaulted"]),
+    "prime": ("select name from prime order by name", ["name"]),
+    "part": ("select base, role from part order by base, role",
+        ["base", "role"]),
+    "reward": ("""select era, minor, base, role, rarity from reward
+        order by era, minor, rarity, base, role""",
+        ["era", "minor", "base", "role", "rarity"]),
+}
+# which dictionary each string column is coded against
+kinds = {"era": "era", "minor": "minor", "name": "base", "base": "base",
+    "role": "role", "rarity": "rarity", "player": "player",
+    "refinement": "refinement"}
+
+def _dictionary(values):
+    words = sorted(set(values))
+    width = max([len(w) for w in words] + [1])
+    return np.array(words, dtype="<U{}".format(width))
+
+def _codes(dictionary, values):
+    return _rows_of(values, dictionary.tolist())
+
+def _rows_of(keys, row_keys):
+    # position of each key in row_keys
+    index = {k: i for (i, k) in enumerate(row_keys)}
+    return np.fromiter(map(index.__getitem__, keys), np.int32, len(keys))
+
+def _save(directory, name, array):
+    # written aside and renamed, so a reader mapping the old file keeps it
+    path = os.path.join(directory, name + ".npy")
+    with open(path + ".tmp", "wb") as outfile:
+        np.save(outfile, array)
+    os.replace(path + ".tmp", path)
+
+def catalog_state(db_connection):
+    return {
+        "generation": db_connection.execute("pragma user_version").fetchone()[0],
+        "rows": {t: db_connection.execute(
+            "select count(*) from {}".format(t)).fetchone()[0]
+            for t in catalog_columns},
+    }
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, "manifest.json")) as infile:
+            manifest = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == version else None
+
+def export(db_connection, directory, full=False):
+    """Writes the columns out; returns the tables that were rewritten.
+    has_relic rows of relics not in the catalog are skipped.
+
+    Read it all in one transaction, so the catalog and has_relic agree.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    state = catalog_state(db_connection)
+    redo_catalog = full or manifest is None or manifest["catalog"] != state
+    written = []
+    if redo_catalog:
+        manifest = {"version": version, "catalog": state, "tables": {}}
+        rows = {t: db_connection.execute(sql).fetchall()
+            for (t, (sql, names)) in catalog_columns.items()}
+        values = {"era": [], "minor": [], "base": [], "role": [], "rarity": []}
+        for (t, (sql, names)) in catalog_columns.items():
+            for (i, name) in enumerate(names):
+                if name in kinds:
+                    values[kinds[name]].extend(r[i] for r in rows[t])
+        dicts = {kind: _dictionary(v) for (kind, v) in values.items()}
+        relic_keys = [(r[0], r[1]) for r in rows["relic"]]
+        part_keys = [(r[0], r[1]) for r in rows["part"]]
+        for (t, (sql, names)) in catalog_columns.items():
+            columns = {}
+            for (i, name) in enumerate(names):
+                column = [r[i] for r in rows[t]]
+                if name in kinds:
+                    columns[name] = _codes(dicts[kinds[name]], column)
+                else:
+                    columns[name] = np.array(column, dtype=np.int8)
+            if t == "reward":
+                columns["relic"] = _rows_of([(r[0], r[1]) for r in rows[t]],
+                    relic_keys)
+                columns["part"] = _rows_of([(r[2], r[3]) for r in rows[t]],
+                    part_keys)
+            for (name, array) in columns.items():
+                _save(directory, "{}.{}".format(t, name), array)
+            manifest["tables"][t] = {"rows": len(rows[t]),
+                "columns": {n: str(a.dtype) for (n, a) in columns.items()}}
+            written.append(t)
+        for (kind, d) in dicts.items():
+            _save(directory, "dict." + kind, d)
+    else:
+        dicts = {}
+        relic_keys = db_connection.execute(
+            catalog_columns["relic"][0]).fetchall()
+        relic_keys = [(era, minor) for (era, minor, vaulted) in relic_keys]
+    relic_era = np.load(os.path.join(directory, "relic.era.npy"))
+    relic_minor = np.load(os.path.join(directory, "relic.minor.npy"))
+
+    rows = db_connection.execute(
+        """select player, era, minor, refinement, quantity from has_relic
+        order by player, era, minor, refinement""").fetchall()
+    known = set(relic_keys)
+    held = [r for r in rows if (r[1], r[2]) in known]
+    (orphans, rows) = (len(rows) - len(held), held)
+    for kind in ["player", "refinement"]:
+        dicts[kind] = _dictionary(r[0 if kind == "player" else 3] for r in rows)
+        _save(directory, "dict." + kind, dicts[kind])
+    relic = _rows_of([(r[1], r[2]) for r in rows], relic_keys)
+    columns = {
+        "player": _codes(dicts["player"], [r[0] for r in rows]),
+        "era": relic_era[relic],
+        "minor": relic_minor[relic],
+        "refinement": _codes(dicts["refinement"], [r[3] for r in rows]),
+        "quantity": np.fromiter((r[4] for r in rows), np.int32, len(rows)),
+        "relic": relic,
+    }
+    for (name, array) in columns.items():
+        _save(directory, "has_relic." + name, array)
+    manifest["tables"]["has_relic"] = {"rows": len(rows), "orphans": orphans,
+        "columns": {n: str(a.dtype) for (n, a) in columns.items()}}
+    written.append("has_relic")
+    manifest["dicts"] = sorted(set(kinds.values()))
+    with open(os.path.join(directory, "manifest.json.tmp"), "w") as outfile:
+        json.dump(manifest, outfile, indent=1)
+    os.replace(os.path.join(directory, "manifest.json.tmp"),
+        os.path.join(directory, "manifest.json"))
+    return written
+
+def load(directory, mmap_mode="r"):
+    """{table: {column: array}, "dict": {kind: array}}, memory-mapped."""
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError("no columnar export in {}".format(directory))
+    path = lambda name: os.path.join(directory, name + ".npy")
+    result = {t: {c: np.load(path("{}.{}".format(t, c)), mmap_mode=mmap_mode)
+        for c in info["columns"]} for (t, info) in manifest["tables"].items()}
+    result["dict"] = {kind: np.load(path("dict." + kind), mmap_mode=mmap_mode)
+        for kind in manifest["dicts"]}
+    return result
+
+def decode(columns, table, column):
+    """A coded column turned back into its strings."""
+    return columns["dict"][kinds[column]][columns[table][column]]
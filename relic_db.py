@@ -0,0 +1,600 @@
+#! /usr/bin/env python3
+# relic_db.py
+# Schema, indexes and the standard report queries for the relic database,
+# shared by wfrelic-createdb.py, the benchmarks and anything else that
+# needs to build or query one, plus a small connection pool.
+
+import os, sqlite3, threading
+from contextlib import contextmanager
+import relic_profile
+
+# table name -> create statement, in dependency order
+tables = {
+    # relic table
+    "relic": """create table relic(
+      era char(4) not null,
+      minor char(3) not null,
+      vaulted int not null,
+      primary key (era, minor)
+    );""",
+
+    # prime table
+    # likely optional since prime part contains all known primes
+    "prime": """create table prime(
+      name char(100) primary key
+    );""",
+
+    # prime part table
+    "part": """create table part(
+      base char(100) references prime (name),
+      role char(100),
+      primary key (base, role)
+    );""",
+
+    # reward table
+    # n.b. it doesn't care about things that are in there twice
+    # so this can't naively be used to calculate probabilities
+    "reward": """create table reward(
+      era char(4) not null,
+      minor char(3) not null,
+
+      base char(100) not null,
+      role char(100) not null,
+
+      rarity char(10) not null,
+
+      foreign key (era, minor) references relic (era, minor)
+      foreign key (base, role) references part (base, role)
+
+      primary key (era, minor, base, role, rarity)
+    );""",
+
+    # who has which relic at what refinement and how many
+    "has_relic": """create table if not exists has_relic (
+          player char(100) not null,
+          era char(4) not null,
+          minor char(3) not null,
+          quantity integer not null,
+          refinement char(15) not null,
+
+          primary key (player, era, minor, refinement),
+          foreign key (era, minor) references relic (era, minor)
+      )""",
+}
+catalog_tables = ["relic", "prime", "part", "reward"]# rebuilt from the dump
+
+# The primary keys only help lookups that start with the relic
+# (reward) or the player (has_relic). These cover the other directions
+# the report queries go in; numbers behind each one are in
+# `wfrelic-bench.py queries`.
+indexes = {
+    # "which relics drop X": reward filtered on base/role, joined on relic
+    "reward_by_part":
+        "create index if not exists reward_by_part " +
+        "on reward (base, role, rarity, era, minor)",
+    # "who owns relic X": has_relic joined on (era, minor) from reward/relic
+    "has_relic_by_relic":
+        "create index if not exists has_relic_by_relic " +
+        "on has_relic (era, minor, player, refinement, quantity)",
+}
+# no longer worth keeping, dropped wherever the indexes are (re)made.
+# has_relic_by_player only saved the primary key's trip back to the
+# table for quantity (inventory 0.16 -> 0.13 ms at 5000 players), for a
+# second copy of has_relic to write on every change.
+retired_indexes = ["has_relic_by_player"]
+
+def create_tables(db_cursor, names=None):
+    for name in (names or tables.keys()):
+        db_cursor.execute(tables[name])
+
+def create_indexes(db_cursor):
+    for name in retired_indexes:
+        db_cursor.execute("drop index if exists {}".format(name))
+    for statement in indexes.values():
+        db_cursor.execute(statement)
+    db_cursor.execute("analyze")
+
+def drop_indexes(db_cursor):
+    for name in list(indexes.keys()) + retired_indexes:
+        db_cursor.execute("drop index if exists {}".format(name))
+
+def catalog_rows(registry, table):
+    """Rows for one catalog table, straight from a Registry."""
+    if table == "relic":
+        # (era, minor, vaulted)
+        return [
+            (r.era, r.minor_name, r.vaulted) for r in registry.relics.values()
+        ]
+    elif table == "prime":
+        # (name)
+        return [(k,) for k in registry.primes.keys()]
+    elif table == "part":
+        # (base, role)
+        return [
+            (p.prime_obj.name, p.role) for p in registry.parts.values()
+        ]
+    elif table == "reward":
+        # (era, minor, base, role, rarity)
+        return [
+            (relic.era, relic.minor_name, part.prime_obj.name, part.role, rarity)
+            for relic in registry.relics.values()
+            for rarity in ["Common", "Uncommon", "Rare"]
+            for part in relic.rewards[rarity]
+        ]
+    raise KeyError(table)
+
+def load_catalog(db_cursor, registry):
+    with relic_profile.phase("catalog insert"):
+        for table in catalog_tables:
+            rows = catalog_rows(registry, table)
+            if len(rows) > 0:
+                db_cursor.executemany(
+                    "insert into {} values({})".format(
+                        table, ", ".join("?" for c in rows[0])),
+                    rows
+                )
+
+def bump_generation(db_cursor):
+    """Marks the catalog as changed for anything caching it (relic_cache).
+    Kept in user_version, so it commits along with the change."""
+    generation = db_cursor.execute("pragma user_version").fetchone()[0]
+    db_cursor.execute("pragma user_version = {}".format(generation + 1))
+
+def rebuild_catalog(db_cursor, registry):
+    """Drops and rebuilds relic, prime, part and reward from registry,
+    leaving has_relic alone. Returns has_relic rows whose relic is gone
+    (pragma foreign_key_check output), which should normally be none."""
+    con = db_cursor.connection
+    con.commit()# the foreign_keys pragma does nothing inside a transaction
+    # has_relic points at relic, so the checks stay off while it's replaced
+    db_cursor.execute("pragma foreign_keys = off")
+    try:
+        for t in catalog_tables:# clear tables
+            db_cursor.execute("drop table if exists {};".format(t))
+        # relic_incremental's block hashes, which no longer apply
+        db_cursor.execute("drop table if exists dump_block")
+        # relic, prime, part, reward, and has_relic if it isn't there yet
+        create_tables(db_cursor)
+        load_catalog(db_cursor, registry)
+        # indexes go on after the bulk insert, it's cheaper that way
+        with relic_profile.phase("indexes"):
+            create_indexes(db_cursor)
+        # and the part -> relics/owners lookup tables, same reason
+        with relic_profile.phase("part index"):
+            create_part_index(db_cursor)
+        bump_generation(db_cursor)
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    finally:
+        db_cursor.execute("pragma foreign_keys = on")
+    return db_cursor.execute("pragma foreign_key_check").fetchall()
+
+# Shadow rebuild: the same catalog rebuild, but into a fresh file next
+# to the database, built with bulk-load settings (no journal, no
+# fsyncs, no foreign key checks, indexes after the data), then checked
+# and copied over the live database in one step. Everything that isn't
+# catalog (has_relic, history, views...) is carried over as it was.
+#
+# The copy uses SQLite's backup API rather than renaming the file:
+# other connections keep the live file (and its -wal/-shm) open, and
+# renaming a WAL database under them corrupts it. The backup writes the
+# new pages as one transaction, so a reader sees the old catalog or the
+# new one, never half of either.
+
+shadow_skip = ["dump_block", "sqlite_stat1"]# not carried over
+shadow_cache_kb = 256 * 1024# page cache for the build, mostly the part index
+
+def _build_shadow(shadow, path, registry):
+    # uri=True so the live database can be attached read-only
+    con = sqlite3.connect(file_uri(shadow, "rwc"), uri=True)
+    try:
+        con.execute("attach database ? as live", (file_uri(path),))
+        # page sizes have to match for a backup into a WAL database
+        con.execute("pragma main.page_size = {}".format(
+            con.execute("pragma live.page_size").fetchone()[0]))
+        con.execute("pragma main.journal_mode = off")
+        con.execute("pragma main.synchronous = off")
+        con.execute("pragma main.cache_size = -{}".format(shadow_cache_kb))
+        con.execute("pragma temp_store = memory")
+        con.execute("pragma foreign_keys = off")
+        cur = con.cursor()
+        with relic_profile.phase("copy live tables"):
+            cur.execute("begin")# one read snapshot of the live database
+            live = cur.execute("""select type, name, tbl_name, sql
+                from live.sqlite_master where sql is not null""").fetchall()
+            generation = cur.execute("pragma live.user_version").fetchone()[0]
+            for (kind, name, table, sql) in live:
+                if kind != "table" or name in catalog_tables \
+                        or name in part_index_tables or name in shadow_skip:
+                    continue
+                cur.execute(sql)
+                cur.execute('insert into main."{0}" select * from live."{0}"'
+                    .format(name))
+            con.commit()
+        # detached, so unqualified names below can only mean the new file
+        con.execute("detach database live")
+        create_tables(cur)# the catalog, and has_relic if it wasn't there
+        load_catalog(cur, registry)
+        with relic_profile.phase("indexes"):
+            create_indexes(cur)
+        with relic_profile.phase("part index"):
+            create_part_index(cur)
+        have = set(r[0] for r in cur.execute("select name from sqlite_master"))
+        for kind in ["index", "trigger", "view"]:# views may use the rest
+            for (k, name, table, sql) in live:
+                if k == kind and name not in have and table not in shadow_skip \
+                        and name not in retired_indexes:
+                    cur.execute(sql)
+        cur.execute("pragma user_version = {}".format(generation + 1))
+        con.commit()
+        return con
+    except BaseException:
+        con.close()
+        raise
+
+def shadow_rebuild(path, registry, live=None, attempts=3):
+    """rebuild_catalog() for the database at path, built aside and
+    swapped in through live (a connection to path; opened here if None,
+    a ConnectionPool's writer under write() keeps this process's other
+    writers out until it's done). Returns how many builds it took.
+
+    Raises ValueError, leaving the database alone, if the new file fails
+    quick_check or leaves has_relic rows without their relic. Builds
+    again if another connection commits while the new file is being
+    built, since its copy of has_relic would be out of date."""
+    shadow = path + ".rebuild"
+    close_live = live is None
+    if live is None:
+        live = connect(path)
+    try:
+        for attempt in range(attempts):
+            # moves when any other connection commits to path
+            before = live.execute("pragma data_version").fetchone()[0]
+            if os.path.exists(shadow):
+                os.remove(shadow)
+            con = None
+            try:
+                con = _build_shadow(shadow, path, registry)
+                with relic_profile.phase("verify"):
+                    # quick_check: integrity_check less matching every index
+                    # entry to its row, which takes 5x as long and checks
+                    # indexes that were built from those rows moments ago
+                    problems = con.execute("pragma quick_check").fetchall()
+                    if problems != [("ok",)]:
+                        raise ValueError("rebuilt database failed quick_check: " +
+                            "; ".join(r[0] for r in problems[:5]))
+                    orphans = con.execute("pragma foreign_key_check").fetchall()
+                    if len(orphans) > 0:
+                        raise ValueError("{} row(s) would lose their relic: {}".format(
+                            len(orphans), orphans[:5]))
+                if live.execute("pragma data_version").fetchone()[0] == before:
+                    with relic_profile.phase("swap"):
+                        con.backup(live)
+                    return attempt + 1
+            finally:
+                if con is not None:
+                    con.close()
+                if os.path.exists(shadow):
+                    os.remove(shadow)
+        raise RuntimeError("the database kept changing during the rebuild")
+    finally:
+        if close_live:
+            live.close()
+
+# Materialized "which relics drop this part, and who owns them".
+# part_drop is reward with the relic's vaulted flag folded in, and
+# part_owner is that joined to has_relic, both keyed by part first so a
+# lookup is one index range read. Triggers on reward, relic and
+# has_relic keep them current, so nothing else has to know about them.
+part_index_tables = {
+    "part_drop": """create table part_drop (
+        base char(100) not null,
+        role char(100) not null,
+        era char(4) not null,
+        minor char(3) not null,
+        rarity char(10) not null,
+        vaulted int not null,
+        primary key (base, role, era, minor, rarity)
+    ) without rowid""",
+    "part_owner": """create table part_owner (
+        base char(100) not null,
+        role char(100) not null,
+        era char(4) not null,
+        minor char(3) not null,
+        player char(100) not null,
+        refinement char(15) not null,
+        quantity integer not null,
+        vaulted int not null,
+        primary key (base, role, era, minor, player, refinement)
+    ) without rowid""",
+}
+part_index_indexes = [
+    # the triggers find rows by relic / holding
+    "create index part_drop_by_relic on part_drop (era, minor)",
+    "create index part_owner_by_holding " +
+        "on part_owner (era, minor, player, refinement)",
+]
+# a reward row (era, minor, base, role) -> owners of that relic
+_owners_of_reward = """
+        insert or ignore into part_owner
+        select {r}.base, {r}.role, {r}.era, {r}.minor,
+            has_relic.player, has_relic.refinement, has_relic.quantity,
+            relic.vaulted
+        from has_relic join relic
+            on relic.era = has_relic.era and relic.minor = has_relic.minor
+        where has_relic.era = {r}.era and has_relic.minor = {r}.minor;"""
+# a has_relic row -> every part its relic drops
+_parts_of_holding = """
+        insert or ignore into part_owner
+        select reward.base, reward.role, reward.era, reward.minor,
+            new.player, new.refinement, new.quantity, relic.vaulted
+        from reward join relic
+            on relic.era = reward.era and relic.minor = reward.minor
+        where reward.era = new.era and reward.minor = new.minor;"""
+part_index_triggers = {
+    "reward_insert_part_index": """create trigger reward_insert_part_index
+        after insert on reward begin
+        insert or ignore into part_drop
+        select new.base, new.role, new.era, new.minor, new.rarity,
+            relic.vaulted
+        from relic where relic.era = new.era and relic.minor = new.minor;
+        """ + _owners_of_reward.format(r="new") + """
+        end""",
+    "reward_delete_part_index": """create trigger reward_delete_part_index
+        after delete on reward begin
+        delete from part_drop where base = old.base and role = old.role
+            and era = old.era and minor = old.minor
+            and rarity = old.rarity;
+        delete from part_owner where base = old.base and role = old.role
+            and era = old.era and minor = old.minor
+            and not exists (select 1 from reward
+                where base = old.base and role = old.role
+                and era = old.era and minor = old.minor);
+        end""",
+    "relic_vaulted_part_index": """create trigger relic_vaulted_part_index
+        after update of vaulted on relic begin
+        update part_drop set vaulted = new.vaulted
+            where era = new.era and minor = new.minor;
+        update part_owner set vaulted = new.vaulted
+            where era = new.era and minor = new.minor;
+        end""",
+    "has_relic_insert_part_index": """create trigger has_relic_insert_part_index
+        after insert on has_relic begin
+        """ + _parts_of_holding + """
+        end""",
+    "has_relic_update_part_index": """create trigger has_relic_update_part_index
+        after update on has_relic begin
+        delete from part_owner where era = old.era and minor = old.minor
+            and player = old.player and refinement = old.refinement;
+        """ + _parts_of_holding + """
+        end""",
+    "has_relic_delete_part_index": """create trigger has_relic_delete_part_index
+        after delete on has_relic begin
+        delete from part_owner where era = old.era and minor = old.minor
+            and player = old.player and refinement = old.refinement;
+        end""",
+}
+
+def create_part_index(db_cursor):
+    """(Re)builds part_drop/part_owner from scratch and installs the
+    triggers that keep them current. Run it after bulk loads."""
+    drop_part_index(db_cursor)
+    for statement in part_index_tables.values():
+        db_cursor.execute(statement)
+    for statement in part_index_indexes:
+        db_cursor.execute(statement)
+    db_cursor.execute("""insert or ignore into part_drop
+        select reward.base, reward.role, reward.era, reward.minor,
+            reward.rarity, relic.vaulted
+        from reward join relic
+            on relic.era = reward.era and relic.minor = reward.minor""")
+    db_cursor.execute("""insert or ignore into part_owner
+        select reward.base, reward.role, reward.era, reward.minor,
+            has_relic.player, has_relic.refinement, has_relic.quantity,
+            relic.vaulted
+        from reward
+        join relic
+            on relic.era = reward.era and relic.minor = reward.minor
+        join has_relic
+            on has_relic.era = reward.era and has_relic.minor = reward.minor""")
+    for statement in part_index_triggers.values():
+        db_cursor.execute(statement)
+
+def drop_part_index(db_cursor):
+    for name in part_index_triggers.keys():
+        db_cursor.execute("drop trigger if exists {}".format(name))
+    for name in part_index_tables.keys():
+        db_cursor.execute("drop table if exists {}".format(name))
+
+def part_drops(db_cursor, base, role, unvaulted_only=True):
+    """[(era, minor, rarity, vaulted)] for relics that drop base role."""
+    return db_cursor.execute(
+        """select era, minor, rarity, vaulted from part_drop
+        where base = ? and role = ? {}""".format(
+            "and vaulted = 0" if unvaulted_only else ""),
+        (base, role)
+    ).fetchall()
+
+def part_owners(db_cursor, base, role, unvaulted_only=True):
+    """[(player, era, minor, refinement, quantity)] holding base role."""
+    return db_cursor.execute(
+        """select player, era, minor, refinement, quantity from part_owner
+        where base = ? and role = ? and quantity > 0 {}
+        order by quantity desc""".format(
+            "and vaulted = 0" if unvaulted_only else ""),
+        (base, role)
+    ).fetchall()
+
+# The standard reports. All take named parameters.
+report_queries = {
+    "players": "select distinct player from has_relic",
+
+    "inventory": """select * from has_relic
+        where player == :player
+        order by era asc, quantity desc""",
+
+    # skel_full_relic_reward_join.sql with the blanks filled in
+    "unvaulted_drops": """select has_relic.*, reward.base, reward.rarity
+        from has_relic
+        inner join relic
+            on has_relic.era == relic.era
+            and has_relic.minor == relic.minor
+        inner join reward
+            on has_relic.era == reward.era
+            and has_relic.minor == reward.minor
+        where
+            has_relic.player == :player
+            and reward.base == :base
+            and relic.vaulted == 0
+        order by reward.rarity asc, has_relic.quantity desc""",
+
+    # which unvaulted relics drop a part, and who owns them
+    "part_owners": """select reward.era, reward.minor, reward.rarity,
+            has_relic.player, has_relic.refinement, has_relic.quantity
+        from reward
+        inner join relic
+            on relic.era == reward.era
+            and relic.minor == reward.minor
+        inner join has_relic
+            on has_relic.era == reward.era
+            and has_relic.minor == reward.minor
+        where
+            reward.base == :base
+            and reward.role == :role
+            and relic.vaulted == 0
+            and has_relic.quantity > 0
+        order by has_relic.quantity desc""",
+
+    # same answer out of the materialized part_owner table
+    "part_owners_materialized": """select era, minor,
+            player, refinement, quantity
+        from part_owner
+        where base == :base and role == :role
+            and vaulted == 0 and quantity > 0
+        order by quantity desc""",
+
+    # like the sooby_rewards view in relic.db, for any player
+    "player_rewards": """select relic.era, relic.minor, has_relic.refinement,
+            has_relic.quantity, reward.base, reward.role, reward.rarity,
+            relic.vaulted
+        from relic
+        join has_relic
+            on relic.era = has_relic.era
+            and relic.minor = has_relic.minor
+        join reward
+            on relic.era = reward.era
+            and relic.minor = reward.minor
+        where
+            has_relic.player = :player
+            and has_relic.quantity > 0""",
+}
+
+# Connections
+# The database runs in WAL mode so readers never wait on the writer.
+# There's one writer connection, shared under a lock, and a handful of
+# read-only connections handed out one thread at a time. Nothing is
+# opened until something asks for it.
+
+busy_timeout = 10.0# seconds to wait on another process's lock
+
+def file_uri(path, mode="ro"):
+    # the characters that mean something in a URI, without
+    # paying for urllib at startup
+    quoted = path.replace("%", "%25").replace("?", "%3f").replace("#", "%23")
+    return "file:{}?mode={}".format(quoted, mode)
+
+def connect(path, readonly=False):
+    if readonly:
+        con = sqlite3.connect(file_uri(path), uri=True,
+            timeout=busy_timeout, check_same_thread=False)
+    else:
+        con = sqlite3.connect(
+            path, timeout=busy_timeout, check_same_thread=False)
+    con.execute("pragma foreign_keys = on")
+    return relic_profile.trace_connection(con)
+
+class ConnectionPool:
+    def __init__(self, path, max_readers=8):
+        self.path = path
+        self.max_readers = max_readers
+        self._idle = []# readers not checked out right now
+        self._slots = threading.BoundedSemaphore(max_readers)
+        self._readers = []
+        self._lock = threading.Lock()# guards opening connections
+        self._write_lock = threading.RLock()# one writer at a time
+        self._write_depth = 0
+        self._writer = None
+        self._cache = None
+
+    def cache(self):
+        """The pool's relic_cache.Cache, on a reader of its own."""
+        if self._cache is None:
+            if not os.path.exists(self.path):
+                self.writer_connection()# read-only can't create it
+            with self._lock:
+                if self._cache is None:
+                    import relic_cache
+                    self._cache = relic_cache.Cache(
+                        connect(self.path, readonly=True))
+        return self._cache
+
+    def writer_connection(self):
+        with self._lock:
+            if self._writer is None:
+                con = connect(self.path)
+                # sticks to the file, so every later connection gets it too
+                con.execute("pragma journal_mode = wal")
+                con.execute("pragma synchronous = normal")# safe under WAL
+                self._writer = con
+            return self._writer
+
+    @contextmanager
+    def read(self):
+        """A read-only connection for this thread until the block ends."""
+        with self._slots:
+            with self._lock:
+                con = self._idle.pop() if len(self._idle) > 0 else None
+            if con is None:
+                if not os.path.exists(self.path):
+                    self.writer_connection()# read-only can't create it
+                con = connect(self.path, readonly=True)
+                with self._lock:
+                    self._readers.append(con)
+            try:
+                yield con
+            finally:
+                if con.in_transaction:
+                    con.rollback()
+                with self._lock:
+                    self._idle.append(con)
+
+    @contextmanager
+    def write(self):
+        """The writer connection, inside a transaction that commits when
+        the outermost write() block ends (or rolls back on an error)."""
+        with self._write_lock:
+            con = self.writer_connection()
+            self._write_depth += 1
+            try:
+                if self._write_depth > 1:# nested, the outer block commits
+                    yield con
+                else:
+                    with con:
+                        yield con
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        with self._lock:
+            for con in self._readers:
+                con.close()
+            self._readers = []
+            self._idle = []
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._cache is not None:
+                self._cache.probe.close()
+                self._cache = None
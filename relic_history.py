@@ -0,0 +1,185 @@
+#! /usr/bin/env python3
+# relic_history.py
+# Ownership history: every change to has_relic is appended to
+# ownership_event by triggers, so nothing that writes has_relic has to
+# know about it, and has_relic stays the latest-state view.
+#
+# Every so often (snapshot_every events) the whole of has_relic is
+# copied into snapshot_row. "What did P own at T" then reads the last
+# snapshot before T and only the events between it and T, never the
+# whole log.
+#
+# Times are unix seconds (float). An event records the quantity a
+# holding was set to; 0 means it went away.
+
+import time
+
+snapshot_every = 10000# events between automatic snapshots
+
+history_tables = {
+    "ownership_event": """create table if not exists ownership_event (
+        id integer primary key,
+        at real not null,
+        player char(100) not null,
+        era char(4) not null,
+        minor char(3) not null,
+        refinement char(15) not null,
+        quantity integer not null
+    )""",
+    "ownership_snapshot": """create table if not exists ownership_snapshot (
+        id integer primary key,
+        at real not null,
+        last_event integer not null
+    )""",
+    "snapshot_row": """create table if not exists snapshot_row (
+        snapshot integer not null references ownership_snapshot (id),
+        player char(100) not null,
+        era char(4) not null,
+        minor char(3) not null,
+        refinement char(15) not null,
+        quantity integer not null,
+        primary key (snapshot, player, era, minor, refinement)
+    ) without rowid""",
+}
+history_indexes = [
+    "create index if not exists ownership_event_by_player " +
+        "on ownership_event (player, id)",
+    "create index if not exists ownership_snapshot_by_time " +
+        "on ownership_snapshot (at)",
+]
+_now = "(julianday('now') - 2440587.5) * 86400.0"
+_event = """insert into ownership_event
+        (at, player, era, minor, refinement, quantity)
+        values (""" + _now + """, {r}.player, {r}.era, {r}.minor,
+            {r}.refinement, {q});"""
+history_triggers = {
+    "has_relic_insert_history": """create trigger if not exists
+        has_relic_insert_history after insert on has_relic begin
+        """ + _event.format(r="new", q="new.quantity") + """
+        end""",
+    "has_relic_update_history": """create trigger if not exists
+        has_relic_update_history after update on has_relic
+        when old.quantity is not new.quantity or old.player is not new.player
+            or old.era is not new.era or old.minor is not new.minor
+            or old.refinement is not new.refinement
+        begin
+        insert into ownership_event
+            (at, player, era, minor, refinement, quantity)
+            select """ + _now + """, old.player, old.era, old.minor,
+                old.refinement, 0
+            where old.player is not new.player or old.era is not new.era
+                or old.minor is not new.minor
+                or old.refinement is not new.refinement;
+        """ + _event.format(r="new", q="new.quantity") + """
+        end""",
+    "has_relic_delete_history": """create trigger if not exists
+        has_relic_delete_history after delete on has_relic begin
+        """ + _event.format(r="old", q="0") + """
+        end""",
+}
+
+def installed(db_connection):
+    return db_connection.execute(
+        """select count(*) from sqlite_master
+        where type = 'table' and name = 'ownership_event'""").fetchone()[0] > 0
+
+def create_event_log(db_cursor):
+    """Installs the log and its triggers, with a first snapshot of
+    has_relic as the starting point. Safe to run again."""
+    for statement in history_tables.values():
+        db_cursor.execute(statement)
+    for statement in history_indexes:
+        db_cursor.execute(statement)
+    for statement in history_triggers.values():
+        db_cursor.execute(statement)
+    if db_cursor.execute(
+            "select count(*) from ownership_snapshot").fetchone()[0] == 0:
+        snapshot(db_cursor)
+
+def drop_event_log(db_cursor):
+    for name in history_triggers.keys():
+        db_cursor.execute("drop trigger if exists {}".format(name))
+    for name in reversed(list(history_tables.keys())):
+        db_cursor.execute("drop table if exists {}".format(name))
+
+def snapshot(db_cursor, at=None):
+    """Copies has_relic as it is now into a new snapshot; returns its id.
+    Run it in the same transaction as the writes it should include."""
+    if at is None:
+        at = time.time()
+    last_event = db_cursor.execute(
+        "select coalesce(max(id), 0) from ownership_event").fetchone()[0]
+    db_cursor.execute(
+        "insert into ownership_snapshot (at, last_event) values (?, ?)",
+        (at, last_event))
+    snapshot_id = db_cursor.lastrowid
+    db_cursor.execute(
+        """insert into snapshot_row
+            (snapshot, player, era, minor, refinement, quantity)
+        select ?, player, era, minor, refinement, quantity
+        from has_relic where quantity > 0""",
+        (snapshot_id,))
+    return snapshot_id
+
+def maybe_snapshot(db_cursor, every=None):
+    """Takes a snapshot if enough events piled up since the last one.
+    Does nothing if the log isn't installed."""
+    if not installed(db_cursor.connection):
+        return None
+    row = db_cursor.execute(
+        """select (select coalesce(max(id), 0) from ownership_event),
+            (select coalesce(max(last_event), 0) from ownership_snapshot)"""
+    ).fetchone()
+    if row[0] - row[1] >= (every or snapshot_every):
+        return snapshot(db_cursor)
+    return None
+
+def _base(db_connection, at):
+    # the last snapshot at or before `at`: (id, last event it includes,
+    # last event of the first snapshot after `at`). Nothing from after
+    # `at` can come before that one, so events past it needn't be read.
+    row = db_connection.execute(
+        """select id, last_event from ownership_snapshot where at <= ?
+        order by at desc, id desc limit 1""",
+        (at,)).fetchone()
+    (snap, last_event) = row if row is not None else (None, 0)
+    bound = db_connection.execute(
+        """select coalesce(min(last_event), (select max(id) from ownership_event))
+        from ownership_snapshot where at > ?""",
+        (at,)).fetchone()[0]
+    return (snap, last_event, bound if bound is not None else 0)
+
+def inventory_at(db_connection, at, player=None):
+    """{(player, era, minor, refinement): quantity} as of time `at`, for
+    one player or everyone."""
+    (snap, last_event, bound) = _base(db_connection, at)
+    where = "" if player is None else " and player = ?"
+    args = () if player is None else (player,)
+    held = {}
+    if snap is not None:
+        for (p, era, minor, refinement, quantity) in db_connection.execute(
+                """select player, era, minor, refinement, quantity
+                from snapshot_row where snapshot = ?""" + where,
+                (snap,) + args):
+            held[(p, era, minor, refinement)] = quantity
+    for (p, era, minor, refinement, quantity) in db_connection.execute(
+            """select player, era, minor, refinement, quantity
+            from ownership_event where id > ? and id <= ? and at <= ?""" +
+            where + " order by id",
+            (last_event, bound, at) + args):
+        if quantity > 0:
+            held[(p, era, minor, refinement)] = quantity
+        else:
+            held.pop((p, era, minor, refinement), None)
+    return held
+
+def changes_between(db_connection, since, until, player=None):
+    """{(player, era, minor, refinement): (quantity then, quantity after)}
+    for every holding that differs between the two times."""
+    before = inventory_at(db_connection, since, player)
+    after = inventory_at(db_connection, until, player)
+    return {
+        key: (before.get(key, 0), after.get(key, 0))
+        for key in set(before) | set(after)
+        if before.get(key, 0) != after.get(key, 0)
+    }
@@ -0,0 +1,222 @@
+#! /usr/bin/env python3
+# relic_incremental.py
+# Re-imports a new wiki dump one prime block at a time.
+#
+# The dump is a run of blocks, each starting with an image line
+# ("MirageAkboltoPrime", "DEPrimeDualBroncos") and listing one prime's
+# parts and rewards. After an import every block's hash is kept in
+# dump_block along with the primes it covered. Next time only blocks
+# with a hash we haven't seen get parsed, and only the primes in those
+# blocks (or in blocks that disappeared) get diffed against the db.
+#
+#   changes = relic_incremental.changes(read_relics.iter_lines(path), cur)
+#   relic_incremental.apply(cur, changes)
+
+import hashlib
+import read_relics, relic_db, relic_profile
+
+block_table = """create table if not exists dump_block(
+  hash char(40) primary key,
+  primes text not null
+)"""# primes: the block's prime names, one per line
+
+def iter_blocks(lines):
+    """Yields (hash, (prime, part) at the start, lines) per block.
+
+    The starting prime and part go into the hash too, since a block
+    that doesn't open with its prime's name depends on the one before.
+    """
+    prime_s = None
+    part_s = None
+    context = (None, None)
+    block = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if read_relics.is_image_line(line) and len(block) > 0:
+            yield (block_hash(context, block), context, block)
+            context = (prime_s, part_s)
+            block = []
+        block.append(line)
+        # just enough of parse_line to follow the context along
+        lsp = line.strip().split(" \t")
+        if len(lsp) == 3:
+            (prime_s, part_s) = (lsp[0], lsp[1])
+        elif len(lsp) == 2:
+            part_s = lsp[0]
+    if len(block) > 0:
+        yield (block_hash(context, block), context, block)
+
+def block_hash(context, block):
+    h = hashlib.sha1()
+    h.update(repr(context).encode("utf-8"))
+    for line in block:
+        h.update(line.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+def first_vaulted(blocks):
+    """{(era, minor): vaulted} from each relic's first reward line in
+    the whole dump, which is the one a full parse goes by."""
+    flags = {"(V)": 1, "(B)": 2}
+    seen = {}
+    for (h, context, block) in blocks:
+        for line in block:
+            rs = line.strip().split(" \t")[-1].split(" ")
+            if len(rs) >= 3 and (rs[0], rs[1]) not in seen:
+                seen[(rs[0], rs[1])] = flags.get(rs[3], 0) if len(rs) == 4 else 0
+    return seen
+
+def stored_blocks(db_cursor):
+    db_cursor.execute(block_table)
+    return {
+        h: set(primes.split("\n"))
+        for (h, primes) in db_cursor.execute("select hash, primes from dump_block")
+    }
+
+def changes(lines, db_cursor):
+    """The minimal change set turning the db into what lines say.
+
+    Returns {table: {"new": [rows], "removed": [rows]}} for prime, part
+    and reward, relic also gets "vaulting": [(era, minor, old, new)],
+    and "blocks" has what apply() should remember for next time.
+    """
+    stored = stored_blocks(db_cursor)
+    with relic_profile.phase("split blocks"):
+        blocks = list(iter_blocks(lines))
+    hashes = set(h for (h, context, block) in blocks)
+    changed = set(h for h in hashes if h not in stored)
+    # primes we'll have to diff: the ones in blocks that went away...
+    affected = set()
+    for (h, primes) in stored.items():
+        if h not in hashes:
+            affected |= primes
+    if len(stored) == 0:# nothing to go on, so everything
+        affected |= set(r[0] for r in db_cursor.execute("select name from prime"))
+    # ...and the ones in changed blocks. A prime diffed from some of its
+    # blocks but not others would look like it lost rewards, so any
+    # unchanged block sharing a prime with a changed one is parsed too.
+    with relic_profile.phase("parse changed blocks"):
+        reg = read_relics.Registry()
+        block_primes = {}
+        parsed = set()
+        while True:
+            for (h, context, block) in blocks:
+                if h in parsed or not (h in changed or stored[h] & affected):
+                    continue
+                parsed.add(h)
+                records = list(read_relics.iter_records(block, *context))
+                read_relics.build_registry(records, reg)
+                block_primes[h] = set(r[0] for r in records if r[0] is not None)
+                affected |= block_primes[h]
+            if all(h in parsed or not stored[h] & affected
+                    for (h, context, block) in blocks if h not in changed):
+                break
+
+    result = {"blocks": {
+        "total": len(blocks),
+        "parsed": len(parsed),
+        "forget": [h for h in stored if h not in hashes],
+        "remember": [(h, "\n".join(sorted(p))) for (h, p) in block_primes.items()
+            if h not in stored],
+    }}
+    with relic_profile.phase("diff blocks"):
+        # the primes being diffed, as a table to join against
+        db_cursor.execute("drop table if exists temp.inc_prime")
+        db_cursor.execute("create temp table inc_prime (name primary key)")
+        db_cursor.executemany("insert into temp.inc_prime values (?)",
+            [(p,) for p in affected])
+        for (table, sql) in [
+            ("prime", "select name from prime where name in temp.inc_prime"),
+            ("part", "select base, role from part where base in temp.inc_prime"),
+            ("reward", "select era, minor, base, role, rarity from reward " +
+                "where base in temp.inc_prime"),
+        ]:
+            old = set(db_cursor.execute(sql))
+            new = set(relic_db.catalog_rows(reg, table))
+            result[table] = {
+                "new": sorted(new - old),
+                "removed": sorted(old - new),
+            }
+        # relics belong to no one prime. A relic's vaulted comes from its
+        # first line anywhere in the dump, which may well be in a block
+        # that wasn't parsed, so it's checked for every relic.
+        db_relics = {
+            (era, minor): vaulted for (era, minor, vaulted)
+            in db_cursor.execute("select era, minor, vaulted from relic")
+        }
+        vaulted_now = first_vaulted(blocks)
+        new_relics = []
+        vaulting = []
+        for (era, minor, vaulted) in relic_db.catalog_rows(reg, "relic"):
+            if (era, minor) not in db_relics:
+                new_relics.append((era, minor, vaulted_now[(era, minor)]))
+        for ((era, minor), old) in db_relics.items():
+            if vaulted_now.get((era, minor), old) != old:
+                vaulting.append((era, minor, old, vaulted_now[(era, minor)]))
+        # gone if it lost rewards here and has none left anywhere else
+        losing = set((r[0], r[1]) for r in result["reward"]["removed"])
+        losing -= set((r[0], r[1]) for r in relic_db.catalog_rows(reg, "relic"))
+        removed_relics = []
+        for (era, minor) in sorted(losing):
+            others = db_cursor.execute(
+                """select count(*) from reward where era = ? and minor = ?
+                and base not in temp.inc_prime""",
+                (era, minor)
+            ).fetchone()[0]
+            if others == 0:
+                removed_relics.append((era, minor, db_relics[(era, minor)]))
+        result["relic"] = {
+            "new": sorted(new_relics),
+            "removed": removed_relics,
+            "vaulting": sorted(vaulting),
+        }
+    return result
+
+def change_count(change_set):
+    return sum(len(rows) for (table, kinds) in change_set.items()
+        if table != "blocks" for rows in kinds.values())
+
+def apply(db_cursor, change_set):
+    """Applies changes() output and records the new block hashes.
+
+    Doesn't commit. Removing a relic someone still owns fails on the
+    has_relic foreign key, same as any other delete would.
+    """
+    c = change_set
+    with relic_profile.phase("apply blocks"):
+        # removals child-first, additions parent-first
+        db_cursor.executemany(
+            """delete from reward where era = ? and minor = ?
+            and base = ? and role = ? and rarity = ?""",
+            c["reward"]["removed"])
+        db_cursor.executemany(
+            "delete from part where base = ? and role = ?",
+            c["part"]["removed"])
+        db_cursor.executemany(
+            "delete from prime where name = ?", c["prime"]["removed"])
+        db_cursor.executemany(
+            "delete from relic where era = ? and minor = ?",
+            [(era, minor) for (era, minor, vaulted) in c["relic"]["removed"]])
+        db_cursor.executemany(
+            "insert into relic (era, minor, vaulted) values (?, ?, ?)",
+            c["relic"]["new"])
+        db_cursor.executemany(
+            "update relic set vaulted = ? where era = ? and minor = ?",
+            [(new, era, minor) for (era, minor, old, new) in c["relic"]["vaulting"]])
+        db_cursor.executemany(
+            "insert into prime (name) values (?)", c["prime"]["new"])
+        db_cursor.executemany(
+            "insert into part (base, role) values (?, ?)", c["part"]["new"])
+        db_cursor.executemany(
+            """insert into reward (era, minor, base, role, rarity)
+            values (?, ?, ?, ?, ?)""",
+            c["reward"]["new"])
+        db_cursor.execute(block_table)
+        db_cursor.executemany(
+            "delete from dump_block where hash = ?",
+            [(h,) for h in c["blocks"]["forget"]])
+        db_cursor.executemany(
+            "insert or replace into dump_block (hash, primes) values (?, ?)",
+            c["blocks"]["remember"])
+        if change_count(c) > 0:
+            relic_db.bump_generation(db_cursor)
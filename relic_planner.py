@@ -0,0 +1,133 @@
+#! /usr/bin/env python3
+# relic_planner.py
+# Which of a player's relics to crack next, for some objective:
+#   ducats    part values from the "ducats" column of a price table
+#   platinum  same, "platinum" column
+#   sets      1 for every part the player still needs, so the score is
+#             the expected number of needed parts per crack
+# Every (relic, refinement) stack a player owns is scored with one
+# lookup into relic_value's per-relic EV table, and the best k come out
+# of a heap, so one player or every player at once stays quick.
+
+import csv, heapq
+import numpy as np
+import read_relics, relic_value
+
+objectives = ["ducats", "platinum", "sets"]
+
+def load_prices(path):
+    """{part full name: {"ducats": x, "platinum": y}} from a tab-separated
+    file of name, ducats, platinum (a header line is skipped)."""
+    prices = {}
+    with open(path, newline="") as infile:
+        for (n, fields) in enumerate(csv.reader(infile, "excel-tab"), 1):
+            if len(fields) == 0 or fields[0].strip() == "":
+                continue
+            if len(fields) != 3:
+                raise ValueError("{}:{}: expected 3 fields, got {}".format(
+                    path, n, len(fields)))
+            try:
+                (ducats, platinum) = (float(fields[1]), float(fields[2]))
+            except ValueError:
+                if n == 1:# header
+                    continue
+                raise ValueError("{}:{}: bad number".format(path, n))
+            prices[fields[0].strip()] = {"ducats": ducats, "platinum": platinum}
+    return prices
+
+def load_needs(path):
+    """Part names, one per line. A prime's name means all of its parts."""
+    with open(path) as infile:
+        return set(line.strip() for line in infile
+            if line.strip() != "" and not line.startswith("#"))
+
+class Planner:
+    def __init__(self, registry):
+        self.registry = registry
+        self.rv = relic_value.RelicValues(registry)
+        self._ev = {}# objective -> (relics, 4) EV table, for shared values
+
+    def expand_needs(self, names):
+        """Part full names for names, with prime names expanded."""
+        parts = set()
+        for name in names:
+            if name in self.registry.primes:
+                parts.update(self.registry.primes[name].parts.keys())
+            else:
+                parts.add(name)
+        return parts
+
+    def relic_scores(self, objective, prices=None):
+        """Per-crack value of every relic at every refinement."""
+        if objective not in self._ev:
+            if objective not in ("ducats", "platinum"):
+                raise ValueError("unknown objective {}".format(objective))
+            if prices is None:
+                raise ValueError("{} needs a price table".format(objective))
+            self._ev[objective] = self.rv.relic_ev(self.rv.value_vector(
+                {name: p[objective] for (name, p) in prices.items()}))
+        return self._ev[objective]
+
+    def row_scores(self, holdings, objective, prices=None, needs=None):
+        # needs: {player: names} for "sets"
+        if objective == "sets":
+            if needs is None:
+                raise ValueError("sets needs a list of parts to look for")
+            player_names = holdings[0]
+            matrix = relic_value.needs_matrix(self.rv, player_names,
+                {p: self.expand_needs(needs.get(p, ())) for p in player_names})
+            return self.rv.row_ev(matrix, holdings)
+        (player_names, p_idx, r_idx, ref_idx, qty) = holdings
+        return self.relic_scores(objective, prices)[r_idx, ref_idx]
+
+    def _top(self, holdings, scores, rows, k):
+        (player_names, p_idx, r_idx, ref_idx, qty) = holdings
+        rows = [i for i in rows if qty[i] > 0]# nothing to crack otherwise
+        best = heapq.nlargest(k, rows, key=lambda i: (scores[i], qty[i]))
+        return [{
+            "player": player_names[p_idx[i]],
+            "relic": self.rv.relic_names[r_idx[i]],
+            "refinement": relic_value.refinements[ref_idx[i]],
+            "quantity": int(qty[i]),
+            "per_crack": float(scores[i]),
+            "total": float(scores[i] * qty[i]),
+        } for i in best if scores[i] > 0]
+
+    def plan(self, db_connection, player, objective="ducats", k=10,
+            prices=None, needs=None):
+        """The k best stacks for player to crack, best first."""
+        holdings = self.rv.holdings(db_connection, [player])
+        if needs is not None:
+            needs = {player: needs}
+        scores = self.row_scores(holdings, objective, prices, needs)
+        return self._top(holdings, scores, range(len(scores)), k)
+
+    def plan_all(self, db_connection, objective="ducats", k=10,
+            prices=None, needs=None):
+        """{player: plan} for everyone in has_relic."""
+        holdings = self.rv.holdings(db_connection)
+        scores = self.row_scores(holdings, objective, prices, needs)
+        p_idx = holdings[1]
+        order = np.argsort(p_idx, kind="stable")
+        bounds = np.searchsorted(p_idx[order], np.arange(len(holdings[0]) + 1))
+        return {
+            player: self._top(holdings, scores,
+                order[bounds[i]:bounds[i + 1]].tolist(), k)
+            for (i, player) in enumerate(holdings[0])
+        }
+
+def format_plan(plan):
+    lines = ["relic\trefinement\tquantity\tper_crack\ttotal"]
+    for p in plan:
+        lines.append("{relic}\t{refinement}\t{quantity}\t{per_crack:.3f}\t{total:.2f}"
+            .format(**p))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import sqlite3, sys
+    if len(sys.argv) < 3:
+        sys.exit("usage: relic_planner.py PLAYER NEEDS_FILE [db]")
+    planner = Planner(read_relics.load_registry(read_relics.source_table))
+    con = sqlite3.connect(sys.argv[3] if len(sys.argv) > 3 else "relics.db")
+    print(format_plan(planner.plan(con, sys.argv[1], "sets",
+        needs=load_needs(sys.argv[2]))))
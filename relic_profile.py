@@ -0,0 +1,151 @@
+#! /usr/bin/env python3
+# relic_profile.py
+# Opt-in profiling for the relic scripts.
+#
+#   WFRELIC_PROFILE=1 ./wfrelic-updatedb.py            summary on stderr
+#   WFRELIC_PROFILE=prof.json ./wfrelic-updatedb.py    summary as JSON
+#
+# Named phases (parse, diff, apply...) are timed with `with phase(...)`,
+# and connections passed through trace_connection() get per-statement
+# counts, time, rows changed and VM steps, grouped by the SQL text with
+# its literals taken out. With the variable unset, phase() hands back a
+# shared do-nothing context manager and trace_connection() does nothing.
+
+import os, sys, time
+from contextlib import nullcontext
+# re and json are only imported once profiling is actually on
+
+setting = os.environ.get("WFRELIC_PROFILE", "")
+enabled = setting not in ("", "0")
+progress_every = 1000# VM instructions between progress callbacks
+
+phases = {}# name -> {"calls", "seconds"}
+statements = {}# normalized sql -> {"count", "seconds", "rows", "vm_steps"}
+
+_null = nullcontext()
+
+class _Phase:
+    __slots__ = ("name", "start")
+    def __init__(self, name):
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        p = phases.setdefault(self.name, {"calls": 0, "seconds": 0.0})
+        p["calls"] += 1
+        p["seconds"] += time.perf_counter() - self.start
+        return False
+
+def phase(name):
+    if not enabled:
+        return _null
+    return _Phase(name)
+
+_patterns = []# (literal, parameter list), compiled on first use
+_normalized = {}
+
+def normalize(sql):
+    """Same statement, different parameters -> same text."""
+    if len(_patterns) == 0:
+        import re
+        _patterns.append(re.compile(
+            r"'(?:[^']|'')*'|\bx'[0-9a-fA-F]*'|\b\d+(?:\.\d+)?\b"))
+        _patterns.append(re.compile(r"\?(?:\s*,\s*\?)+"))
+    (_literal, _param_list) = _patterns
+    key = _normalized.get(sql)
+    if key is None:
+        key = _param_list.sub("?, ...", _literal.sub("?", " ".join(sql.split())))
+        if len(_normalized) < 10000:
+            _normalized[sql] = key
+    return key
+
+class _Tracer:
+    # A statement's time runs from its trace callback to the last
+    # progress callback seen before the next statement starts, so time
+    # spent outside sqlite (prompts, Python loops) isn't charged to it.
+    def __init__(self, connection):
+        self.connection = connection
+        self.current = None
+        self.start = 0.0
+        self.last_seen = 0.0
+        self.changes = 0
+
+    def close(self):
+        if self.current is not None:
+            s = self.current
+            s["seconds"] += self.last_seen - self.start
+            try:
+                s["rows"] += self.connection.total_changes - self.changes
+            except Exception:# connection already closed; rows unknown
+                pass
+            self.current = None
+
+    def trace(self, sql):
+        if sql.startswith("-- TRIGGER"):# runs inside the outer statement
+            key = " ".join(sql.split())
+            statements.setdefault(key, _new_stats())["count"] += 1
+            return
+        self.close()
+        s = statements.setdefault(normalize(sql), _new_stats())
+        s["count"] += 1
+        self.current = s
+        self.start = self.last_seen = time.perf_counter()
+        self.changes = self.connection.total_changes
+
+    def progress(self):
+        if self.current is not None:
+            self.current["vm_steps"] += progress_every
+            self.last_seen = time.perf_counter()
+        return 0
+
+def _new_stats():
+    return {"count": 0, "seconds": 0.0, "rows": 0, "vm_steps": 0}
+
+_tracers = []
+
+def trace_connection(connection):
+    """Starts collecting statement stats for connection, if enabled."""
+    if not enabled:
+        return connection
+    tracer = _Tracer(connection)
+    connection.set_trace_callback(tracer.trace)
+    connection.set_progress_handler(tracer.progress, progress_every)
+    _tracers.append(tracer)
+    return connection
+
+def summary():
+    for tracer in _tracers:
+        tracer.close()
+    return {
+        "phases": phases,
+        "statements": [
+            dict(sql=sql, **s) for (sql, s) in sorted(
+                statements.items(), key=lambda kv: -kv[1]["seconds"])
+        ],
+    }
+
+def report(outfile=sys.stderr, top=25):
+    s = summary()
+    print("== phases", file=outfile)
+    for (name, p) in sorted(s["phases"].items(), key=lambda kv: -kv[1]["seconds"]):
+        print("{:10.4f}s {:6d}x  {}".format(p["seconds"], p["calls"], name),
+            file=outfile)
+    print("== statements (top {} by time)".format(top), file=outfile)
+    print("   seconds   count     rows   vm_steps  sql", file=outfile)
+    for st in s["statements"][:top]:
+        sql = st["sql"] if len(st["sql"]) < 100 else st["sql"][:97] + "..."
+        print("{seconds:10.4f} {count:7d} {rows:8d} {vm_steps:10d}  ".format(**st) +
+            sql, file=outfile)
+
+def _at_exit():
+    if setting.endswith(".json"):
+        import json
+        with open(setting, "w") as outfile:
+            json.dump(summary(), outfile, indent=1)
+    else:
+        report()
+
+if enabled:
+    import atexit
+    atexit.register(_at_exit)
@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+# relic_search.py
+# Typo-tolerant lookup of relic, prime and part names, for entry and
+# search.
+#
+# Names are compared squashed: lowercase letters and digits only, so
+# "lith g 1", "LITH G1" and "Lith G1" are all "lithg1", and without the
+# word "prime", which nearly every name has and nobody bothers to type
+# ("akbolto barrel" is "Akbolto Prime Barrel"). Each squashed
+# name is broken into trigrams, and every trigram keeps the (numpy)
+# sorted list of names containing it. The names on a query's trigram
+# lists, plus the ones starting with the query (found by bisecting the
+# sorted squashed names), are the candidates; each gets its Jaccard
+# similarity to the query, and a bonus if the query is its prefix.
+# Only candidates are ever looked at, never the whole catalog.
+#
+# Trigrams on more than max_postings names ("blu", "ron" in a big
+# catalog) would make nearly every name a candidate, so they only pick
+# candidates when a query has nothing rarer. They still count towards
+# the similarity of the candidates the rare ones found.
+
+import bisect, re
+import numpy as np
+
+kinds = ["relic", "prime", "part"]
+prefix_bonus = 0.5# added for names starting with the query
+max_postings = 250# names a trigram can be on and still be used to rank
+_not_alnum = re.compile("[^a-z0-9]+")
+_prime = re.compile(r"\bprime\b")
+
+def squash(s):
+    return _not_alnum.sub("", _prime.sub("", s.lower()))
+
+def trigrams(squashed):
+    padded = "  " + squashed + " "
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class NameIndex:
+    def __init__(self, names, name_kinds=None):
+        # names: display names; name_kinds: a kinds entry for each
+        seen = {}
+        for (i, name) in enumerate(names):
+            seen.setdefault(name, kinds.index(name_kinds[i])
+                if name_kinds is not None else 0)
+        self.names = list(seen.keys())
+        self.kind = np.array(list(seen.values()), dtype=np.int8)
+        squashed = [squash(n) for n in self.names]
+        postings = {}
+        name_grams = [trigrams(s) for s in squashed]
+        for (i, grams) in enumerate(name_grams):
+            for g in grams:
+                postings.setdefault(g, []).append(i)
+        self.postings = {g: np.array(ids, dtype=np.int32)
+            for (g, ids) in postings.items()}
+        self.common = set(g for (g, ids) in postings.items()
+            if len(ids) > max_postings)
+        self.gram_id = {g: i for (i, g) in enumerate(postings)}
+        self.n_trigrams = np.array([len(g) for g in name_grams], dtype=np.int32)
+        # each name's trigram ids, padded with len(gram_id), for counting
+        # a candidate's shared trigrams without going back to Python
+        self.name_grams = np.full((len(self.names),
+            max([len(g) for g in name_grams] + [1])), len(self.gram_id),
+            dtype=np.int32)
+        for (i, grams) in enumerate(name_grams):
+            self.name_grams[i, :len(grams)] = [self.gram_id[g] for g in grams]
+        order = sorted(range(len(squashed)), key=lambda i: squashed[i])
+        self._sorted = [squashed[i] for i in order]# for prefix lookups
+        self._sorted_ids = np.array(order, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    def prefixed(self, squashed, limit=max_postings):
+        """Ids of names whose squashed form starts with squashed, the
+        first `limit` of them alphabetically."""
+        lo = bisect.bisect_left(self._sorted, squashed)
+        hi = bisect.bisect_left(self._sorted, squashed + "\x7f")
+        return self._sorted_ids[lo:min(hi, lo + limit)]
+
+    def scores(self, query):
+        """(ids, scores) of the names query could mean: similarity from 0
+        to 1, plus prefix_bonus for names it's a prefix of, and another
+        1 for an exact match."""
+        q = squash(query)
+        if q == "":
+            return (np.zeros(0, dtype=np.int32), np.zeros(0))
+        all_grams = trigrams(q)
+        grams = set(g for g in all_grams if g in self.postings)
+        pick = grams - self.common or grams
+        prefixed = self.prefixed(q)
+        ids = np.zeros(0, dtype=np.int32)
+        if len(pick) > 0:
+            (ids, hits) = np.unique(np.concatenate(
+                [self.postings[g] for g in pick]), return_counts=True)
+            # sharing under half as many as the best would rank far below
+            ids = ids[2 * hits >= hits.max()]
+        ids = np.union1d(ids, prefixed)
+        in_query = np.zeros(len(self.gram_id) + 1, dtype=bool)
+        in_query[[self.gram_id[g] for g in grams]] = True
+        shared = in_query[self.name_grams[ids]].sum(axis=1)
+        score = shared / (len(all_grams) + self.n_trigrams[ids] - shared)
+        score[np.searchsorted(ids, prefixed)] += prefix_bonus
+        # the exact matches sort first among the prefixed
+        lo = bisect.bisect_left(self._sorted, q)
+        score[np.searchsorted(ids, self._sorted_ids[lo:bisect.bisect_right(
+            self._sorted, q)])] += 1.0
+        return (ids, score)
+
+    def search(self, query, k=10, kind=None, min_score=0.3):
+        """[(name, score)], best first, at most k of them."""
+        (ids, score) = self.scores(query)
+        if kind is not None:
+            keep = self.kind[ids] == kinds.index(kind)
+            (ids, score) = (ids[keep], score[keep])
+        k = min(k, len(score))
+        if k == 0:
+            return []
+        top = np.argpartition(-score, k - 1)[:k]
+        top = top[np.argsort(-score[top], kind="stable")]
+        return [(self.names[ids[i]], float(score[i])) for i in top
+            if score[i] >= min_score]
+
+    def correct(self, query, kind=None, margin=0.1):
+        """The name query most likely meant, or None if nothing is close
+        or the top two are too close to call."""
+        best = self.search(query, 2, kind)
+        if len(best) == 0:
+            return None
+        if len(best) > 1 and best[0][1] - best[1][1] < margin:
+            return None
+        return best[0][0]
+
+def catalog_index(db_connection):
+    """A NameIndex over relic keys ("Lith G1"), prime names and part full
+    names ("Akbolto Prime Barrel") in the catalog."""
+    names = []
+    name_kinds = []
+    for (kind, sql) in [
+        ("relic", "select era || ' ' || minor from relic"),
+        ("prime", "select name from prime"),
+        ("part", "select base || ' ' || role from part"),
+    ]:
+        for (name,) in db_connection.execute(sql):
+            names.append(name)
+            name_kinds.append(kind)
+    return NameIndex(names, name_kinds)
@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+# relic_sets.py
+# Bitset index for set completion questions.
+#
+# Every part gets a bit, and bitsets are rows of uint64 words. A relic's
+# row is every part it can drop, a player's row is the OR of the relics
+# they own. Each prime's parts sit next to each other inside a single
+# word, so a prime is just (word, mask), and "can this player finish
+# that set" is row[word] & mask == mask, for every player and prime
+# in one numpy expression.
+
+import numpy as np
+
+class SetIndex:
+    def __init__(self, registry):
+        by_prime = {}
+        for (name, part) in registry.parts.items():
+            by_prime.setdefault(part.prime_obj.name, []).append(name)
+        self.prime_names = sorted(by_prime)
+        self.prime_index = {n: i for (i, n) in enumerate(self.prime_names)}
+        self.part_bit = {}# part full name -> bit
+        bit = 0
+        for prime in self.prime_names:
+            parts = sorted(by_prime[prime])
+            if len(parts) > 64:
+                raise ValueError("{} has more than 64 parts".format(prime))
+            if (bit & 63) + len(parts) > 64:# don't straddle two words
+                bit = (bit | 63) + 1
+            for name in parts:
+                self.part_bit[name] = bit
+                bit += 1
+        self.part_names = {b: n for (n, b) in self.part_bit.items()}
+        self.n_words = max(1, (bit + 63) // 64)
+        self.prime_word = np.zeros(len(self.prime_names), dtype=np.int64)
+        self.prime_bits = np.zeros(len(self.prime_names), dtype=np.uint64)
+        for (i, prime) in enumerate(self.prime_names):
+            words = self.mask(by_prime[prime])
+            self.prime_word[i] = np.nonzero(words)[0][0]
+            self.prime_bits[i] = words[self.prime_word[i]]
+        self.relic_names = list(registry.relics.keys())
+        self.relic_index = {n: i for (i, n) in enumerate(self.relic_names)}
+        self.relic_words = np.zeros((len(self.relic_names), self.n_words),
+            dtype=np.uint64)
+        self.vaulted = np.zeros(len(self.relic_names), dtype=np.int8)
+        for (i, name) in enumerate(self.relic_names):
+            relic = registry.relics[name]
+            self.vaulted[i] = relic.vaulted
+            self.relic_words[i] = self.mask(p.full_name()
+                for rarity in ["Common", "Uncommon", "Rare"]
+                for p in relic.rewards[rarity])
+
+    def mask(self, part_names):
+        """Bitset row for some part full names."""
+        words = np.zeros(self.n_words, dtype=np.uint64)
+        for name in part_names:
+            b = self.part_bit[name]
+            words[b >> 6] |= np.uint64(1) << np.uint64(b & 63)
+        return words
+
+    def names(self, words):
+        """Part full names in a bitset row."""
+        bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+        return [self.part_names[b] for b in np.nonzero(bits)[0]]
+
+    def relic_mask(self, relic_names):
+        rows = [self.relic_index[n] for n in relic_names if n in self.relic_index]
+        if len(rows) == 0:
+            return np.zeros(self.n_words, dtype=np.uint64)
+        return np.bitwise_or.reduce(self.relic_words[rows], axis=0)
+
+    def unvaulted(self):
+        """Everything that still drops from unvaulted relics."""
+        return np.bitwise_or.reduce(self.relic_words[self.vaulted == 0], axis=0)
+
+    def covered(self, masks):
+        """Which primes each mask covers completely.
+
+        masks is one row (-> (primes,) bools) or (n, words) rows
+        (-> (n, primes)).
+        """
+        masks = np.asarray(masks, dtype=np.uint64)
+        return masks[..., self.prime_word] & self.prime_bits == self.prime_bits
+
+    def farmable_primes(self):
+        """(fully, partly): primes whose parts all, or only some, still
+        drop from unvaulted relics."""
+        u = self.unvaulted()
+        full = self.covered(u)
+        some = u[self.prime_word] & self.prime_bits != 0
+        return ([p for (p, f) in zip(self.prime_names, full) if f],
+            [p for (p, f, s) in zip(self.prime_names, full, some) if s and not f])
+
+    def player_masks(self, db_connection, players=None):
+        """(player names, (players, words) rows) of what each player's
+        relics can drop, from has_relic."""
+        query = "select player, era, minor from has_relic where quantity > 0"
+        args = ()
+        if players is not None:
+            players = list(players)
+            query += " and player in ({})".format(", ".join("?" for p in players))
+            args = players
+        rows = db_connection.execute(query, args).fetchall()
+        player_names = sorted(set(r[0] for r in rows)) if players is None else players
+        player_index = {p: i for (i, p) in enumerate(player_names)}
+        keep = [(player_index[p], self.relic_index[era + " " + minor])
+            for (p, era, minor) in rows if era + " " + minor in self.relic_index]
+        masks = np.zeros((len(player_names), self.n_words), dtype=np.uint64)
+        if len(keep) > 0:
+            keep.sort()
+            (p_idx, r_idx) = np.array(keep, dtype=np.int64).T
+            # one OR-reduce per player over their (sorted) relic rows
+            starts = np.nonzero(np.r_[True, p_idx[1:] != p_idx[:-1]])[0]
+            masks[p_idx[starts]] = np.bitwise_or.reduceat(
+                self.relic_words[r_idx], starts, axis=0)
+        return (player_names, masks)
+
+    def completable(self, player_names, masks, have=None):
+        """{player: [primes they can finish]} from player_masks() output,
+        plus have ({player: part names}) already in hand."""
+        if have is not None:
+            masks = masks.copy()
+            for (i, p) in enumerate(player_names):
+                masks[i] |= self.mask(have.get(p, ()))
+        covered = self.covered(masks)
+        return {
+            p: [self.prime_names[j] for j in np.nonzero(covered[i])[0]]
+            for (i, p) in enumerate(player_names)
+        }
@@ -0,0 +1,148 @@
+#! /usr/bin/env python3
+# relic_sim.py
+# Monte Carlo squad runs: how many runs until I get a part, or every
+# part of a set?
+#
+# A squad is up to 4 (relic, refinement) pairs, one per member, and
+# after each run I get to pick one reward out of everything the squad
+# rolled. Each trial keeps going until it has every target part,
+# picking the rarest one it still needs when several drop at once.
+# Trials are batched: one numpy step rolls every member's relic for
+# every unfinished trial, with the targets a trial still needs kept as
+# bits in an int64, so the Python loop is per run, not per trial.
+
+import numpy as np
+import relic_value
+
+batch_trials = 200000# trials per numpy batch, keeps the arrays ~100 MB
+max_targets = 62# bits in an int64, less the sign
+
+def squad_tables(rv, squad, targets):
+    """Per-member tables for a squad of (relic name, refinement code).
+
+    Returns (cum, bits, target names): cum[member, slot] is the
+    cumulative chance up to that slot, bits[member, slot] the target
+    bit that slot gives (0 for other parts, and for the "nothing"
+    slot 6). Bit 0 is the rarest target in this squad.
+    """
+    targets = sorted(set(targets))
+    if len(targets) == 0 or len(targets) > max_targets:
+        raise ValueError("need 1 to {} target parts".format(max_targets))
+    for t in targets:
+        if t not in rv.part_index:
+            raise KeyError("unknown part {}".format(t))
+    rows = []
+    for (relic_name, refinement) in squad:
+        if relic_name not in rv.relic_index:
+            raise KeyError("unknown relic {}".format(relic_name))
+        rows.append((rv.relic_index[relic_name], int(refinement)))
+    # how likely each target is per run, so the rarest gets bit 0
+    chance = {
+        t: sum(rv.prob[i, s, ref] for (i, ref) in rows for s in range(6)
+            if rv.slot_part[i, s] == rv.part_index[t])
+        for t in targets
+    }
+    for t in targets:
+        if chance[t] == 0:
+            raise ValueError("nobody in the squad can get {}".format(t))
+    targets.sort(key=lambda t: chance[t])
+    bit_of = {rv.part_index[t]: 1 << b for (b, t) in enumerate(targets)}
+    cum = np.zeros((len(rows), 6))
+    bits = np.zeros((len(rows), 7), dtype=np.int64)
+    for (m, (i, ref)) in enumerate(rows):
+        cum[m] = np.cumsum(rv.prob[i, :, ref])
+        for s in range(6):
+            bits[m, s] = bit_of.get(int(rv.slot_part[i, s]), 0)
+    return (cum, bits, targets)
+
+def simulate_batch(cum, bits, n_trials, max_runs, seed):
+    """Runs needed by each of n_trials trials (max_runs + 1 if a trial
+    didn't finish), as an int32 array."""
+    rng = np.random.default_rng(seed)
+    full = np.int64(0)
+    for b in np.unique(bits):
+        full |= b
+    members = np.arange(cum.shape[0])[None, :]
+    result = np.full(n_trials, max_runs + 1, dtype=np.int32)
+    active = np.arange(n_trials)
+    owned = np.zeros(n_trials, dtype=np.int64)
+    for run in range(1, max_runs + 1):
+        u = rng.random((len(active), cum.shape[0]))
+        slot = (u[:, :, None] >= cum[None, :, :]).sum(axis=2)# 6 = nothing
+        rolled = np.bitwise_or.reduce(bits[members, slot], axis=1)
+        new = rolled & ~owned
+        owned |= new & -new# lowest bit, i.e. rarest still needed
+        done = owned == full
+        if done.any():
+            result[active[done]] = run
+            keep = ~done
+            active = active[keep]
+            owned = owned[keep]
+            if len(active) == 0:
+                break
+    return result
+
+def _simulate_chunk(args):
+    # process pool entry point
+    return simulate_batch(*args)
+
+def simulate(cum, bits, n_trials, max_runs=1000, seed=0, workers=1):
+    """Runs needed per trial over n_trials trials. workers > 1 spreads
+    batches, each with its own seed, over a process pool."""
+    seeds = np.random.SeedSequence(seed).spawn(
+        max(1, -(-n_trials // batch_trials)))
+    sizes = [batch_trials] * (len(seeds) - 1)
+    sizes.append(n_trials - sum(sizes))
+    jobs = [(cum, bits, n, max_runs, s) for (n, s) in zip(sizes, seeds)]
+    if workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers) as pool:
+            chunks = list(pool.map(_simulate_chunk, jobs))
+    else:
+        chunks = [_simulate_chunk(j) for j in jobs]
+    return np.concatenate(chunks)
+
+def summarize(runs, max_runs, z=1.96):
+    """Mean runs with a z-sigma confidence interval, plus percentiles.
+    Unfinished trials are left out of the mean and counted separately."""
+    finished = runs[runs <= max_runs]
+    n = len(finished)
+    mean = float(finished.mean()) if n > 0 else float("nan")
+    half = float(z * finished.std(ddof=1) / np.sqrt(n)) if n > 1 else float("nan")
+    pct = np.percentile(finished, [50, 90, 99]) if n > 0 else [float("nan")] * 3
+    return {
+        "trials": len(runs),
+        "unfinished": len(runs) - n,
+        "mean_runs": mean,
+        "ci_low": mean - half,
+        "ci_high": mean + half,
+        "median": float(pct[0]),
+        "p90": float(pct[1]),
+        "p99": float(pct[2]),
+    }
+
+def best_squad(rv, db_connection, players, targets):
+    """Each player's owned (relic, refinement) most likely to drop any of
+    targets, as a squad. Players with nothing useful are left out."""
+    holdings = rv.holdings(db_connection, players)
+    (player_names, p_idx, r_idx, ref_idx, qty) = holdings
+    chance = rv.drop_chance(targets)[r_idx, ref_idx]
+    squad = []
+    for (p, player) in enumerate(player_names):
+        rows = np.nonzero((p_idx == p) & (chance > 0) & (qty > 0))[0]
+        if len(rows) == 0:
+            continue
+        best = rows[np.argmax(chance[rows])]
+        squad.append((rv.relic_names[r_idx[best]], int(ref_idx[best])))
+    return squad
+
+def parse_member(s):
+    """"Lith V5:Radiant" or "Lith V5:3" -> ("Lith V5", 3); Intact if no
+    refinement is given."""
+    (relic_name, _, refinement) = s.partition(":")
+    if refinement == "":
+        return (relic_name, 0)
+    if refinement.isdigit():
+        return (relic_name, int(refinement))
+    names = [r.lower() for r in relic_value.refinements]
+    return (relic_name, names.index(refinement.lower()))
@@ -0,0 +1,146 @@
+#! /usr/bin/env python3
+# relic_value.py
+# Expected values of relics from their drop tables.
+#
+# Every relic is 6 slots (3 common, 2 uncommon, 1 rare) and each slot's
+# chance depends on the refinement, so the whole catalog is one
+# (relics x 6 slots x 4 refinements) probability tensor. Give it a value
+# per part (ducats, platinum, 1 for "parts I still need") and it gives
+# back expected values for every relic at every refinement, or for every
+# player's whole inventory, without looping over relics in Python.
+
+import numpy as np
+import read_relics
+
+refinements = ["Intact", "Exceptional", "Flawless", "Radiant"]# codes 0-3
+slot_rarities = ["Common"] * 3 + ["Uncommon"] * 2 + ["Rare"]
+
+# chance of each single reward of that rarity, per refinement
+rarity_chances = {
+    "Common":   [0.2533, 0.2333, 0.20, 0.1667],
+    "Uncommon": [0.11, 0.13, 0.17, 0.20],
+    "Rare":     [0.02, 0.04, 0.06, 0.10],
+}
+
+class RelicValues:
+    def __init__(self, registry):
+        self.relic_names = list(registry.relics.keys())
+        self.relic_index = {n: i for (i, n) in enumerate(self.relic_names)}
+        self.part_names = list(registry.parts.keys())
+        self.part_index = {n: i for (i, n) in enumerate(self.part_names)}
+        n_relics = len(self.relic_names)
+        n_parts = len(self.part_names)
+        # slot_part[relic, slot] is a part index, or n_parts for an empty
+        # slot (value vectors get a 0 tacked on the end for it)
+        self.slot_part = np.full((n_relics, 6), n_parts, dtype=np.int32)
+        self.prob = np.zeros((n_relics, 6, 4))
+        self.vaulted = np.zeros(n_relics, dtype=np.int8)
+        chances = np.array([rarity_chances[r] for r in slot_rarities])
+        for (i, name) in enumerate(self.relic_names):
+            relic = registry.relics[name]
+            self.vaulted[i] = relic.vaulted
+            slot = 0
+            for rarity in ["Common", "Uncommon", "Rare"]:
+                # n.b. the dump lists a reward once even if a relic has it
+                # twice, so a doubled-up relic just has an empty slot here
+                want = slot_rarities.count(rarity)
+                parts = sorted(p.full_name() for p in relic.rewards[rarity])
+                if len(parts) > want:
+                    raise ValueError("{} has {} {} rewards, expected {}".format(
+                        name, len(parts), rarity, want))
+                for (k, part_name) in enumerate(parts):
+                    self.slot_part[i, slot + k] = self.part_index[part_name]
+                    self.prob[i, slot + k] = chances[slot + k]
+                slot += want
+
+    def value_vector(self, values, default=0.0):
+        """Turns {part full name: value} into a vector over parts."""
+        v = np.full(len(self.part_names), float(default))
+        for (name, value) in values.items():
+            if name in self.part_index:
+                v[self.part_index[name]] = value
+        return v
+
+    def _padded(self, part_values):
+        pv = np.asarray(part_values, dtype=float)
+        pad = [(0, 0)] * (pv.ndim - 1) + [(0, 1)]
+        return np.pad(pv, pad)# the empty-slot column
+
+    def relic_ev(self, part_values):
+        """Expected value of one crack of each relic at each refinement.
+
+        part_values is (parts,) -> returns (relics, 4), or
+        (k, parts) for k value vectors at once -> returns (k, relics, 4).
+        """
+        pv = self._padded(part_values)
+        slot_values = pv[..., self.slot_part]# (..., relics, 6)
+        return np.einsum("...ns,nsr->...nr", slot_values, self.prob)
+
+    def drop_chance(self, part_names):
+        """Chance of getting any of part_names per relic and refinement."""
+        return self.relic_ev(self.value_vector({n: 1 for n in part_names}))
+
+    def holdings(self, db_connection, players=None):
+        """has_relic as flat arrays: (player names, player, relic,
+        refinement, quantity), one entry per row held. Relics the
+        registry doesn't know about are left out."""
+        query = """select player, era, minor, refinement, quantity
+            from has_relic where quantity > 0"""
+        args = ()
+        if players is not None:
+            players = list(players)
+            query += " and player in ({})".format(
+                ", ".join("?" for p in players))
+            args = players
+        rows = db_connection.execute(query, args).fetchall()
+        player_names = sorted(set(r[0] for r in rows)) \
+            if players is None else players
+        player_index = {p: i for (i, p) in enumerate(player_names)}
+        keep = [r for r in rows if r[1] + " " + r[2] in self.relic_index]
+        p_idx = np.array([player_index[r[0]] for r in keep], dtype=np.int32)
+        r_idx = np.array(
+            [self.relic_index[r[1] + " " + r[2]] for r in keep], dtype=np.int32)
+        ref_idx = np.array([int(r[3]) for r in keep], dtype=np.int8)
+        qty = np.array([r[4] for r in keep], dtype=float)
+        return (player_names, p_idx, r_idx, ref_idx, qty)
+
+    def row_ev(self, part_values, holdings):
+        """Expected value of one crack for each has_relic row.
+
+        part_values is (parts,) for everyone, or (players, parts) in
+        the same player order as holdings for per-player values like
+        "parts I still need".
+        """
+        (player_names, p_idx, r_idx, ref_idx, qty) = holdings
+        pv = np.asarray(part_values, dtype=float)
+        if pv.ndim == 1:
+            return self.relic_ev(pv)[r_idx, ref_idx]
+        pv = self._padded(pv)
+        slot_values = pv[p_idx[:, None], self.slot_part[r_idx]]# (rows, 6)
+        return np.einsum(
+            "ks,ks->k", slot_values, self.prob[r_idx, :, ref_idx])
+
+    def player_ev(self, part_values, holdings):
+        """Total expected value of cracking everything each player owns."""
+        (player_names, p_idx, r_idx, ref_idx, qty) = holdings
+        per_row = self.row_ev(part_values, holdings) * qty
+        return np.bincount(p_idx, weights=per_row, minlength=len(player_names))
+
+def needs_matrix(rv, player_names, needs):
+    """(players, parts) 0/1 matrix from {player: set of part names}."""
+    m = np.zeros((len(player_names), len(rv.part_names)))
+    for (i, player) in enumerate(player_names):
+        for name in needs.get(player, ()):
+            if name in rv.part_index:
+                m[i, rv.part_index[name]] = 1
+    return m
+
+if __name__ == "__main__":
+    rv = RelicValues(read_relics.load_registry(read_relics.source_table))
+    forma = rv.drop_chance(["Forma Blueprint"])
+    print("Best unvaulted relics for Forma, chance per crack:")
+    print("relic\t" + "\t".join(refinements))
+    order = np.argsort(-forma[:, 0])
+    for i in [i for i in order if rv.vaulted[i] == 0][:10]:
+        print(rv.relic_names[i] + "\t" +
+            "\t".join("{:.3f}".format(c) for c in forma[i]))
@@ -0,0 +1,109 @@
+#! /usr/bin/env python3
+# synthetic.py
+# Made-up catalogs for benchmarking, shaped like the wiki dump.
+
+import random
+import read_relics, relic_db
+
+eras = ["Lith", "Meso", "Neo", "Axi"]
+roles = ["Blueprint", "Chassis", "Neuroptics", "Systems",
+    "Barrel", "Receiver", "Stock", "Blade", "Handle", "Link"]
+
+def relic_names(n_relics):
+    # "Lith A1", "Meso A1", ... "Axi Z9", "Lith A10", ...
+    names = []
+    gen = 1
+    while len(names) < n_relics:
+        for letter in "ABCDEFGHIJKLMNOPQRSTUVWXYZ":
+            for era in eras:
+                names.append("{} {}{}".format(era, letter, gen))
+                if len(names) == n_relics:
+                    return names
+        gen += 1
+    return names
+
+def synthetic_records(n_relics, parts_per_prime=4, relics_per_part=4, seed=0):
+    """Yields (prime, part, relic, rarity, vaulted) records like iter_records.
+
+    Every relic gets 3 commons, 2 uncommons and a rare, and records come
+    out grouped by prime and part the way the dump lists them.
+    """
+    rng = random.Random(seed)
+    names = relic_names(n_relics)
+    vaulted = {n: rng.choice([0, 0, 1]) for n in names}
+    n_parts = max(1, (n_relics * 6) // relics_per_part)
+    parts = []
+    for i in range(n_parts):
+        prime = "Synth{} Prime".format(i // parts_per_prime)
+        parts.append((prime, roles[i % parts_per_prime % len(roles)]))
+    drops = {}# part index -> [(relic, rarity)]
+    for n in names:
+        picks = rng.sample(range(n_parts), min(6, n_parts))
+        for (slot, p) in enumerate(picks):
+            rarity = "Common" if slot < 3 else \
+                "Uncommon" if slot < 5 else "Rare"
+            drops.setdefault(p, []).append((n, rarity))
+    for p in sorted(drops):
+        (prime, role) = parts[p]
+        for (relic, rarity) in drops[p]:
+            yield (prime, role, relic, rarity, vaulted[relic])
+
+def synthetic_inventory(relic_keys, n_players, relics_per_player=60, seed=0):
+    """Yields has_relic rows (player, era, minor, refinement, quantity)."""
+    rng = random.Random(seed)
+    relic_keys = list(relic_keys)
+    for p in range(n_players):
+        player = "player{}".format(p)
+        owned = rng.sample(relic_keys, min(relics_per_player, len(relic_keys)))
+        for (era, minor) in owned:
+            # mostly intact, some radiant, the odd one in between
+            refinement = rng.choice("0000000312")
+            yield (player, era, minor, refinement, rng.randint(1, 30))
+
+def build_synthetic_db(db_connection, n_relics, n_players,
+        relics_per_player=60, seed=0, indexes=True):
+    """Fills an empty database with a synthetic catalog and inventories.
+
+    Returns the Registry the catalog came from.
+    """
+    reg = read_relics.build_registry(synthetic_records(n_relics, seed=seed))
+    cur = db_connection.cursor()
+    relic_db.create_tables(cur)
+    relic_db.load_catalog(cur, reg)
+    cur.executemany(
+        """insert into has_relic (player, era, minor, refinement, quantity)
+        values (?, ?, ?, ?, ?)""",
+        synthetic_inventory(
+            [(r.era, r.minor_name) for r in reg.relics.values()],
+            n_players, relics_per_player, seed))
+    relic_db.create_part_index(cur)
+    if indexes:
+        relic_db.create_indexes(cur)
+    db_connection.commit()
+    return reg
+
+def dump_lines(records):
+    """Formats records the way the wiki dump lays them out: an image line
+    per prime, prime and part only on the first line they apply to."""
+    last_prime = None
+    last_part = None
+    for (prime, part, relic, rarity, vaulted) in records:
+        reward = relic + " " + rarity + ["", " (V)", " (B)"][vaulted]
+        if prime != last_prime:
+            yield prime.replace(" ", "")# the image marker line
+            yield prime + " \t" + part + " \t" + reward
+        elif part != last_part:
+            yield part + " \t" + reward
+        else:
+            yield reward
+        (last_prime, last_part) = (prime, part)
+
+def write_dump(path, n_lines, seed=0):
+    """Writes a synthetic dump of about n_lines lines; returns the count."""
+    n = 0
+    with open(path, "w") as outfile:
+        # a relic is 6 reward lines, plus an image line every few primes
+        for line in dump_lines(synthetic_records(max(1, n_lines // 6), seed=seed)):
+            outfile.write(line + "\n")
+            n += 1
+    return n
@@ -0,0 +1,30 @@
+import importlib.util, os, sqlite3, sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+import synthetic
+
+def load_script(name, directory):
+    """Imports one of the hyphenated scripts. They open their default
+    database where they run, so that happens in directory."""
+    old_cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        spec = importlib.util.spec_from_file_location(
+            name[:-len(".py")].replace("-", "_"), os.path.join(root, name))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(old_cwd)
+    return module
+
+@pytest.fixture
+def synthetic_db(tmp_path):
+    """(path, connection, registry) of a small synthetic database."""
+    path = str(tmp_path / "relics.db")
+    con = sqlite3.connect(path)
+    reg = synthetic.build_synthetic_db(con, 40, 3, relics_per_player=10)
+    yield (path, con, reg)
+    con.close()
@@ -0,0 +1,58 @@
+import pytest
+import ownership_io
+
+def holdings(con):
+    return sorted(con.execute(
+        "select player, era, minor, refinement, quantity from has_relic"))
+
+@pytest.mark.parametrize("name", ["inventory.tsv", "inventory.csv"])
+def test_export_then_import_round_trips(synthetic_db, tmp_path, name):
+    (path, con, reg) = synthetic_db
+    before = holdings(con)
+    out = str(tmp_path / name)
+    assert ownership_io.export_file(out, con) == len(before)
+    with open(out) as infile:
+        text = infile.read()
+    assert "Intact" in text and "Radiant" in text
+    con.execute("delete from has_relic")
+    con.commit()
+    assert ownership_io.import_files([out], con) == \
+        {"rows": len(before), "players": 3}
+    assert holdings(con) == before
+
+def test_replace_clears_the_players_in_the_file(synthetic_db, tmp_path):
+    (path, con, reg) = synthetic_db
+    out = str(tmp_path / "player0.tsv")
+    ownership_io.export_file(out, con, ["player0"])
+    before = holdings(con)
+    (era, minor) = con.execute("""select era, minor from relic
+        where (era, minor) not in (select era, minor from has_relic
+            where player = 'player0') limit 1""").fetchone()
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        values ('player0', ?, ?, '2', 4)""", (era, minor))
+    con.execute("update has_relic set quantity = 99 where player = 'player0'")
+    con.commit()
+    ownership_io.import_files([out], con)
+    # upserted back, but the extra holding stays
+    assert len(holdings(con)) == len(before) + 1
+    ownership_io.import_files([out], con, replace=True)
+    assert holdings(con) == before
+
+@pytest.mark.parametrize("bad_line", [
+    "player0\tLith\tQ99\t1\tIntact",
+    "player0\tLith\tA1\t-3\tIntact",
+    "player0\tLith\tA1\tmany\tIntact",
+    "player0\tLith\tA1\t1\tShiny",
+    "player0\tLith\tA1\t1",
+])
+def test_bad_line_rolls_back_the_whole_import(synthetic_db, tmp_path, bad_line):
+    (path, con, reg) = synthetic_db
+    before = holdings(con)
+    good = tmp_path / "good.tsv"
+    good.write_text("player0\tAxi\tA1\t12\tRadiant\nnewbie\tLith\tA1\t1\tIntact\n")
+    bad = tmp_path / "bad.tsv"
+    bad.write_text("newbie\tMeso\tA1\t2\tIntact\n" + bad_line + "\n")
+    with pytest.raises(ValueError, match="nothing imported") as e:
+        ownership_io.import_files([str(good), str(bad)], con, replace=True)
+    assert "bad.tsv:2" in str(e.value)
+    assert holdings(con) == before
@@ -0,0 +1,73 @@
+import random
+import read_relics, relic_db, synthetic
+
+drops_join = """select reward.base, reward.role, reward.era, reward.minor,
+        reward.rarity, relic.vaulted
+    from reward join relic
+        on relic.era = reward.era and relic.minor = reward.minor"""
+owners_join = """select distinct reward.base, reward.role, reward.era,
+        reward.minor, has_relic.player, has_relic.refinement,
+        has_relic.quantity, relic.vaulted
+    from reward
+    join relic on relic.era = reward.era and relic.minor = reward.minor
+    join has_relic
+        on has_relic.era = reward.era and has_relic.minor = reward.minor"""
+
+def check(con):
+    assert con.execute("select count(*) from part_owner").fetchone()[0] > 0
+    assert sorted(con.execute("select * from part_drop")) == \
+        sorted(con.execute(drops_join))
+    assert sorted(con.execute("""select base, role, era, minor, player,
+            refinement, quantity, vaulted from part_owner""")) == \
+        sorted(con.execute(owners_join))
+
+def test_part_index_tracks_the_join(synthetic_db):
+    (path, con, reg) = synthetic_db
+    cur = con.cursor()
+    rng = random.Random(0)
+    keys = con.execute("select era, minor from relic").fetchall()
+    check(con)
+
+    for i in range(30):# new holdings
+        (era, minor) = rng.choice(keys)
+        cur.execute("""insert or ignore into has_relic
+            (player, era, minor, refinement, quantity) values (?, ?, ?, ?, ?)""",
+            ("newcomer", era, minor, rng.choice("0123"), rng.randint(1, 9)))
+    check(con)
+    cur.execute("""update has_relic set quantity = 0 where rowid in
+        (select rowid from has_relic order by rowid limit 15)""")
+    check(con)
+    cur.execute("""update has_relic set quantity = quantity + 1
+        where player = 'player1'""")
+    cur.execute("""update or ignore has_relic set refinement = '3'
+        where player = 'player2' and refinement = '0'""")
+    check(con)
+    cur.execute("delete from has_relic where player = 'player0'")
+    cur.execute("""delete from has_relic where rowid in
+        (select rowid from has_relic order by rowid desc limit 5)""")
+    check(con)
+    cur.execute("update relic set vaulted = 1 - vaulted where rowid % 3 = 0")
+    check(con)
+    # catalog edits the way relic_incremental makes them
+    (era, minor) = keys[0]
+    (base, role) = con.execute("select base, role from part limit 1").fetchone()
+    cur.execute("delete from reward where era = ? and minor = ?", (era, minor))
+    check(con)
+    cur.execute("""insert or ignore into reward (era, minor, base, role, rarity)
+        values (?, ?, ?, ?, 'Rare')""", (era, minor, base, role))
+    check(con)
+    con.commit()
+
+    # a rebuild from a different catalog, with holdings of relics in both
+    new_reg = read_relics.build_registry(synthetic.synthetic_records(40, seed=5))
+    relic_db.rebuild_catalog(cur, new_reg)
+    check(con)
+    cur.execute("""update has_relic set quantity = 0
+        where player = 'player1' and rowid % 2 = 0""")
+    cur.execute("delete from has_relic where player = 'newcomer'")
+    check(con)
+    con.commit()
+    relic_db.shadow_rebuild(path, reg, con)
+    check(con)
+    cur.execute("delete from has_relic where player = 'player2'")
+    check(con)
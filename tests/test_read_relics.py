@@ -0,0 +1,109 @@
+import os
+import pytest
+import conftest, read_relics, synthetic
+
+real_dump = os.path.join(conftest.root, read_relics.source_table)
+
+@pytest.fixture(params=["real", "synthetic"])
+def dump(request, tmp_path):
+    if request.param == "real":
+        return real_dump
+    path = str(tmp_path / "dump.txt")
+    synthetic.write_dump(path, 3000, seed=1)
+    return path
+
+@pytest.mark.parametrize("workers", [1, 2, 3, 7])
+def test_parallel_parse_builds_the_same_registry(dump, workers, monkeypatch):
+    monkeypatch.setattr(read_relics, "parallel_min_bytes", 0)
+    expected = list(read_relics.read_relics(dump).records())
+    assert len(expected) > 0
+    # workers * 4 ranges, so most cuts land partway into the dump's blocks
+    points = read_relics.split_points(dump, workers * 4)
+    assert len(points) > 2 or workers == 1
+    reg = read_relics.read_relics_parallel(dump, workers)
+    assert list(reg.records()) == expected
+
+@pytest.fixture
+def dump_copy(tmp_path, monkeypatch):
+    monkeypatch.setattr(read_relics, "use_cache", True)
+    path = str(tmp_path / "dump.txt")
+    with open(real_dump, "rb") as infile, open(path, "wb") as outfile:
+        outfile.write(infile.read())
+    return path
+
+def relic_names(reg):
+    return set(reg.relics.keys())
+
+def edit(path, old, new):
+    with open(path, "rb") as infile:
+        data = infile.read()
+    assert data.count(old) == 1
+    with open(path, "wb") as outfile:
+        outfile.write(data.replace(old, new))
+    st = os.stat(path)# make sure the mtime moves, however coarse the clock
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+def test_snapshot_of_another_version_is_ignored(dump_copy, monkeypatch):
+    read_relics.load_registry(dump_copy)
+    assert read_relics.load_snapshot(dump_copy) is not None
+    monkeypatch.setattr(read_relics, "cache_version", read_relics.cache_version + 1)
+    assert read_relics.load_snapshot(dump_copy) is None
+
+def test_snapshot_is_stale_once_the_size_changes(dump_copy):
+    read_relics.load_registry(dump_copy)
+    with open(dump_copy, "ab") as outfile:
+        outfile.write(b"\r\nNeo Z9 Common")
+    assert read_relics.load_snapshot(dump_copy) is None
+    assert "Neo Z9" in relic_names(read_relics.load_registry(dump_copy))
+
+def test_same_size_edit_is_caught_by_the_hash(dump_copy):
+    assert "Lith A9" not in relic_names(read_relics.load_registry(dump_copy))
+    edit(dump_copy, b"Barrel \tLith A3 Uncommon", b"Barrel \tLith A9 Uncommon")
+    assert read_relics.load_snapshot(dump_copy) is None
+    assert "Lith A9" in relic_names(read_relics.load_registry(dump_copy))
+
+def test_touched_dump_is_hashed_once(dump_copy, monkeypatch):
+    expected = relic_names(read_relics.load_registry(dump_copy))
+    edit(dump_copy, b"Barrel \tLith A3 Uncommon", b"Barrel \tLith A3 Uncommon")
+    assert relic_names(read_relics.load_snapshot(dump_copy)) == expected
+    def no_hashing():
+        raise AssertionError("hashed the dump again")
+    monkeypatch.setattr(read_relics.hashlib, "sha256", no_hashing)
+    assert relic_names(read_relics.load_snapshot(dump_copy)) == expected
+
+def test_dump_rewritten_during_the_parse_isnt_snapshotted(dump_copy,
+        monkeypatch):
+    parse = read_relics.read_relics
+    def parse_then_rewrite(input_file, **kwargs):
+        reg = parse(input_file, **kwargs)
+        edit(input_file, b"Barrel \tLith A3 Uncommon", b"Barrel \tLith A9 Uncommon")
+        return reg
+    monkeypatch.setattr(read_relics, "read_relics", parse_then_rewrite)
+    assert "Lith A3" in relic_names(read_relics.load_registry(dump_copy))
+    assert not os.path.exists(dump_copy + read_relics.cache_suffix)
+    monkeypatch.setattr(read_relics, "read_relics", parse)
+    assert "Lith A9" in relic_names(read_relics.load_registry(dump_copy))
+
+def view(registry):
+    # everything a caller can reach through either registry, by name
+    return (
+        {n: (r.name, r.era, r.minor_name, r.vaulted, {rarity: sorted(
+            p.full_name() for p in parts) for (rarity, parts)
+            in r.rewards.items()}) for (n, r) in registry.relics.items()},
+        {n: sorted(p.parts) for (n, p) in registry.primes.items()},
+        {n: (p.role, p.prime_obj.name, p.full_name(), {r: (o.name, rarity)
+            for (r, (o, rarity)) in p.relics.items()})
+            for (n, p) in registry.parts.items()},
+        sorted(registry.records()),
+    )
+
+def test_compact_registry_matches_the_plain_one(synthetic_db):
+    (path, con, reg) = synthetic_db
+    records = list(reg.records())
+    (head, tail) = (records[:len(records) // 2], records[len(records) // 2:])
+    plain = read_relics.build_registry(records + head)# repeats are no-ops
+    compact = read_relics.build_registry(head, read_relics.new_registry(True))
+    view(compact)# builds the indexes, which registering more has to reset
+    read_relics.build_registry(tail + head, compact)
+    assert view(compact) == view(plain) == view(reg)
+    assert not hasattr(next(iter(compact.relics.values())), "__dict__")
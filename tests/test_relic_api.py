@@ -0,0 +1,39 @@
+import json
+import pytest
+import relic_api, relic_db
+
+@pytest.fixture
+def api(synthetic_db):
+    (path, con, reg) = synthetic_db
+    pool = relic_db.ConnectionPool(path, 2)
+    yield relic_api.Api(pool)
+    pool.close()
+
+def post(api, items):
+    return api.handle("POST", "/players/p/inventory", {},
+        json.dumps(items).encode("utf-8"))
+
+def test_upsert_rejects_boolean_quantities(api):
+    for quantity in [True, False]:
+        (status, etag, body) = post(api,
+            [{"era": "Axi", "minor": "A1", "quantity": quantity}])
+        assert status == 400, body
+    assert post(api, [{"era": "Axi", "minor": "A1", "quantity": 2}])[0] == 200
+    assert api.stats()["requests"] == 3
+
+@pytest.mark.parametrize("item", [
+    {"era": ["Axi"], "minor": "A1", "quantity": 1},
+    {"era": "Axi", "minor": {"A": 1}, "quantity": 1},
+    ["Axi", "A1", 1],
+])
+def test_upsert_rejects_malformed_items_with_400(api, item):
+    (status, etag, body) = post(api, [item])
+    assert status == 400, body
+
+def test_current_etag_on_an_unknown_path_is_still_404(api):
+    (status, etag, body) = api.handle("GET", "/relics", {}, b"")
+    assert (status, etag is not None) == (200, True)
+    sent = {"if-none-match": etag}
+    assert api.handle("GET", "/relics", sent, b"")[0] == 304
+    for path in ["/nothing/here", "/relics/Axi/Q99", "/players/nobody/inventory"]:
+        assert api.handle("GET", path, sent, b"")[0] == 404
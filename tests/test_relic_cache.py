@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+import relic_cache, relic_db
+
+@pytest.fixture
+def cache(synthetic_db):
+    (path, con, reg) = synthetic_db
+    probe = sqlite3.connect(path)
+    yield relic_cache.Cache(probe)
+    probe.close()
+
+def counting(value):
+    calls = []
+    def load():
+        calls.append(1)
+        return value
+    return (load, calls)
+
+def test_hits_while_nothing_changes(cache):
+    (load, calls) = counting(("x",))
+    for i in range(3):
+        assert cache.get("k", load) == ("x",)
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 2
+
+def test_ownership_write_elsewhere_drops_plain_entries_only(cache, synthetic_db):
+    (path, con, reg) = synthetic_db
+    (load_plain, plain) = counting(1)
+    (load_catalog, catalog) = counting(2)
+    cache.get("players", load_plain)
+    cache.get("eras", load_catalog, catalog=True)
+    con.execute("update has_relic set quantity = quantity + 1 where rowid = 1")
+    con.commit()# another connection: seen through data_version
+    cache.get("players", load_plain)
+    cache.get("eras", load_catalog, catalog=True)
+    assert (len(plain), len(catalog)) == (2, 1)
+
+def test_write_through_the_probe_drops_plain_entries(cache):
+    (load, calls) = counting(1)
+    cache.get("players", load)
+    cache.probe.execute("delete from has_relic where rowid = 1")
+    cache.probe.commit()# data_version doesn't move for its own writes
+    cache.get("players", load)
+    assert len(calls) == 2
+
+def test_catalog_generation_drops_catalog_entries(cache, synthetic_db):
+    (path, con, reg) = synthetic_db
+    (load, calls) = counting(2)
+    cache.get("eras", load, catalog=True)
+    relic_db.bump_generation(con.cursor())
+    con.commit()
+    cache.get("eras", load, catalog=True)
+    assert len(calls) == 2
+    assert cache.stats()["invalidations"] == 1
+
+def test_query_results_follow_the_data(cache, synthetic_db):
+    (path, con, reg) = synthetic_db
+    sql = "select count(*) from has_relic where player = ?"
+    before = cache.query(sql, ("player0",))[0][0]
+    con.execute("delete from has_relic where player = 'player0'")
+    con.commit()
+    assert before > 0
+    assert cache.query(sql, ("player0",)) == ((0,),)
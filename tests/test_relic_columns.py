@@ -0,0 +1,15 @@
+import relic_columns
+
+def test_export_skips_orphan_holdings(synthetic_db, tmp_path):
+    (path, con, reg) = synthetic_db
+    before = con.execute("select count(*) from has_relic").fetchone()[0]
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        values ('player0', 'Lith', 'Z99', '0', 4)""")
+    out = str(tmp_path / "cols")
+    for full in [True, False]:# the catalog, then has_relic on its own
+        relic_columns.export(con, out, full)
+        manifest = relic_columns.read_manifest(out)
+        assert manifest["tables"]["has_relic"]["rows"] == before
+        assert manifest["tables"]["has_relic"]["orphans"] == 1
+    columns = relic_columns.load(out)
+    assert len(columns["has_relic"]["relic"]) == before
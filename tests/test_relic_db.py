@@ -0,0 +1,128 @@
+import os, sqlite3
+import pytest
+import read_relics, relic_db, relic_history, synthetic
+
+def index_names(con):
+    return set(r[0] for r in con.execute(
+        "select name from sqlite_master where type = 'index'"))
+
+def test_retired_indexes_are_dropped(synthetic_db):
+    (path, con, reg) = synthetic_db
+    con.execute("""create index has_relic_by_player
+        on has_relic (player, era, minor, refinement, quantity)""")
+    con.commit()
+    relic_db.shadow_rebuild(path, reg, con)
+    assert "has_relic_by_player" not in index_names(con)
+    assert set(relic_db.indexes) <= index_names(con)
+    con.execute("""create index has_relic_by_player
+        on has_relic (player, era, minor, refinement, quantity)""")
+    relic_db.create_indexes(con.cursor())
+    assert "has_relic_by_player" not in index_names(con)
+
+def rows(con, table):
+    return sorted(con.execute('select * from "{}"'.format(table)))
+
+def everything(con):
+    return list(con.iterdump())
+
+@pytest.fixture
+def with_history(synthetic_db):
+    (path, con, reg) = synthetic_db
+    cur = con.cursor()
+    relic_history.create_event_log(cur)
+    cur.execute("update has_relic set quantity = quantity + 2 where rowid % 4 = 0")
+    cur.execute("delete from has_relic where rowid % 9 = 0")
+    relic_history.snapshot(cur)
+    cur.execute("update has_relic set quantity = 0 where rowid % 5 = 0")
+    con.commit()
+    return synthetic_db
+
+kept_tables = ["has_relic", "ownership_event", "ownership_snapshot", "snapshot_row"]
+
+def test_shadow_rebuild_keeps_everything_but_the_catalog(with_history):
+    (path, con, reg) = with_history
+    before = {t: rows(con, t) for t in kept_tables}
+    generation = con.execute("pragma user_version").fetchone()[0]
+    assert relic_db.shadow_rebuild(path, reg, con) == 1
+    for t in kept_tables:
+        assert rows(con, t) == before[t], t
+    for t in relic_db.catalog_tables:
+        assert rows(con, t) == sorted(set(relic_db.catalog_rows(reg, t))), t
+    assert con.execute("pragma user_version").fetchone()[0] == generation + 1
+    # and the history triggers came along
+    con.execute("update has_relic set quantity = 77 where rowid = 2")
+    assert con.execute("""select quantity from ownership_event
+        order by id desc limit 1""").fetchone()[0] == 77
+
+def test_write_during_the_build_means_building_again(with_history, monkeypatch):
+    (path, con, reg) = with_history
+    build = relic_db._build_shadow
+    builds = []
+    def build_then_write(shadow, path, registry):
+        shadow_con = build(shadow, path, registry)
+        builds.append(1)
+        if len(builds) == 1:# lands after the shadow copied has_relic
+            other = sqlite3.connect(path)
+            other.execute("""insert into has_relic
+                (player, era, minor, refinement, quantity)
+                select 'latecomer', era, minor, '0', 5 from relic limit 1""")
+            other.commit()
+            other.close()
+        return shadow_con
+    monkeypatch.setattr(relic_db, "_build_shadow", build_then_write)
+    assert relic_db.shadow_rebuild(path, reg, con) == 2
+    assert con.execute("""select quantity from has_relic
+        where player = 'latecomer'""").fetchall() == [(5,)]
+    assert con.execute("""select count(*) from ownership_event
+        where player = 'latecomer'""").fetchone()[0] == 1
+
+def test_database_that_keeps_changing_is_left_alone(with_history, monkeypatch):
+    (path, con, reg) = with_history
+    build = relic_db._build_shadow
+    def build_then_write(shadow, path, registry):
+        shadow_con = build(shadow, path, registry)
+        other = sqlite3.connect(path)
+        other.execute("update has_relic set quantity = quantity + 1 where rowid = 1")
+        other.commit()
+        other.close()
+        return shadow_con
+    monkeypatch.setattr(relic_db, "_build_shadow", build_then_write)
+    new_reg = read_relics.build_registry(synthetic.synthetic_records(40, seed=5))
+    with pytest.raises(RuntimeError):
+        relic_db.shadow_rebuild(path, new_reg, con, attempts=2)
+    assert rows(con, "relic") == sorted(set(relic_db.catalog_rows(reg, "relic")))
+    assert not os.path.exists(path + ".rebuild")
+
+class FailingCheck:
+    # a shadow connection whose quick_check finds a problem
+    def __init__(self, con):
+        self.con = con
+
+    def execute(self, sql, *args):
+        if sql == "pragma quick_check":
+            return self.con.execute("select 'page 7: btree broken'")
+        return self.con.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+def test_failed_quick_check_leaves_the_database_untouched(with_history,
+        monkeypatch):
+    (path, con, reg) = with_history
+    before = everything(con)
+    build = relic_db._build_shadow
+    monkeypatch.setattr(relic_db, "_build_shadow",
+        lambda *args: FailingCheck(build(*args)))
+    with pytest.raises(ValueError, match="quick_check"):
+        relic_db.shadow_rebuild(path, reg, con)
+    assert everything(con) == before
+    assert not os.path.exists(path + ".rebuild")
+
+def test_orphaning_rebuild_is_refused(with_history):
+    (path, con, reg) = with_history
+    before = everything(con)
+    # a catalog that lacks relics people hold
+    smaller = read_relics.build_registry(synthetic.synthetic_records(8, seed=5))
+    with pytest.raises(ValueError, match="lose their relic"):
+        relic_db.shadow_rebuild(path, smaller, con)
+    assert everything(con) == before
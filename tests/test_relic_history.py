@@ -0,0 +1,100 @@
+import math, random, time
+import relic_history
+
+def replay(con, at, player=None):
+    # brute force: the first snapshot (history starts there), then every
+    # event up to `at`
+    first = con.execute("""select min(id) from ownership_snapshot
+        where at <= ?""", (at,)).fetchone()[0]
+    held = {}
+    for (p, era, minor, refinement, quantity) in con.execute(
+            """select player, era, minor, refinement, quantity
+            from snapshot_row where snapshot = ?""", (first,)):
+        held[(p, era, minor, refinement)] = quantity
+    for (p, era, minor, refinement, quantity) in con.execute(
+            """select player, era, minor, refinement, quantity
+            from ownership_event where at <= ? order by id""", (at,)):
+        if quantity > 0:
+            held[(p, era, minor, refinement)] = quantity
+        else:
+            held.pop((p, era, minor, refinement), None)
+    return {k: q for (k, q) in held.items() if player is None or k[0] == player}
+
+def test_inventory_at_matches_a_full_replay(synthetic_db):
+    (path, con, reg) = synthetic_db
+    cur = con.cursor()
+    relic_history.create_event_log(cur)
+    con.commit()
+    rng = random.Random(0)
+    keys = con.execute("select era, minor from relic").fetchall()
+    players = ["player0", "player1", "player2"]
+    times = []
+    for step in range(60):
+        for i in range(rng.randint(1, 8)):
+            (era, minor) = rng.choice(keys)
+            (player, refinement) = (rng.choice(players), rng.choice("0123"))
+            if rng.random() < 0.2:
+                cur.execute("""delete from has_relic where player = ? and era = ?
+                    and minor = ? and refinement = ?""",
+                    (player, era, minor, refinement))
+            else:
+                cur.execute("""insert into has_relic
+                    (player, era, minor, refinement, quantity)
+                    values (?, ?, ?, ?, ?) on conflict do update
+                    set quantity = excluded.quantity""",
+                    (player, era, minor, refinement, rng.randint(0, 5)))
+        relic_history.maybe_snapshot(cur, every=20)
+        con.commit()
+        times.append(time.time())
+        time.sleep(0.002)
+    assert con.execute("select count(*) from ownership_snapshot").fetchone()[0] > 3
+    for t in [times[0] - 10] + times[::7] + [math.inf]:
+        assert relic_history.inventory_at(con, t) == replay(con, t)
+        assert relic_history.inventory_at(con, t, "player1") == \
+            replay(con, t, "player1")
+    now = {(p, era, minor, r): q for (p, era, minor, r, q) in con.execute(
+        """select player, era, minor, refinement, quantity from has_relic
+        where quantity > 0""")}
+    assert relic_history.inventory_at(con, math.inf) == now
+    for (since, until) in [(times[3], times[40]), (times[10], times[11]),
+            (times[0] - 10, math.inf)]:
+        (before, after) = (replay(con, since), replay(con, until))
+        expected = {k: (before.get(k, 0), after.get(k, 0))
+            for k in set(before) | set(after)
+            if before.get(k, 0) != after.get(k, 0)}
+        assert relic_history.changes_between(con, since, until) == expected
+
+def test_inventory_at_reads_no_further_than_the_next_snapshot(synthetic_db):
+    (path, con, reg) = synthetic_db
+    cur = con.cursor()
+    relic_history.create_event_log(cur)
+    keys = con.execute("select era, minor from relic").fetchall()
+
+    def churn(n):
+        for i in range(n):
+            (era, minor) = keys[i % len(keys)]
+            cur.execute("""insert into has_relic
+                (player, era, minor, refinement, quantity)
+                values ('churn', ?, ?, '0', ?) on conflict do update
+                set quantity = excluded.quantity""", (era, minor, i % 7 + 1))
+            relic_history.maybe_snapshot(cur, every=100)
+        con.commit()
+
+    def steps(at):
+        counter = [0]
+        def tick():
+            counter[0] += 1
+        con.set_progress_handler(tick, 1)
+        try:
+            relic_history.inventory_at(con, at, "churn")
+        finally:
+            con.set_progress_handler(None, 1)
+        return counter[0]
+
+    churn(250)
+    t = time.time()
+    time.sleep(0.002)
+    churn(50)
+    before = steps(t)
+    churn(5000)# the log grows twentyfold after t
+    assert steps(t) < 1.5 * before
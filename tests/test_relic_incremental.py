@@ -0,0 +1,84 @@
+import sqlite3
+import conftest, read_relics, relic_db, relic_incremental, synthetic
+
+def write(path, lines):
+    with open(path, "w") as outfile:
+        outfile.write("\n".join(lines) + "\n")
+
+def blocks(lines):
+    # [(start, end)] of each prime block
+    starts = [i for (i, line) in enumerate(lines)
+        if read_relics.is_image_line(line)] + [len(lines)]
+    return list(zip(starts[:-1], starts[1:]))
+
+def edited(lines):
+    lines = list(lines)
+    spans = blocks(lines)
+    # rename a part: block 2's second part line
+    (start, end) = spans[2]
+    i = next(i for i in range(start + 2, end) if " \t" in lines[i])
+    lines[i] = "Carapace \t" + lines[i].split(" \t", 1)[1]
+    # strip the prime name from the first line of block 5, so its
+    # rewards now go to the prime before
+    (start, end) = spans[5]
+    lines[start + 1] = lines[start + 1].split(" \t", 1)[1]
+    # flip the flag on a later line of two relics whose first line is in
+    # an earlier, untouched block: the full parse goes by the first line,
+    # so neither relic's vaulted should change
+    first_block = {}
+    for (n, (start, end)) in enumerate(spans):
+        for i in range(start + 1, end):
+            relic = " ".join(lines[i].split(" \t")[-1].split(" ")[:2])
+            first_block.setdefault(relic, n)
+    flipped = []
+    for (start, end) in spans[9:]:
+        for i in range(start + 1, end):
+            relic = " ".join(lines[i].split(" \t")[-1].split(" ")[:2])
+            vaulted = lines[i].endswith(" (V)")
+            if first_block[relic] < 5 and vaulted not in flipped:
+                lines[i] = lines[i][:-4] if vaulted else lines[i] + " (V)"
+                flipped.append(vaulted)
+        if len(flipped) == 2:
+            break
+    assert sorted(flipped) == [False, True]
+    # add a part to block 11 and remove the last part of block 13
+    (start, end) = spans[11]
+    lines.insert(end, "Harness \tLith A1 Rare")
+    (start, end) = blocks(lines)[13]
+    last = max(i for i in range(start + 2, end) if " \t" in lines[i])
+    del lines[last:end]
+    # and a whole new prime at the end
+    lines += ["Synth99Prime", "Synth99 Prime \tBlueprint \tLith A1 Common",
+        "Lith Q42 Uncommon (B)"]
+    return lines
+
+def test_incremental_update_matches_a_full_update(tmp_path):
+    updatedb = conftest.load_script("wfrelic-updatedb.py", str(tmp_path))
+    dump = str(tmp_path / "dump.txt")
+    synthetic.write_dump(dump, 900, seed=2)
+    con = sqlite3.connect(str(tmp_path / "relics.db"))
+    cur = con.cursor()
+    relic_db.create_tables(cur)
+    relic_db.load_catalog(cur, read_relics.read_relics(dump))
+    first = relic_incremental.changes(read_relics.iter_lines(dump), cur)
+    assert relic_incremental.change_count(first) == 0
+    relic_incremental.apply(cur, first)
+    con.commit()
+
+    with open(dump) as infile:
+        write(dump, edited(infile.read().splitlines()))
+    change_set = relic_incremental.changes(read_relics.iter_lines(dump), cur)
+    assert change_set["blocks"]["parsed"] < change_set["blocks"]["total"]
+    relic_incremental.apply(cur, change_set)
+    con.commit()
+
+    full = read_relics.read_relics(dump)
+    for table in relic_db.catalog_tables:
+        assert sorted(cur.execute("select * from {}".format(table))) == \
+            sorted(set(relic_db.catalog_rows(full, table))), table
+        (matches, removed, bad) = updatedb.diff_table(full, cur, table)
+        assert all(count == 1 for (key, count, row) in matches), table
+        assert removed == [] and bad == [], table
+    # a second run finds nothing left to do
+    again = relic_incremental.changes(read_relics.iter_lines(dump), cur)
+    assert relic_incremental.change_count(again) == 0
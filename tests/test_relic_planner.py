@@ -0,0 +1,17 @@
+import relic_planner
+
+def test_plan_skips_stacks_held_at_zero(synthetic_db):
+    (path, con, reg) = synthetic_db
+    planner = relic_planner.Planner(reg)
+    prices = {name: {"ducats": 100, "platinum": 10} for name in reg.parts}
+    # every relic scores above 0 on these prices, so only quantity can
+    # keep the empty stack out
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        select 'emptyhanded', era, minor, '3', 0 from relic""")
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        select 'emptyhanded', era, minor, '0', 2 from relic limit 1""")
+    plan = planner.plan(con, "emptyhanded", "ducats", k=100, prices=prices)
+    assert len(plan) == 1
+    assert plan[0]["quantity"] == 2
+    assert all(p["quantity"] > 0 for p in
+        planner.plan_all(con, "ducats", k=100, prices=prices)["emptyhanded"])
@@ -0,0 +1,9 @@
+import relic_search
+
+def test_corrects_the_typos_pick_from_dict_mentions():
+    eras = relic_search.NameIndex(["lith", "meso", "neo", "axi"])
+    refinements = relic_search.NameIndex(
+        ["intact", "exceptional", "flawless", "radiant"])
+    assert eras.correct("lithh") == "lith"
+    assert refinements.correct("radaint") == "radiant"
+    assert eras.correct("lihh") is None
@@ -0,0 +1,51 @@
+import random
+import read_relics, relic_sets, synthetic
+
+def drops(relic):
+    return set(p.full_name() for rarity in ["Common", "Uncommon", "Rare"]
+        for p in relic.rewards[rarity])
+
+def finished(registry, parts):
+    # primes all of whose parts are in parts, the slow way
+    by_prime = {}
+    for (name, part) in registry.parts.items():
+        by_prime.setdefault(part.prime_obj.name, set()).add(name)
+    return [p for p in sorted(by_prime) if by_prime[p] <= parts]
+
+def test_bitsets_agree_with_plain_sets(synthetic_db):
+    (path, con, reg) = synthetic_db
+    index = relic_sets.SetIndex(reg)
+    (players, masks) = index.player_masks(con)
+    found = index.completable(players, masks)
+    for player in players:
+        owned = [era + " " + minor for (era, minor) in con.execute("""select
+            era, minor from has_relic where player = ? and quantity > 0""",
+            (player,))]
+        parts = set().union(*(drops(reg.relics[r]) for r in owned))
+        assert found[player] == finished(reg, parts)
+    unvaulted = set().union(*(drops(r) for r in reg.relics.values()
+        if not r.vaulted))
+    (fully, partly) = index.farmable_primes()
+    assert fully == finished(reg, unvaulted)
+    assert partly == sorted(set(p.prime_obj.name
+        for (n, p) in reg.parts.items() if n in unvaulted) - set(fully))
+
+    # three parts a prime leaves a bit over at the end of every word, so
+    # every 22nd prime has to start the next one
+    big = read_relics.build_registry(
+        synthetic.synthetic_records(400, parts_per_prime=3))
+    index = relic_sets.SetIndex(big)
+    assert index.n_words > 3
+    for (name, part) in big.parts.items():
+        bit = index.part_bit[name]
+        assert bit >> 6 == index.prime_word[
+            index.prime_index[part.prime_obj.name]]
+    rng = random.Random(0)
+    names = list(big.relics)
+    for n in [0, 1, 40, 200, len(names)]:
+        picked = rng.sample(names, n)
+        covered = index.covered(index.relic_mask(picked))
+        parts = set().union(*(drops(big.relics[r]) for r in picked))
+        assert [p for (p, c) in zip(index.prime_names, covered) if c] \
+            == finished(big, parts)
+        assert sorted(index.names(index.relic_mask(picked))) == sorted(parts)
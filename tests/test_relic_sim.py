@@ -0,0 +1,17 @@
+import relic_sim, relic_value
+
+def test_best_squad_skips_relics_held_at_zero(synthetic_db):
+    (path, con, reg) = synthetic_db
+    rv = relic_value.RelicValues(reg)
+    # a Radiant stack of the target's relic, but none of it left, and an
+    # Intact one actually held
+    (era, minor, base, role) = con.execute(
+        "select era, minor, base, role from reward limit 1").fetchone()
+    target = base + " " + role
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        values ('emptyhanded', ?, ?, '3', 0)""", (era, minor))
+    assert relic_sim.best_squad(rv, con, ["emptyhanded"], [target]) == []
+    con.execute("""insert into has_relic (player, era, minor, refinement, quantity)
+        values ('emptyhanded', ?, ?, '0', 1)""", (era, minor))
+    assert relic_sim.best_squad(rv, con, ["emptyhanded"], [target]) == \
+        [(era + " " + minor, 0)]
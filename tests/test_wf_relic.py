@@ -0,0 +1,133 @@
+import os, sqlite3, subprocess, sys
+import pytest
+import conftest, relic_db
+
+script = os.path.join(conftest.root, "wf-relic.py")
+
+def entry(path, text):
+    return subprocess.run([sys.executable, script, "--db", path, "entry",
+        "--player", "piped", "--era", "Axi", "--refinement", "0"],
+        input=text, capture_output=True, text=True,
+        cwd=os.path.dirname(path), timeout=60)
+
+def held(con):
+    return con.execute("""select minor, quantity from has_relic
+        where player = 'piped' order by minor""").fetchall()
+
+def test_entry_saves_when_input_runs_out(synthetic_db):
+    (path, con, reg) = synthetic_db
+    result = entry(path, "axi a1 7\n")
+    assert result.returncode == 0, result.stderr
+    assert "Traceback" not in result.stderr
+    assert held(con) == [("A1", 7)]
+
+def test_entry_ends_after_stop_without_done(synthetic_db):
+    (path, con, reg) = synthetic_db
+    result = entry(path, "axi a1 3\nstop\n")
+    assert result.returncode == 0, result.stderr
+    assert "Traceback" not in result.stderr
+    assert held(con) == [("A1", 3)]
+
+@pytest.fixture
+def wfrelic(synthetic_db, tmp_path):
+    (path, con, reg) = synthetic_db
+    module = conftest.load_script("wf-relic.py", str(tmp_path))
+    module.db = relic_db.ConnectionPool(path, 2)
+    yield module
+    module.db.close()
+
+def test_own_many_counts(wfrelic, synthetic_db):
+    (path, con, reg) = synthetic_db
+    (era, minor, refinement, quantity) = con.execute("""select era, minor,
+        refinement, quantity from has_relic where player = 'player0'
+        limit 1""").fetchone()
+    counts = wfrelic.own_many([
+        ("player0", era, minor, quantity, refinement),# as it is
+        ("player0", era, minor, quantity + 1, refinement),# then changed
+        ("piped", "Axi", "A1", 2, "0"),
+        ("piped", "Axi", "A1", 2, "0"),# a repeat of a new row
+    ])
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 2}
+    assert held(con) == [("A1", 2)]
+
+class Interloper:
+    # a connection that lets another one try to write the moment
+    # own_many reads what's there
+    def __init__(self, con, path):
+        self.con = con
+        self.path = path
+        self.blocked = None
+
+    def execute(self, sql, *args):
+        if "from has_relic" in sql and self.blocked is None:
+            other = sqlite3.connect(self.path, timeout=0)
+            try:
+                other.execute("""update has_relic set quantity = 50
+                    where player = 'player0'""")
+                other.commit()
+                self.blocked = False
+            except sqlite3.OperationalError:
+                self.blocked = True
+            other.close()
+        return self.con.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def __enter__(self):
+        return self.con.__enter__()
+
+    def __exit__(self, *exc):
+        return self.con.__exit__(*exc)
+
+def test_own_many_reads_inside_its_write_transaction(wfrelic, synthetic_db):
+    (path, con, reg) = synthetic_db
+    (era, minor, refinement) = con.execute("""select era, minor, refinement
+        from has_relic where player = 'player0' limit 1""").fetchone()
+    writer = relic_db.connect(path)
+    interloper = Interloper(writer, path)
+    counts = wfrelic.own_many([("player0", era, minor, 50, refinement)],
+        interloper)
+    writer.close()
+    assert interloper.blocked
+    assert counts["updated"] == 1
+
+def test_batch_entry_saves_the_good_lines(wfrelic, synthetic_db):
+    (path, con, reg) = synthetic_db
+    (counts, problems) = wfrelic.batch_entry("piped",
+        ["axi a1 4", "axi q99 2", "zzz", "axi b1 1"], refinement="0")
+    assert counts["inserted"] == 2
+    assert [p.split(":")[0] for p in problems] == ["line 2", "line 3"]
+    assert held(con) == [("A1", 4), ("B1", 1)]
+
+def test_entry_saves_what_came_before_a_bad_line(synthetic_db):
+    (path, con, reg) = synthetic_db
+    result = entry(path, "axi a1 7\nzzz\n")
+    assert result.returncode == 0, result.stderr
+    assert held(con) == [("A1", 7)]
+
+def test_batch_file_carries_era_and_refinement_over(synthetic_db, tmp_path):
+    (path, con, reg) = synthetic_db
+    batch = tmp_path / "loot.txt"
+    batch.write_text("\n".join([
+        "# after a radiant lith run",
+        "lith a1 radiant 3",
+        "b1 2",# still Lith, still radiant
+        "",
+        "axi c1 flawless 1",
+        "d1 4  # Axi, flawless",
+        "q1 5",# not a relic: reported, the rest still saved
+        "stop",
+        "axi e1 9",
+    ]) + "\n")
+    result = subprocess.run([sys.executable, script, "--db", path, "entry",
+        "--batch", str(batch), "--player", "piped"],
+        capture_output=True, text=True, cwd=str(tmp_path), timeout=60)
+    assert result.returncode != 0
+    assert "line 7: unknown relic Axi Q1" in result.stderr
+    assert "1 bad line(s) skipped" in result.stderr
+    assert con.execute("""select era, minor, refinement, quantity
+        from has_relic where player = 'piped'
+        order by era, minor""").fetchall() == [
+        ("Axi", "C1", "2", 1), ("Axi", "D1", "2", 4),
+        ("Lith", "A1", "3", 3), ("Lith", "B1", "3", 2)]
@@ -0,0 +1,73 @@
+import conftest, relic_db
+
+def per_row(updatedb, registry, db_cursor, table):
+    # what the diff used to do: one select per registry entry
+    (keys, others) = updatedb.reg_tables[table]
+    width = len(keys)
+    reg_keys = set()
+    found = {}
+    for row in relic_db.catalog_rows(registry, table):
+        key = tuple(row[:width])
+        reg_keys.add(key)
+        found[key] = db_cursor.execute(
+            f"select * from {table} where " +
+            " and ".join(f"{k} = ?" for k in keys), key).fetchall()
+    removed = [row for row in db_cursor.execute(f"select * from {table}")
+        if tuple(row[:width]) not in reg_keys]
+    return (found, sorted(removed))
+
+def test_set_diff_matches_a_per_row_diff(synthetic_db, tmp_path):
+    (path, con, reg) = synthetic_db
+    updatedb = conftest.load_script("wfrelic-updatedb.py", str(tmp_path))
+    (gone, flipped) = sorted(reg.relics)[:2]
+    (era, minor) = gone.split()
+    for table in ["has_relic", "reward", "relic"]:
+        con.execute(f"delete from {table} where era = ? and minor = ?",
+            (era, minor))
+    (era, minor) = flipped.split()
+    con.execute("""update relic set vaulted = 1 - vaulted
+        where era = ? and minor = ?""", (era, minor))
+    (base, role) = con.execute("select base, role from part limit 1").fetchone()
+    con.execute("delete from reward where base = ? and role = ?", (base, role))
+    con.execute("delete from part where base = ? and role = ?", (base, role))
+    con.execute("insert into prime values ('Bogus Prime')")
+    con.execute("insert into part values ('Bogus Prime', 'Blueprint')")
+    con.execute("""insert into reward select era, minor, 'Bogus Prime',
+        'Blueprint', 'Rare' from relic limit 1""")
+    con.commit()
+    cur = con.cursor()
+
+    relics = updatedb.get_relic_updates(reg, cur)
+    (found, removed) = per_row(updatedb, reg, cur, "relic")
+    assert relics["new"] == [gone]
+    assert relics["vaulting"] == [(flipped, reg.relics[flipped].vaulted ^ 1,
+        reg.relics[flipped].vaulted)]
+    assert relics["existing"] == sorted(" ".join(k)
+        for (k, rows) in found.items()
+        if len(rows) == 1 and " ".join(k) != flipped)
+    assert relics["removed"] == removed == []
+    assert relics["bad"] == []
+
+    primes = updatedb.get_prime_updates(reg, cur)
+    (found, removed) = per_row(updatedb, reg, cur, "prime")
+    assert primes["new"] == []
+    assert primes["existing"] == sorted(k[0] for k in found)
+    assert primes["removed"] == [r[0] for r in removed] == ["Bogus Prime"]
+
+    parts = updatedb.get_part_updates(reg, cur)
+    (found, removed) = per_row(updatedb, reg, cur, "part")
+    assert parts["new"] == [f"{base} {role}"]
+    assert parts["existing"] == sorted(" ".join(k)
+        for (k, rows) in found.items() if len(rows) == 1)
+    assert parts["removed"] == removed == [("Bogus Prime", "Blueprint")]
+
+    rewards = updatedb.get_reward_updates(reg, cur)
+    (found, removed) = per_row(updatedb, reg, cur, "reward")
+    assert rewards["new"] == sorted(k for (k, rows) in found.items()
+        if len(rows) == 0)
+    assert len(rewards["new"]) > 0
+    assert rewards["existing"] == sorted(k for (k, rows) in found.items()
+        if len(rows) == 1)
+    assert rewards["all"] == sorted(found)
+    assert rewards["removed"] == removed
+    assert [r[2] for r in removed] == ["Bogus Prime"]
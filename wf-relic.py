@@ -2,14 +2,13 @@
 # wf-relic.py
 # Ariadne V. Vilece 2019
 
-import sqlite3, read_relics
-from typing import List
-import tkinter
+import sys, relic_db, relic_profile
+# tkinter, read_relics, ownership_io and relic_history are imported
+# where they're used, so the read-only commands start fast
 
-connection = sqlite3.connect("relics.db")
-
-cursor = connection.cursor()
-cursor.execute("pragma foreign_keys = ON")
+# WAL mode, one writer, read-only connections for the reports,
+# all opened on first use (see relic_db.ConnectionPool)
+db = relic_db.ConnectionPool("relics.db")
 
 era_choices = {
   "lith": "Lith",
@@ -37,6 +36,7 @@ CREATE TABLE sqlite_master (
 """
 
 def stopstopstop(text):
+  import tkinter
   t = tkinter.Tk()
   w = tkinter.Label(t, text=text)
   w.pack()
@@ -58,6 +58,15 @@ def soft_prompt(callback: callable):
       continue
   return x
 
+def read_line(prompt: str, at_end: str) -> str:
+  # input(), except that running out of input (a pipe, ^D) or ^C reads as
+  # at_end, so the loops below still get to save what they have
+  try:
+    return input(prompt)
+  except (EOFError, KeyboardInterrupt):
+    print()
+    return at_end
+
 def format_indices(choice_list: list) -> str:
   # don't need to return choice_list since it already exists as needed
   return (
@@ -96,6 +105,13 @@ def pick_from_dict(choices: dict, title: str, s_es: str = "s"):
     try:
       ci: int = int(cc)
     except ValueError:
+      # maybe a typo, i.e. "lithh" or "radaint" (too mangled, like "lihh",
+      # and it's an error below)
+      import relic_search
+      guess = relic_search.NameIndex(c_list).correct(cc)
+      if guess is not None:
+        print(f"Selecting {title} {choices[guess]} (closest to {cc})")
+        return choices[guess]
       eve = KeyError(f"{title} {cc} not found in {title} choices " +
         "and can't be justified as a number")
       print(eve)
@@ -123,9 +139,10 @@ def pick_refinement() -> str:
     refinement_choices, "Refinement", "s"
   )
 
-def get_players() -> List[str]:
+def get_players() -> list[str]:
   # Simple select to find players that exist
-  rows = cursor.execute("select distinct player from has_relic;").fetchall()
+  # (cached until has_relic changes, see relic_cache)
+  rows = db.cache().query("select distinct player from has_relic;")
   pcands = [r[0] for r in rows]# oh boy
   # let's unpack that one
   # that sql will return something like
@@ -155,42 +172,175 @@ def pick_player():
     player: str = pchoices[pindex]
     print("Selecting existing player {} by index".format(player))
     return player
-  except:# I'm not even going to try to handle failure analysis for that one
-    print("Creating new player {}".format(player))
+  except (ValueError, IndexError):
+    pass
+  # a new player, unless it's a typo of an old one
+  if len(pchoices) > 0:
+    import relic_search
+    guess = relic_search.NameIndex(pchoices).correct(pc)
+    if guess is not None and input(f"Did you mean {guess}? [y/any] >>> ") == "y":
+      print(f"Selecting existing player {guess}")
+      return guess
+  print("Creating new player {}".format(pc))
+  return pc
 
 
+def own_many(rows, db_connection = None) -> dict:
+  # rows: iterable of (player, era, minor, quantity, refinement)
+  # Everything goes in as one transaction, one upsert per changed row.
+  # Returns how many rows were inserted, updated, and left alone.
+  if db_connection is None:
+    with db.write() as con:
+      return own_many(rows, con)
+  rows = [
+    (player, era, minor, int(quantity), refinement)
+    for (player, era, minor, quantity, refinement) in rows
+  ]
+  counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+  with relic_profile.phase("ownership write"), db_connection:
+    # commits, or rolls back if anything fails. Taking the write lock
+    # before reading means nobody can change these rows in between, so
+    # the counts are what this write really did.
+    if not db_connection.in_transaction:
+      db_connection.execute("begin immediate")
+    # what's there now, for just the players we're touching
+    # (player, era, minor, refinement) -> quantity
+    current = {}
+    for player in set(r[0] for r in rows):
+      for (era, minor, refinement, quantity) in db_connection.execute(
+        """select era, minor, refinement, quantity
+          from has_relic where player == ?;""",
+        (player,)
+      ):
+        current[(player, era, minor, refinement)] = quantity
+    to_write = []
+    for (player, era, minor, quantity, refinement) in rows:
+      key = (player, era, minor, refinement)
+      if key not in current:
+        counts["inserted"] += 1
+      elif current[key] != quantity:
+        counts["updated"] += 1
+      else:
+        counts["unchanged"] += 1
+        continue
+      current[key] = quantity# later duplicates compare against this one
+      to_write.append((player, era, minor, refinement, quantity))
+    db_connection.executemany(
+"""insert into has_relic (player, era, minor, refinement, quantity)
+  values (?, ?, ?, ?, ?)
+  on conflict (player, era, minor, refinement)
+  do update set quantity = excluded.quantity;""",
+      to_write
+    )
+    # ownership_event picks the changes up by trigger, if it's installed
+    import relic_history
+    relic_history.maybe_snapshot(db_connection.cursor())
+  return counts
+
 def own_one(player: str, era: str, minor: str, quantity: int, refinement: str):
   # player, era, minor, quantity, refinement: string
   # uhhh quantity may need to be cast to an int
-  #print("[debug] using the following statement:")
-  #print(
-  #  "insert or ignore into has_relic values(\n" +
-  #  f"{player}, {era}, {minor}, {quantity}, {refinement}\n);"
-  #)
-  cursor.execute(
-"""insert or ignore
-  into has_relic
-  values (?, ?, ?, ?, ?);""",
-  (player, era, minor, quantity, refinement)
-  )
-  #print("[debug] updating now:")
-  #print(
-#f"""update has_relic
-#  set quantity = {quantity}
-#  where player == {player}
-#    and era == {era}
-#    and minor == {minor}
-#    and refinement == {refinement};"""
-#  )
-  cursor.execute(
-"""update has_relic
-  set quantity = ?
-  where player == ?
-    and era == ?
-    and minor == ?
-    and refinement == ?;""",
-    (quantity, player, era, minor, refinement)
-  )
+  return own_many([(player, era, minor, quantity, refinement)])
+
+def parse_entry(tokens: list, era: str, refinement: str):
+  # tokens: one "[era] minor [refinement] quantity" line, split on spaces
+  # era and refinement are whatever the last line left them at
+  # Returns (era, minor, refinement, quantity), unchecked.
+  # IndexError for too few tokens, ValueError for a bad quantity
+  tokens = list(tokens)
+  # gotta deconstruct it in reverse
+  # because I'm an idiot and didn't want to reverse it
+  # whatever whatever
+  quantity = int(tokens.pop())
+  if len(tokens) == 1:# "minor quantity" aka "g1 10"
+    minor = tokens.pop().upper()
+  else:
+    mr = tokens.pop()# can't be era because we haven't seen minor yet
+    if mr in refinement_choices.keys():
+      refinement = mr
+      minor = tokens.pop().upper()# minor is mandatory
+    else:# can't be era so it must be a minor relic name
+      minor = mr.upper()
+  # finally, we've seen quantity, minor, and refinement
+  # so there's only era left
+  # I want to go soak my head
+  if len(tokens) == 1:# the only thing left is era
+    era = tokens.pop()
+  elif len(tokens) > 1:# We should have popped minor before
+    # so we shouldn't be left with anything
+    raise ValueError("Too many identifiers")
+  # if len(tokens) == 0, then we already popped everything we need to
+  return (era, minor, refinement, quantity)
+
+def known_relic_keys() -> frozenset:
+  # {(era, minor)}, kept until the catalog changes
+  cache = db.cache()
+  return cache.get(("known relic keys",),
+    lambda: frozenset(cache.probe.execute("select era, minor from relic")),
+    catalog=True)
+
+def name_index():
+  # relic_search.NameIndex over the catalog, kept until it changes
+  import relic_search
+  cache = db.cache()
+  return cache.get(("name index",),
+    lambda: relic_search.catalog_index(cache.probe), catalog=True)
+
+def did_you_mean(query: str, kind: str = None) -> str:
+  # " (did you mean X, Y?)" or "" if nothing's close
+  names = [n for (n, score) in name_index().search(query, 3, kind)]
+  return f" (did you mean {', '.join(names)}?)" if len(names) > 0 else ""
+
+def batch_entry(player: str, lines, era = None, refinement = None):
+  # Same grammar as the entry loop, for a whole file at once:
+  # era and refinement carry over from line to line, blank lines and
+  # "#" comments are skipped, "stop" ends it early.
+  # Every line is checked against the catalog before anything is
+  # written; the good ones then go in as one transaction.
+  # Returns (own_many counts, ["line N: problem", ...])
+  known_relics = known_relic_keys()
+  if era is not None:
+    era = era.lower()
+  rows = []
+  problems = []
+  for (n, line) in enumerate(lines, 1):
+    r = line.split("#")[0].strip().lower()
+    if r == "":
+      continue
+    if r == "stop":
+      break
+    try:
+      (era, minor, refinement, quantity) = parse_entry(
+        r.split(), era, refinement)
+    except IndexError:
+      problems.append(f"line {n}: not enough identifiers: {line.strip()}")
+      continue
+    except ValueError as ve:
+      problems.append(f"line {n}: couldn't parse ({ve}): {line.strip()}")
+      continue
+    if era is None:
+      problems.append(f"line {n}: no era given yet")
+      continue
+    if refinement is None:
+      problems.append(f"line {n}: no refinement given yet")
+      continue
+    e = era_choices.get(era.lower())
+    ref = refinement if refinement in refinement_choices.values() \
+      else refinement_choices.get(refinement.lower())
+    if e is None:
+      problems.append(f"line {n}: unknown era {era}")
+    elif ref is None:
+      problems.append(f"line {n}: unknown refinement {refinement}")
+    elif quantity < 0:
+      problems.append(f"line {n}: negative quantity {quantity}")
+    elif (e, minor) not in known_relics:
+      problems.append(f"line {n}: unknown relic {e} {minor}" +
+        did_you_mean(f"{e} {minor}", "relic"))
+    else:
+      rows.append((player, e, minor, quantity, ref))
+  counts = own_many(rows) if len(rows) > 0 \
+    else {"inserted": 0, "updated": 0, "unchanged": 0}
+  return (counts, problems)
 
 def update_ownership(player = None, era = None, refinement = None,
     first_command = None):
@@ -200,7 +350,7 @@ def update_ownership(player = None, era = None, refinement = None,
       next_command = first_command
       first_command = None
     else:
-      next_command = input(outer_prompt).lower()
+      next_command = read_line(outer_prompt, "done").lower()
     if next_command == "player":
       player = pick_player()
       continue
@@ -222,8 +372,15 @@ def update_ownership(player = None, era = None, refinement = None,
         continue
       print("Anything but a valid relic breaks to outer loop")
       print("Optional: era, refinement")
+      pending = []# written all at once when we leave the entry loop
+      # these don't change while we're in here, so ask once
+      all_players = get_players()
+      e_rows = db.cache().query("select distinct era from relic", catalog=True)
+      all_eras = [r[0] for r in e_rows]
+      known_relics = known_relic_keys()
       while True:
-        r = input("[era] minor [refinement] quantity (or stop) >>> ").lower()
+        r = read_line("[era] minor [refinement] quantity (or stop) >>> ",
+          "stop").lower()
         if r == "stop": break
         tokens = r.split(" ")
         # format for era: "lith", "Lith", "LITH"
@@ -233,28 +390,9 @@ def update_ownership(player = None, era = None, refinement = None,
         if len(tokens) < 2:
           print("Can't treat this as a relic")
           break
-        try:# gotta deconstruct it in reverse
-          # because I'm an idiot and didn't want to reverse it
-          # whatever whatever
-          quantity = int(tokens.pop())
-          if len(tokens) == 1:# "minor quantity" aka "g1 10"
-            minor = tokens.pop().upper()
-          else:
-            mr = tokens.pop()# can't be era because we haven't seen minor yet
-            if mr in refinement_choices.keys():
-              refinement = mr
-              minor = tokens.pop().upper()# minor is mandatory
-            else:# can't be era so it must be a minor relic name
-              minor = mr.upper()
-          # finally, we've seen quantity, minor, and refinement
-          # so there's only era left
-          # I want to go soak my head
-          if len(tokens) == 1:# the only thing left is era
-            era = tokens.pop()
-          elif len(tokens) > 1:# We should have popped minor before
-            # so we shouldn't be left with anything
-            raise ValueError("Too many identifiers")
-          # if len(tokens) == 0, then we already popped everything we need to
+        try:
+          (era, minor, refinement, quantity) = parse_entry(
+            tokens, era, refinement)
         except IndexError:# always gonna be pop from empty list here
           print("Not enough identifiers\nBreaking to outer loop")
           break
@@ -265,7 +403,6 @@ def update_ownership(player = None, era = None, refinement = None,
         # so far we need player, era, minor, quantity, refinement
 
         # let's do player first
-        all_players = get_players()
         if player in all_players:
           print(f"Using existing player {player}")
         else:
@@ -273,16 +410,19 @@ def update_ownership(player = None, era = None, refinement = None,
         # Can't really do sanity checking on it so let's move on
 
         # next, let's do era
-        e_rows = cursor.execute("select distinct era from relic").fetchall()
-        all_eras = [r[0] for r in e_rows]
         if era in all_eras:
           print(f"Selecting valid era {era}")
         elif era.lower() in era_choices.keys():
           era = era_choices[era.lower()]
           print(f"Fixing caps, selecting valid era {era}")
         else:
-          print(f"Unknown era {era}")
-          continue
+          import relic_search
+          guess = relic_search.NameIndex(list(era_choices.keys())).correct(era)
+          if guess is None:
+            print(f"Unknown era {era}")
+            continue
+          print(f"Fixing typo, selecting era {era_choices[guess]} for {era}")
+          era = era_choices[guess]
         
         # ok ok let's do minor next
         # the structure of minor is [rare_reward_first_initial][generation]
@@ -304,6 +444,10 @@ def update_ownership(player = None, era = None, refinement = None,
           continue
         print(f"Rare reward first initial: {minor_fi}")
         print(f"Minor revision: {minor_i}")
+        if (era, minor) not in known_relics:
+          print(f"Unknown relic {era} {minor}" +
+            did_you_mean(f"{era} {minor}", "relic"))
+          continue
         # the name is still G10 or whatever
         # so we can discard minor_fi and minor_i now
       
@@ -341,9 +485,13 @@ def update_ownership(player = None, era = None, refinement = None,
         prompt = False
         if prompt:
           if input("Ok? [y/any] >>> ") == "y":
-            own_one(player, era, minor, quantity, refinement)
+            pending.append((player, era, minor, quantity, refinement))
         else:
-            own_one(player, era, minor, quantity, refinement)
+            pending.append((player, era, minor, quantity, refinement))
+      if len(pending) > 0:
+        counts = own_many(pending)
+        print(("Saved {} relic(s): {inserted} new, {updated} changed, " +
+          "{unchanged} unchanged").format(len(pending), **counts))
     else:# context: "if next_command ==......"
       break
 
@@ -366,28 +514,402 @@ def unpack_table(table_from_sql):
   return formatted_rows
 
 def dq():# debug: quick view has_relic
-  hr_rows = cursor.execute(
-    "select * from has_relic order by era asc, quantity desc;"
-  ).fetchall()
+  with db.read() as con:
+    hr_rows = con.execute(
+      "select * from has_relic order by era asc, quantity desc;"
+    ).fetchall()
   return unpack_table(hr_rows)
 
 def du(fe):# debug: quick update ownership
   update_ownership("sooby", fe, "0", "entry")
 
-# helpful: cursor.execute("select * from sqlite_master")
+# helpful: with db.read() as con: con.execute("select * from sqlite_master")
 
-def update_vaulteds():
-  reg = read_relics.read_relics(read_relics.source_table)
+def update_vaulteds(source_file = None) -> int:
+  # n.b. load_registry reuses the parsed snapshot unless the dump changed
+  import read_relics
+  if source_file is None:
+    source_file = read_relics.source_table
+  reg = read_relics.load_registry(source_file)
   uvr = [
-    (rel.vaulted, rel.era, rel.minor_name)
+    (rel.vaulted, rel.era, rel.minor_name, rel.vaulted)
     for rel in reg.relics.values()
   ]
-  cursor.executemany(
-    "update relic set vaulted = ? where era == ? and minor == ?",
-    uvr
-  )
+  with relic_profile.phase("update vaulted"), db.write() as con:
+    before = con.total_changes
+    con.executemany(
+      """update relic set vaulted = ?
+        where era == ? and minor == ? and vaulted != ?""",
+      uvr
+    )
+    changed = con.total_changes - before
+    if changed > 0:
+      relic_db.bump_generation(con)
+    return changed
+
+# Command line
+# wf-relic.py [--db relics.db] COMMAND ...
+# Each command only imports what it needs.
+
+def cmd_entry(args):
+  if args.batch is None:
+    update_ownership(args.player, args.era, args.refinement, "entry")
+    return
+  if args.player is None:
+    sys.exit("--batch needs --player")
+  if args.batch == "-":
+    (counts, problems) = batch_entry(
+      args.player, sys.stdin, args.era, args.refinement)
+  else:
+    with open(args.batch) as infile:
+      (counts, problems) = batch_entry(
+        args.player, infile, args.era, args.refinement)
+  for problem in problems:
+    print(problem, file=sys.stderr)
+  print(("Saved {} relic(s): {inserted} new, {updated} changed, " +
+    "{unchanged} unchanged").format(sum(counts.values()), **counts))
+  if len(problems) > 0:
+    sys.exit(f"{len(problems)} bad line(s) skipped")
+
+def cmd_report(args):
+  params = {"player": args.player, "base": args.base, "role": args.role}
+  rows = db.cache().query(relic_db.report_queries[args.name], params)
+  if len(rows) > 0:
+    print(unpack_table(rows))
+
+def cmd_import(args):
+  import ownership_io, relic_history
+  with db.write() as con:
+    counts = ownership_io.import_files(args.files, con, args.replace)
+    relic_history.maybe_snapshot(con.cursor())
+  print("Imported {rows} row(s) for {players} player(s)".format(**counts))
+
+def cmd_export(args):
+  import ownership_io
+  with db.read() as con:
+    if args.per_player:
+      for (path, n) in ownership_io.export_players(args.path, con).items():
+        print(f"{path}: {n} row(s)", file=sys.stderr)
+    else:
+      n = ownership_io.export_file(args.path, con, args.player)
+      print(f"{n} row(s) exported", file=sys.stderr)
+
+def cmd_export_columns(args):
+  import relic_columns
+  with db.read() as con:
+    con.execute("begin")# one snapshot for every table
+    written = relic_columns.export(con, args.directory, args.full)
+  print("Wrote " + ", ".join(written), file=sys.stderr)
+  orphans = relic_columns.read_manifest(
+    args.directory)["tables"]["has_relic"]["orphans"]
+  if orphans > 0:
+    print(f"Skipped {orphans} has_relic row(s) of relics not in the catalog",
+      file=sys.stderr)
+
+def cmd_update_vaulted(args):
+  print(f"{update_vaulteds(args.source)} relic(s) changed vaulted status")
+
+def cmd_rebuild(args):
+  import read_relics
+  reg = read_relics.load_registry(args.source or read_relics.source_table)
+  if args.shadow:
+    # built in a separate file and swapped in, readers never see it half done
+    try:
+      with db.write() as con:
+        relic_db.shadow_rebuild(db.path, reg, con)
+    except (ValueError, RuntimeError) as e:
+      sys.exit(f"Rebuild abandoned, database unchanged: {e}")
+    print(f"Rebuilt catalog: {len(reg.relics)} relics, {len(reg.parts)} parts")
+    return
+  with db.write() as con:
+    orphans = relic_db.rebuild_catalog(con.cursor(), reg)
+  print(f"Rebuilt catalog: {len(reg.relics)} relics, {len(reg.parts)} parts")
+  if len(orphans) > 0:
+    print(f"Warning: {len(orphans)} has_relic row(s) refer to missing relics")
+
+def cmd_plan(args):
+  # numpy and friends only get imported for this one
+  import read_relics, relic_planner
+  if args.player is None and not args.all:
+    sys.exit("plan needs a player or --all")
+  planner = relic_planner.Planner(read_relics.load_registry(args.source or
+    read_relics.source_table))
+  prices = None
+  needs = None
+  if args.objective == "sets":
+    if args.need is None:
+      sys.exit("--objective sets needs --need FILE")
+    needs = relic_planner.load_needs(args.need)
+  else:
+    prices = relic_planner.load_prices(args.prices)
+  with db.read() as con:
+    if args.all:
+      players = [r[0] for r in con.execute("select distinct player from has_relic")]
+      plans = planner.plan_all(con, args.objective, args.k, prices,
+        None if needs is None else {p: needs for p in players})
+    else:
+      plans = {args.player: planner.plan(con, args.player, args.objective,
+        args.k, prices, needs)}
+  for (player, plan) in plans.items():
+    if args.all:
+      print(f"== {player}")
+    print(relic_planner.format_plan(plan))
+
+def cmd_simulate(args):
+  import time, read_relics, relic_value, relic_sim
+  reg = read_relics.load_registry(args.source or read_relics.source_table)
+  rv = relic_value.RelicValues(reg)
+  targets = set()
+  for name in args.part:# a prime's name means its whole set
+    if name in reg.primes:
+      targets.update(reg.primes[name].parts.keys())
+    else:
+      targets.add(name)
+  if args.squad:
+    squad = [relic_sim.parse_member(m) for m in args.squad]
+  elif args.players:
+    with db.read() as con:
+      squad = relic_sim.best_squad(rv, con, args.players, targets)
+  else:
+    sys.exit("simulate needs --squad or --players")
+  if len(squad) == 0:
+    sys.exit("nobody has a relic that drops that")
+  try:
+    (cum, bits, targets) = relic_sim.squad_tables(rv, squad[:4], targets)
+  except (KeyError, ValueError) as e:
+    sys.exit(str(e).strip("'"))
+  start = time.perf_counter()
+  runs = relic_sim.simulate(cum, bits, args.trials, args.max_runs,
+    args.seed, args.workers)
+  elapsed = time.perf_counter() - start
+  stats = relic_sim.summarize(runs, args.max_runs)
+  print("squad: " + ", ".join(f"{r} {relic_value.refinements[ref]}"
+    for (r, ref) in squad[:4]))
+  print("targets: " + ", ".join(targets))
+  print(("runs needed: {mean_runs:.3f} (95% CI {ci_low:.3f}-{ci_high:.3f}), " +
+    "median {median:.0f}, p90 {p90:.0f}, p99 {p99:.0f}").format(**stats))
+  if stats["unfinished"] > 0:
+    print(f"{stats['unfinished']} trial(s) not done after {args.max_runs} runs")
+  print(f"{int(runs.clip(max=args.max_runs).sum()) / elapsed:,.0f} runs/s " +
+    f"over {args.trials:,} trials")
+
+def cmd_sets(args):
+  import read_relics, relic_sets
+  index = relic_sets.SetIndex(read_relics.load_registry(args.source or
+    read_relics.source_table))
+  if args.farmable:
+    (fully, partly) = index.farmable_primes()
+    print("Every part still drops: " + ", ".join(fully))
+    print("Some parts still drop: " + ", ".join(partly))
+    return
+  with db.read() as con:
+    (players, masks) = index.player_masks(con, args.players or None)
+  for (player, primes) in index.completable(players, masks).items():
+    print(player + "\t" + ", ".join(primes))
+
+def parse_time(s: str) -> float:
+  # "2019-04-03", "2019-04-03 18:30", or unix seconds; local time
+  import datetime
+  try:
+    return float(s)
+  except ValueError:
+    return datetime.datetime.fromisoformat(s).timestamp()
+
+def cmd_history(args):
+  import time, relic_history
+  if args.init or args.snapshot:
+    with db.write() as con:
+      if args.init:
+        relic_history.create_event_log(con.cursor())
+        print("Ownership history is on")
+      else:
+        if not relic_history.installed(con):
+          sys.exit("no history yet, run history --init first")
+        print(f"Snapshot {relic_history.snapshot(con.cursor())} taken")
+    return
+  with db.read() as con:
+    if not relic_history.installed(con):
+      sys.exit("no history yet, run history --init first")
+    if args.since is not None:
+      until = time.time() if args.until is None else parse_time(args.until)
+      changes = relic_history.changes_between(con,
+        parse_time(args.since), until, args.player)
+      rows = [key + before_after for (key, before_after) in sorted(changes.items())]
+    else:
+      at = time.time() if args.at is None else parse_time(args.at)
+      held = relic_history.inventory_at(con, at, args.player)
+      rows = [key + (q,) for (key, q) in sorted(held.items())]
+  if len(rows) > 0:
+    print(unpack_table(rows))
+
+def cmd_search(args):
+  index = name_index()
+  for (name, score) in index.search(" ".join(args.query), args.k, args.kind,
+      min_score=0.0 if args.all else 0.3):
+    print(f"{name}\t{score:.2f}")
+
+def cmd_serve(args):
+  import asyncio, relic_api
+  server = relic_api.Server(db, args.threads)
+  try:
+    asyncio.run(server.serve(args.host, args.port, lambda h, p: print(
+      "listening on http://{}:{}/".format(h, p), flush=True)))
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.close()
+
+def args_entry(p):
+  p.add_argument("--player")
+  p.add_argument("--batch", metavar="FILE",
+    help="read entry lines from FILE (- for stdin) instead of prompting")
+  p.add_argument("--era", choices=list(era_choices.values()))
+  p.add_argument("--refinement",
+    choices=list(refinement_choices.keys()) + list(refinement_choices.values()))
+  p.set_defaults(run=cmd_entry)
+
+def args_report(p):
+  p.add_argument("name", choices=list(relic_db.report_queries.keys()))
+  p.add_argument("--player")
+  p.add_argument("--base", help="prime name, i.e. 'Akbolto Prime'")
+  p.add_argument("--role", help="part name, i.e. 'Barrel'")
+  p.set_defaults(run=cmd_report)
+
+def args_plan(p):
+  p.add_argument("player", nargs="?")
+  p.add_argument("--all", action="store_true", help="every player")
+  p.add_argument("--objective", default="ducats",
+    choices=["ducats", "platinum", "sets"])
+  p.add_argument("--prices", default="prices.tsv",
+    help="name, ducats, platinum per part, tab-separated")
+  p.add_argument("--need", metavar="FILE",
+    help="parts (or whole primes) still needed, one per line, for sets")
+  p.add_argument("-k", type=int, default=10)
+  p.add_argument("--source", help="wiki dump, for the drop tables")
+  p.set_defaults(run=cmd_plan)
+
+def args_simulate(p):
+  p.add_argument("--part", action="append", required=True,
+    help="target part, or a prime for its whole set; repeatable")
+  p.add_argument("--squad", nargs="+", metavar="RELIC[:REFINEMENT]",
+    help="i.e. 'Lith V5:Radiant' four times for a radiant share")
+  p.add_argument("--players", nargs="+",
+    help="use each player's best owned relic for the targets instead")
+  p.add_argument("--trials", type=int, default=1000000)
+  p.add_argument("--max-runs", type=int, default=1000)
+  p.add_argument("--workers", type=int, default=1)
+  p.add_argument("--seed", type=int, default=0)
+  p.add_argument("--source", help="wiki dump, for the drop tables")
+  p.set_defaults(run=cmd_simulate)
+
+def args_sets(p):
+  p.add_argument("players", nargs="*", help="default: everyone")
+  p.add_argument("--farmable", action="store_true",
+    help="list primes still farmable from unvaulted relics instead")
+  p.add_argument("--source", help="wiki dump, for the drop tables")
+  p.set_defaults(run=cmd_sets)
+
+def args_history(p):
+  p.add_argument("player", nargs="?", help="default: everyone")
+  p.add_argument("--at", help="inventory as of this time (default now)")
+  p.add_argument("--since", help="changes from this time...")
+  p.add_argument("--until", help="...to this one (default now)")
+  p.add_argument("--init", action="store_true",
+    help="start recording ownership changes")
+  p.add_argument("--snapshot", action="store_true",
+    help="take a snapshot now")
+  p.set_defaults(run=cmd_history)
+
+def args_search(p):
+  p.add_argument("query", nargs="+", help="i.e. akbolto barel, lith g 1")
+  p.add_argument("-k", type=int, default=10, help="at most this many")
+  p.add_argument("--kind", choices=["relic", "prime", "part"])
+  p.add_argument("--all", action="store_true",
+    help="show weak matches too")
+  p.set_defaults(run=cmd_search)
+
+def args_serve(p):
+  p.add_argument("--host", default="127.0.0.1")
+  p.add_argument("--port", type=int, default=8080, help="0 picks a free one")
+  p.add_argument("--threads", type=int,
+    help="threads running queries (default: one per read connection)")
+  p.set_defaults(run=cmd_serve)
+
+def args_import(p):
+  p.add_argument("files", nargs="+")
+  p.add_argument("--replace", action="store_true",
+    help="drop each player's old rows first")
+  p.set_defaults(run=cmd_import)
+
+def args_export(p):
+  p.add_argument("path", help="file, - for stdout, or a directory " +
+    "with --per-player")
+  p.add_argument("--player", action="append")
+  p.add_argument("--per-player", action="store_true")
+  p.set_defaults(run=cmd_export)
+
+def args_export_columns(p):
+  p.add_argument("directory")
+  p.add_argument("--full", action="store_true",
+    help="rewrite the catalog columns even if it hasn't changed")
+  p.set_defaults(run=cmd_export_columns)
+
+def args_update_vaulted(p):
+  p.add_argument("--source")
+  p.set_defaults(run=cmd_update_vaulted)
+
+def args_rebuild(p):
+  p.add_argument("--source")
+  p.add_argument("--shadow", action="store_true",
+    help="build it in a new file, check it, then swap it in")
+  p.set_defaults(run=cmd_rebuild)
+
+# name -> (help, function adding its arguments), in --help order
+commands = {
+  "entry": ("interactive inventory entry", args_entry),
+  "report": ("run one of the standard reports", args_report),
+  "plan": ("which owned relics to crack next", args_plan),
+  "simulate": ("Monte Carlo squad runs until a part (or set) drops",
+    args_simulate),
+  "sets": ("which sets each player can finish from the relics they own",
+    args_sets),
+  "history": ("what players owned when (needs history --init once)",
+    args_history),
+  "search": ("look up relic, prime and part names, typos and all",
+    args_search),
+  "serve": ("local HTTP/JSON API (see relic_api.py)", args_serve),
+  "import": ("load inventory TSV/CSV files", args_import),
+  "export": ("write has_relic out as TSV/CSV", args_export),
+  "export-columns": ("write the catalog and has_relic as .npy columns " +
+    "(see relic_columns.py)", args_export_columns),
+  "update-vaulted": ("refresh vaulted status from the wiki dump", args_update_vaulted),
+  "rebuild": ("rebuild the catalog from the wiki dump", args_rebuild),
+}
+
+def main(argv = None):
+  import argparse
+  parser = argparse.ArgumentParser(prog="wf-relic.py",
+    description="Relic tracker for Warframe")
+  parser.add_argument("--db", default="relics.db")
+  sub = parser.add_subparsers(dest="command", required=True)
+  # only the command being run needs its arguments set up (all of them
+  # for --help or a typo); building every one was most of argparse's
+  # share of start-up
+  if argv is None:
+    argv = sys.argv[1:]
+  chosen = [a for a in argv if a in commands][:1] or list(commands.keys())
+  for name in chosen:
+    (help_text, add_arguments) = commands[name]
+    add_arguments(sub.add_parser(name, help=help_text))
+
+  args = parser.parse_args(argv)
+  global db
+  if args.db != db.path:
+    db = relic_db.ConnectionPool(args.db)
+  try:
+    args.run(args)
+  finally:
+    db.close()
 
 if __name__ == "__main__":
-  pass
-  #update_vaulteds()
-  #connection.commit()
+  main()
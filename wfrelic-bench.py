@@ -0,0 +1,614 @@
+#! /usr/bin/env python3
+# wfrelic-bench.py
+# Benchmarks for the relic tools.
+# parse/memory measurements run in their own child process so peak RSS
+# belongs to that measurement only.
+# --json writes every result out as JSON so runs can be compared.
+
+import argparse, gzip, importlib.util, json, os, platform, random, resource
+import sqlite3, statistics, subprocess, sys, tempfile, time, tracemalloc
+import read_relics, relic_db, synthetic
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(filename):
+    # the hyphenated scripts can't be imported normally, and they open
+    # their default database at import, so do that in a scratch directory
+    name = filename[:-len(".py")].replace("-", "_")
+    old_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            spec = importlib.util.spec_from_file_location(
+                name, os.path.join(here, filename))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        finally:
+            os.chdir(old_cwd)
+    return module
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return (time.perf_counter() - start, result)
+
+def make_dump(path, copies, compress=False):
+    # concatenated copies of the wiki dump, like the ones we get now
+    with open(read_relics.source_table) as infile:
+        text = infile.read()
+    opener = gzip.open if compress else open
+    with opener(path, "wt") as outfile:
+        for _ in range(copies):
+            outfile.write(text)
+            outfile.write("\n")
+
+def child_parse(path, mode):
+    start = time.perf_counter()
+    reg = read_relics.read_relics(path, streaming=(mode == "stream"))
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "mode": mode,
+        "seconds": elapsed,
+        "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "relics": len(reg.relics),
+    }))
+
+def child_memory(n_relics, mode):
+    records = list(synthetic.synthetic_records(int(n_relics)))
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    reg = read_relics.build_registry(
+        records, read_relics.new_registry(compact=(mode == "compact")))
+    if mode == "compact":
+        reg.build_indexes()# count the lookup tables too
+    used = tracemalloc.get_traced_memory()[0] - before
+    n_entries = len(reg.relics) + len(reg.parts) + len(reg.primes)
+    print(json.dumps({
+        "mode": mode,
+        "relics": len(reg.relics),
+        "entries": n_entries,
+        "rewards": len(records),
+        "bytes": used,
+        "bytes_per_entry": used / n_entries,
+    }))
+
+def run_child(*args):
+    out = subprocess.run(
+        [sys.executable, __file__, "--child"] + [str(a) for a in args],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.strip().split("\n")[-1])
+
+def bench_memory(sizes):
+    results = []
+    for n in sizes:
+        for mode in ["dict", "compact"]:
+            results.append(run_child("memory", n, mode))
+    return results
+
+def query_params(db_connection, n, seed=0):
+    # sample parameter sets for the report queries
+    rng = random.Random(seed)
+    players = [r[0] for r in db_connection.execute(
+        "select distinct player from has_relic")]
+    parts = db_connection.execute("select base, role from part").fetchall()
+    params = []
+    for _ in range(n):
+        (base, role) = rng.choice(parts)
+        params.append(
+            {"player": rng.choice(players), "base": base, "role": role})
+    return params
+
+def time_query(db_connection, sql, params):
+    times = []
+    for p in params:
+        start = time.perf_counter()
+        db_connection.execute(sql, p).fetchall()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def bench_queries(n_relics, n_players, repeats):
+    """Times the report queries under each index set, with their plans."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        con = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        synthetic.build_synthetic_db(con, n_relics, n_players, indexes=False)
+        params = query_params(con, repeats)
+        configs = [("pk only", [])] + [("all indexes", list(relic_db.indexes))]
+        configs += [
+            ("all but " + name, [i for i in relic_db.indexes if i != name])
+            for name in relic_db.indexes
+        ]
+        for (config, index_names) in configs:
+            relic_db.drop_indexes(con)
+            for name in index_names:
+                con.execute(relic_db.indexes[name])
+            con.execute("analyze")
+            for (qname, sql) in relic_db.report_queries.items():
+                plan = [r[-1] for r in
+                    con.execute("explain query plan " + sql, params[0])]
+                results.append({
+                    "config": config,
+                    "query": qname,
+                    "median_ms": 1000 * time_query(con, sql, params),
+                    "plan": plan,
+                })
+        con.close()
+    return results
+
+def bench_suite(lines_list, players_list, repeats):
+    """The whole pipeline on synthetic data: parse, rebuild_db, the four
+    update diffs, bulk and one-at-a-time ownership entry, and the
+    report queries."""
+    createdb = load_script("wfrelic-createdb.py")
+    updatedb = load_script("wfrelic-updatedb.py")
+    wfrelic = load_script("wf-relic.py")
+    read_relics.use_cache = False# time the real parse every time
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_lines in lines_list:
+            dump = os.path.join(tmp, "dump_{}.txt".format(n_lines))
+            n_lines = synthetic.write_dump(dump, n_lines)
+            (secs, reg) = timed(read_relics.read_relics, dump)
+            results.append({"bench": "read_relics", "lines": n_lines,
+                "relics": len(reg.relics), "seconds": secs})
+
+            con = sqlite3.connect(os.path.join(tmp, "db_{}.db".format(n_lines)))
+            (secs, _) = timed(createdb.rebuild_db, dump, con.cursor())
+            con.commit()
+            results.append({"bench": "rebuild_db", "lines": n_lines,
+                "seconds": secs})
+
+            for f in ["get_relic_updates", "get_prime_updates",
+                    "get_part_updates", "get_reward_updates"]:
+                (secs, _) = timed(getattr(updatedb, f), reg, con.cursor())
+                results.append({"bench": f, "lines": n_lines, "seconds": secs})
+
+            keys = [(r.era, r.minor_name) for r in reg.relics.values()]
+            # own_one writes through the module's pool
+            wfrelic.db = relic_db.ConnectionPool(
+                os.path.join(tmp, "db_{}.db".format(n_lines)))
+            for n_players in players_list:
+                con.execute("delete from has_relic")
+                con.commit()
+                rows = [
+                    (player, era, minor, quantity, refinement)
+                    for (player, era, minor, refinement, quantity)
+                    in synthetic.synthetic_inventory(keys, n_players)
+                ]
+                (secs, _) = timed(wfrelic.own_many, rows, con)
+                results.append({"bench": "own_many", "lines": n_lines,
+                    "players": n_players, "rows": len(rows), "seconds": secs,
+                    "rows_per_second": len(rows) / secs})
+                sample = [(p, e, m, q + 1, r) for (p, e, m, q, r) in rows[:200]]
+                start = time.perf_counter()
+                for row in sample:
+                    wfrelic.own_one(*row)
+                secs = time.perf_counter() - start
+                results.append({"bench": "own_one", "lines": n_lines,
+                    "players": n_players, "rows": len(sample), "seconds": secs,
+                    "rows_per_second": len(sample) / secs})
+
+                params = query_params(con, repeats)
+                for (qname, sql) in relic_db.report_queries.items():
+                    results.append({"bench": "query", "query": qname,
+                        "lines": n_lines, "players": n_players,
+                        "median_ms": 1000 * time_query(con, sql, params)})
+            wfrelic.db.close()
+            con.close()
+    return results
+
+def run_info():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=here,
+            capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "argv": sys.argv[1:],
+    }
+
+def bench_parse(copies_list, compress):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for copies in copies_list:
+            path = os.path.join(
+                tmp, "dump_{}.txt{}".format(copies, ".gz" if compress else ""))
+            make_dump(path, copies, compress)
+            size = os.path.getsize(path)
+            for mode in ["list", "stream"]:
+                r = run_child("parse", path, mode)
+                r["copies"] = copies
+                r["bytes"] = size
+                results.append(r)
+    return results
+
+def bench_parallel(copies_list, workers_list):
+    """Sequential vs process-pool parsing, checking they build the same
+    registry. The pool is used at every size, parallel_min_bytes or not,
+    so small dumps show where it stops paying off."""
+    results = []
+    # workers=1 is the sequential baseline, already the first row
+    workers_list = sorted(set(w for w in workers_list if w > 1))
+    min_bytes = read_relics.parallel_min_bytes
+    read_relics.parallel_min_bytes = 0
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for copies in copies_list:
+                path = os.path.join(tmp, "dump_{}.txt".format(copies))
+                make_dump(path, copies)
+                (base, seq) = timed(read_relics.read_relics, path)
+                expected = list(seq.records())
+                results.append({"copies": copies,
+                    "bytes": os.path.getsize(path), "workers": 1,
+                    "seconds": base, "speedup": 1.0, "same": True})
+                for workers in workers_list:
+                    (t, reg) = timed(read_relics.read_relics_parallel,
+                        path, workers)
+                    same = list(reg.records()) == expected
+                    if not same:
+                        print("parallel parse with {} workers differs on {}"
+                            .format(workers, path), file=sys.stderr)
+                    results.append({"copies": copies,
+                        "bytes": os.path.getsize(path), "workers": workers,
+                        "seconds": t, "speedup": base / t, "same": same})
+    finally:
+        read_relics.parallel_min_bytes = min_bytes
+    return results
+
+startup_commands = [
+    ["--help"],
+    ["report", "players"],
+    ["report", "inventory", "--player", "player0"],
+]
+
+def bench_startup(repeats):
+    """Wall time of whole wf-relic.py runs, next to a bare interpreter."""
+    def median_run(argv, cwd):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + argv, cwd=cwd, check=True,
+                stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        con = sqlite3.connect(os.path.join(tmp, "relics.db"))
+        synthetic.build_synthetic_db(con, 200, 20)
+        con.close()
+        bare = median_run(["-c", "pass"], tmp)
+        results.append({"command": "python -c pass", "median_ms": bare * 1000,
+            "over_bare_ms": 0.0})
+        for argv in startup_commands:
+            t = median_run([os.path.join(here, "wf-relic.py")] + argv, tmp)
+            results.append({"command": " ".join(argv), "median_ms": t * 1000,
+                "over_bare_ms": (t - bare) * 1000})
+    return results
+
+def bench_rebuild(n_relics, n_players, repeats):
+    """In-place rebuild_catalog vs shadow_rebuild, with a reader thread
+    running a report the whole time and counting what it saw go wrong."""
+    import threading
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "rebuild.db")
+        con = relic_db.connect(path)
+        con.execute("pragma journal_mode = wal")
+        reg = synthetic.build_synthetic_db(con, n_relics, n_players)
+        con.close()
+        sql = relic_db.report_queries["part_owners"]
+        params = {"base": "Synth0 Prime", "role": "Blueprint"}
+        for mode in ["in place", "shadow"] * repeats:
+            stop = threading.Event()
+            seen = {"queries": 0, "errors": 0, "max_ms": 0.0}
+
+            def reader():
+                con = relic_db.connect(path, readonly=True)
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        con.execute(sql, params).fetchall()
+                    except sqlite3.Error:
+                        seen["errors"] += 1
+                    seen["max_ms"] = max(seen["max_ms"],
+                        1000 * (time.perf_counter() - start))
+                    seen["queries"] += 1
+                con.close()
+            thread = threading.Thread(target=reader)
+            thread.start()
+            time.sleep(0.05)
+            if mode == "in place":
+                con = relic_db.connect(path)
+                (secs, _) = timed(relic_db.rebuild_catalog, con.cursor(), reg)
+                con.close()
+            else:
+                (secs, _) = timed(relic_db.shadow_rebuild, path, reg)
+            stop.set()
+            thread.join()
+            results.append(dict({"mode": mode, "relics": n_relics,
+                "players": n_players, "seconds": secs}, **seen))
+    return results
+
+def typo(name, rng):
+    # what a hurried typist does to a name: case, a dropped or doubled
+    # letter, two letters swapped
+    s = list(name.lower())
+    i = rng.randrange(1, len(s) - 1)
+    what = rng.randrange(3)
+    if what == 0:
+        del s[i]
+    elif what == 1:
+        s.insert(i, s[i])
+    else:
+        (s[i], s[i + 1]) = (s[i + 1], s[i])
+    return "".join(s)
+
+def bench_search(relics_list, repeats):
+    """relic_search lookups of mistyped names, on synthetic catalogs."""
+    import relic_search
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_relics in relics_list:
+            con = sqlite3.connect(os.path.join(tmp, "search_{}.db".format(n_relics)))
+            synthetic.build_synthetic_db(con, n_relics, 0)
+            (build, index) = timed(relic_search.catalog_index, con)
+            con.close()
+            rng = random.Random(0)
+            names = [rng.choice(index.names) for _ in range(repeats)]
+            times = []
+            found = 0
+            for name in names:
+                query = typo(name, rng)
+                start = time.perf_counter()
+                best = index.search(query, 5)
+                times.append(time.perf_counter() - start)
+                found += any(n == name for (n, score) in best)
+            times.sort()
+            results.append({"relics": n_relics, "names": len(index),
+                "build_seconds": build,
+                "median_us": 1e6 * statistics.median(times),
+                "p99_us": 1e6 * times[int(0.99 * (len(times) - 1))],
+                "top5_hit_rate": found / len(names)})
+    return results
+
+async def http_request(reader, writer, method, target, headers=(), body=b""):
+    # one request on a keep-alive connection: (status, headers, body)
+    head = ["{} {} HTTP/1.1".format(method, target), "Host: localhost",
+        "Content-Length: {}".format(len(body))] + list(headers)
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    got = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        (name, _, value) = line.decode("latin-1").partition(":")
+        got[name.strip().lower()] = value.strip()
+    data = await reader.readexactly(int(got.get("content-length", "0")))
+    return (status, got, data)
+
+async def load_test(host, port, connections, seconds, write_share, seed=0):
+    import asyncio
+    (reader, writer) = await asyncio.open_connection(host, port)
+    players = json.loads((await http_request(reader, writer, "GET", "/players"))[2])
+    relics = json.loads((await http_request(reader, writer, "GET", "/relics"))[2])
+    parts = set()
+    for r in relics[:50]:
+        (status, got, data) = await http_request(reader, writer, "GET",
+            "/relics/{}/{}".format(r["era"], r["minor"]))
+        parts.update((w["base"], w["role"]) for w in json.loads(data)["rewards"])
+    writer.close()
+    quote = lambda s: s.replace("%", "%25").replace(" ", "%20").replace("/", "%2F")
+    targets = ["/players"] + ["/players/{}/inventory".format(quote(p))
+        for p in players[:200]]
+    targets += ["/relics/{}/{}".format(r["era"], r["minor"]) for r in relics[:200]]
+    targets += ["/parts/{}/{}".format(quote(b), quote(r)) for (b, r) in sorted(parts)]
+    etags = {}
+    latencies = []
+    statuses = {}
+    deadline = time.perf_counter() + seconds
+
+    async def client(n):
+        rng = random.Random(seed * 1000 + n)
+        (reader, writer) = await asyncio.open_connection(host, port)
+        while time.perf_counter() < deadline:
+            if rng.random() < write_share:
+                r = rng.choice(relics)
+                body = json.dumps([{"era": r["era"], "minor": r["minor"],
+                    "refinement": "Intact", "quantity": rng.randint(1, 20)}])
+                request = ("POST", "/players/{}/inventory".format(
+                    quote(rng.choice(players))), (), body.encode("utf-8"))
+            else:
+                target = rng.choice(targets)
+                headers = ["If-None-Match: " + etags[target]] \
+                    if target in etags and rng.random() < 0.5 else []
+                request = ("GET", target, headers, b"")
+            start = time.perf_counter()
+            (status, got, data) = await http_request(reader, writer, *request)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if "etag" in got:
+                etags[request[1]] = got["etag"]
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(n) for n in range(connections)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pct = lambda q: 1000 * latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return {"connections": connections, "requests": len(latencies),
+        "seconds": elapsed, "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": pct(0.5), "p90_ms": pct(0.9), "p99_ms": pct(0.99),
+        "max_ms": 1000 * latencies[-1],
+        "statuses": {str(k): v for (k, v) in sorted(statuses.items())}}
+
+def bench_api(url, connections_list, seconds, write_share, n_relics, n_players):
+    """Concurrent keep-alive clients against a wf-relic.py serve instance,
+    either url or one started here on a synthetic database."""
+    import asyncio
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if url is None:
+            path = os.path.join(tmp, "relics.db")
+            con = sqlite3.connect(path)
+            synthetic.build_synthetic_db(con, n_relics, n_players)
+            con.close()
+            server = subprocess.Popen([sys.executable,
+                os.path.join(here, "wf-relic.py"), "--db", path,
+                "serve", "--port", "0"], stdout=subprocess.PIPE, text=True)
+            url = server.stdout.readline().split()[-1]
+        (host, _, port) = url.split("//")[-1].strip("/").rpartition(":")
+        try:
+            return [asyncio.run(load_test(host, int(port), n, seconds, write_share))
+                for n in connections_list]
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        (what, path, mode) = sys.argv[2:5]
+        if what == "parse":
+            child_parse(path, mode)
+        elif what == "memory":
+            child_memory(path, mode)
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Benchmark wf-relic tools")
+    parser.add_argument("--json", metavar="PATH",
+        help="also write results (and run info) as JSON, - for stdout")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p_parse = sub.add_parser("parse",
+        help="list vs streaming read_relics, wall time and peak RSS")
+    p_parse.add_argument("--copies", type=int, nargs="+",
+        default=[1, 10, 100, 500])
+    p_parse.add_argument("--gzip", action="store_true",
+        help="compress the generated dumps")
+    p_memory = sub.add_parser("memory",
+        help="registry memory, dict-backed vs compact, synthetic catalogs")
+    p_memory.add_argument("--relics", type=int, nargs="+",
+        default=[1000, 10000, 100000])
+    p_queries = sub.add_parser("queries",
+        help="report queries with and without each index, plus their plans")
+    p_queries.add_argument("--relics", type=int, default=2000)
+    p_queries.add_argument("--players", type=int, default=5000)
+    p_queries.add_argument("--repeats", type=int, default=20)
+    p_queries.add_argument("--plans", action="store_true",
+        help="print EXPLAIN QUERY PLAN output too")
+    p_suite = sub.add_parser("suite",
+        help="everything, end to end, on synthetic dumps and inventories")
+    p_suite.add_argument("--lines", type=int, nargs="+",
+        default=[10000, 100000], help="dump sizes (10k to 1M)")
+    p_suite.add_argument("--players", type=int, nargs="+",
+        default=[1, 1000, 10000], help="inventory sizes (1 to 100k)")
+    p_suite.add_argument("--repeats", type=int, default=20)
+    p_parallel = sub.add_parser("parallel",
+        help="sequential vs process-pool parse, and that they agree")
+    p_parallel.add_argument("--copies", type=int, nargs="+",
+        default=[100, 500])
+    p_parallel.add_argument("--workers", type=int, nargs="+",
+        default=[2, os.cpu_count() or 1])
+    p_startup = sub.add_parser("startup",
+        help="wf-relic.py start-up time for the read-only commands")
+    p_startup.add_argument("--repeats", type=int, default=20)
+    p_rebuild = sub.add_parser("rebuild",
+        help="in-place vs shadow catalog rebuild, under a concurrent reader")
+    p_rebuild.add_argument("--relics", type=int, default=5000)
+    p_rebuild.add_argument("--players", type=int, default=5000)
+    p_rebuild.add_argument("--repeats", type=int, default=2)
+    p_search = sub.add_parser("search",
+        help="fuzzy name lookups of mistyped names (relic_search)")
+    p_search.add_argument("--relics", type=int, nargs="+",
+        default=[2000, 20000])
+    p_search.add_argument("--repeats", type=int, default=2000)
+    p_api = sub.add_parser("api",
+        help="load test the HTTP API with concurrent keep-alive clients")
+    p_api.add_argument("--url",
+        help="a running wf-relic.py serve (default: start one on synthetic data)")
+    p_api.add_argument("--connections", type=int, nargs="+", default=[10, 200])
+    p_api.add_argument("--seconds", type=float, default=10.0)
+    p_api.add_argument("--writes", type=float, default=0.05,
+        help="share of requests that are inventory upserts")
+    p_api.add_argument("--relics", type=int, default=2000)
+    p_api.add_argument("--players", type=int, default=5000)
+    args = parser.parse_args()
+
+    # human-readable goes to stderr when the JSON is going to stdout
+    out = sys.stderr if args.json == "-" else sys.stdout
+    if args.bench == "parse":
+        results = bench_parse(args.copies, args.gzip)
+        print("copies\tbytes\tmode\tseconds\tmaxrss_kb", file=out)
+        for r in results:
+            print("{copies}\t{bytes}\t{mode}\t{seconds:.3f}\t{maxrss_kb}"
+                .format(**r), file=out)
+    elif args.bench == "memory":
+        results = bench_memory(args.relics)
+        print("relics\tentries\tmode\tbytes\tbytes_per_entry", file=out)
+        for r in results:
+            print("{relics}\t{entries}\t{mode}\t{bytes}\t{bytes_per_entry:.0f}"
+                .format(**r), file=out)
+    elif args.bench == "queries":
+        results = bench_queries(args.relics, args.players, args.repeats)
+        print("config\tquery\tmedian_ms", file=out)
+        for r in results:
+            print("{config}\t{query}\t{median_ms:.3f}".format(**r), file=out)
+            if args.plans:
+                print("\t" + "\n\t".join(r["plan"]), file=out)
+    elif args.bench == "parallel":
+        results = bench_parallel(args.copies, args.workers)
+        print("copies\tbytes\tworkers\tseconds\tspeedup\tsame", file=out)
+        for r in results:
+            print("{copies}\t{bytes}\t{workers}\t{seconds:.3f}\t{speedup:.2f}\t{same}"
+                .format(**r), file=out)
+        if not all(r["same"] for r in results):
+            sys.exit(1)
+    elif args.bench == "startup":
+        results = bench_startup(args.repeats)
+        print("command\tmedian_ms\tover_bare_ms", file=out)
+        for r in results:
+            print("{command}\t{median_ms:.1f}\t{over_bare_ms:.1f}"
+                .format(**r), file=out)
+    elif args.bench == "rebuild":
+        results = bench_rebuild(args.relics, args.players, args.repeats)
+        print("mode\tseconds\treader_queries\treader_errors\treader_max_ms", file=out)
+        for r in results:
+            print("{mode}\t{seconds:.2f}\t{queries}\t{errors}\t{max_ms:.1f}"
+                .format(**r), file=out)
+    elif args.bench == "search":
+        results = bench_search(args.relics, args.repeats)
+        print("relics\tnames\tbuild_s\tmedian_us\tp99_us\ttop5_hit_rate", file=out)
+        for r in results:
+            print(("{relics}\t{names}\t{build_seconds:.2f}\t{median_us:.0f}" +
+                "\t{p99_us:.0f}\t{top5_hit_rate:.3f}").format(**r), file=out)
+    elif args.bench == "api":
+        results = bench_api(args.url, args.connections, args.seconds,
+            args.writes, args.relics, args.players)
+        print("connections\trequests\treq_per_s\tp50_ms\tp90_ms\tp99_ms\tmax_ms\tstatuses",
+            file=out)
+        for r in results:
+            print(("{connections}\t{requests}\t{requests_per_second:.0f}\t{p50_ms:.2f}" +
+                "\t{p90_ms:.2f}\t{p99_ms:.2f}\t{max_ms:.1f}\t{statuses}").format(**r),
+                file=out)
+    elif args.bench == "suite":
+        results = bench_suite(args.lines, args.players, args.repeats)
+        for r in results:
+            print("\t".join("{}={}".format(k, round(v, 4)
+                if isinstance(v, float) else v) for (k, v) in r.items()),
+                file=out)
+
+    if args.json is not None:
+        doc = {"run": run_info(), "bench": args.bench, "results": results}
+        if args.json == "-":
+            json.dump(doc, sys.stdout, indent=1)
+            print()
+        else:
+            with open(args.json, "w") as outfile:
+                json.dump(doc, outfile, indent=1)